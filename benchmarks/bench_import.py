@@ -0,0 +1,97 @@
+"""Tiempo de importación del arranque de la app (`python -X importtime`).
+
+Importa en un proceso limpio los mismos módulos que `main.py` importa al inicio (se leen
+de su AST, así que la lista no se desincroniza), imprime los módulos más caros y verifica
+que la pila de PDF no se cargue antes de pintar el formulario.
+
+Uso::
+
+    python -m benchmarks.bench_import                  # desglose
+    python -m benchmarks.bench_import --max-ms 150     # falla si ficha.* tarda más que esto
+
+Termina con código 1 si algún módulo prohibido (ReportLab, PyPDF2, Pillow) se importa
+durante el arranque o si se excede el presupuesto de tiempo.
+"""
+import argparse
+import ast
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN = os.path.join(ROOT, "main.py")
+
+# Solo deben cargarse al generar el PDF (o en la precarga en segundo plano)
+FORBIDDEN = ("reportlab", "PyPDF2", "PIL")
+
+
+def startup_modules(path=MAIN) -> list:
+    """Módulos importados a nivel de módulo en `main.py`."""
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), path)
+    mods = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            mods += [a.name for a in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            mods.append(node.module)
+    return list(dict.fromkeys(mods))
+
+
+def importtime(modules) -> list:
+    """Regresa [(módulo, propio µs, acumulado µs, profundidad)] de importar `modules` en frío."""
+    code = "; ".join(f"import {m}" for m in modules)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cum_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(self_us), int(cum_us), depth))
+    return rows
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Desglose de -X importtime del arranque de la app.")
+    parser.add_argument("--top", type=int, default=15, help="Cuántos módulos mostrar (default: 15)")
+    parser.add_argument("--max-ms", type=float, default=None,
+                        help="Presupuesto (ms) para los módulos ficha.* importados al arranque")
+    args = parser.parse_args(argv)
+
+    modules = startup_modules()
+    rows = importtime(modules)
+    # Primer nivel: lo que cuesta cada import directo de main.py (incluye sus dependencias);
+    # se descartan los módulos que el intérprete carga antes (site, encodings, ...)
+    roots = {m.split(".")[0] for m in modules}
+    top_level = [r for r in rows if r[3] == 0 and r[0].split(".")[0] in roots]
+    total_ms = sum(r[2] for r in top_level) / 1000
+    ours_ms = sum(r[2] for r in top_level if r[0].split(".")[0] == "ficha") / 1000
+
+    print(f"Arranque de main.py: {len(modules)} imports, {total_ms:.1f} ms ({ours_ms:.1f} ms en ficha.*)")
+    print(f"{'módulo':<45}{'propio':>10}{'acumulado':>12}")
+    for name, self_us, cum_us, _ in sorted(top_level, key=lambda r: -r[2])[:args.top]:
+        print(f"{name:<45}{self_us / 1000:>7.1f} ms{cum_us / 1000:>9.1f} ms")
+
+    problems = []
+    for i, (name, _, _, _) in enumerate(rows):
+        if name in FORBIDDEN:
+            # -X importtime lista cada módulo antes que quien lo importó: el siguiente de
+            # profundidad 0 es el import de main.py responsable
+            culprit = next((r[0] for r in rows[i:] if r[3] == 0), name)
+            problems.append(f"{name} se importa al arranque (vía {culprit})")
+    if args.max_ms is not None and ours_ms > args.max_ms:
+        problems.append(f"ficha.* tarda {ours_ms:.1f} ms (presupuesto {args.max_ms:.1f} ms)")
+    if problems:
+        for p in problems:
+            print(f"FALLA: {p}", file=sys.stderr)
+        return 1
+    print("Sin módulos prohibidos en el arranque.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,50 @@
+"""Tamaño y tiempo de la optimización del PDF final (`ficha.optimize`) por paso.
+
+Arma PDFs finales sintéticos (ficha máxima + fotos, PNGs y PDFs anexos, algunos
+repetidos), los pasa por `optimize_pdf` y reporta cada paso: lectura, deduplicación,
+escritura sin pérdida y, con --max-mb, cada calidad probada hasta caber.
+
+Uso::
+
+    python -m benchmarks.bench_optimize
+    python -m benchmarks.bench_optimize --max-mb 1.5
+"""
+import argparse
+import io
+import sys
+
+from benchmarks.fixtures import Upload, image_bytes, maximal_data, pdf_bytes
+from ficha.pdf import build_pdf_with_attachments
+from ficha.optimize import optimize_pdf
+
+
+def cases():
+    yield "ficha sola", []
+    yield "3 fotos de 4 MP", [Upload(f"foto{i}.jpg", image_bytes(4 + i)) for i in range(3)]
+    yield "foto repetida x3", [Upload(f"foto{i}.jpg", image_bytes(4)) for i in range(3)]
+    yield "PNG + PDF 20 págs.", [Upload("captura.png", image_bytes(2, "PNG")), Upload("labs.pdf", pdf_bytes(20))]
+    yield "mixto (8 anexos)", [Upload(f"foto{i}.jpg", image_bytes(2 + i % 3)) for i in range(5)] + [
+        Upload(f"labs{i}.pdf", pdf_bytes(5)) for i in range(3)]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Optimización del PDF final por paso.")
+    parser.add_argument("--max-mb", type=float, default=None, help="Modo de tamaño objetivo (MB)")
+    args = parser.parse_args(argv)
+    target = int(args.max_mb * 1024 * 1024) if args.max_mb else None
+
+    for name, uploads in cases():
+        merged = build_pdf_with_attachments(maximal_data(), uploads)
+        steps = optimize_pdf(merged, io.BytesIO(), target_bytes=target)
+        final = steps[-1].bytes_out
+        print(f"{name}: {len(merged) / 1024:.0f} KB -> {final / 1024:.0f} KB "
+              f"({100 * (1 - final / len(merged)):.0f} % menos)")
+        for s in steps:
+            label = f"{s.step} {s.quality}" if s.quality else s.step
+            size = f"{s.bytes_out / 1024:10.0f} KB" if s.bytes_out else " " * 13
+            print(f"  {label:<14}{size}{s.seconds * 1000:10.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
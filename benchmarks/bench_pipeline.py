@@ -0,0 +1,173 @@
+"""Benchmark y regresión de memoria del pipeline de PDF.
+
+Mide `build_base_pdf`, `image_to_pdf_page`, `merge_pdfs` y `build_pdf_with_attachments`
+con entradas sintéticas (fichas mínima/máxima, 1–100 medicamentos, imágenes de 0.3 a
+50 MP, PDFs de 1 a 500 páginas). Para cada caso registra tiempo (mediana), throughput,
+tamaño de salida y pico de memoria (tracemalloc y RSS).
+
+Uso::
+
+    python -m benchmarks.bench_pipeline                      # todos los casos
+    python -m benchmarks.bench_pipeline --quick -k base      # sin los casos pesados, filtrados
+    python -m benchmarks.bench_pipeline --save baseline.json
+    python -m benchmarks.bench_pipeline --compare baseline.json --threshold 0.25
+
+Con --compare el proceso termina con código 1 si algún caso empeora más que el umbral
+en tiempo o en pico de memoria respecto a la línea base.
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+
+from benchmarks.fixtures import Upload, image_bytes, maximal_data, medications, minimal_data, pdf_bytes
+from ficha.memory import MemoryProbe
+from ficha.pdf import build_base_pdf, build_pdf_with_attachments, image_to_pdf_page, merge_pdfs
+
+# Diferencias menores a esto se consideran ruido aunque superen el umbral relativo
+MIN_TIME_DELTA = 0.002  # s
+MIN_MEM_DELTA = 256 * 1024  # bytes
+
+
+class Case:
+    """Un caso: `make()` prepara las entradas y regresa la función a medir (sin argumentos).
+
+    `units` es cuántas unidades procesa cada llamada (páginas, MB, fichas) para el throughput.
+    """
+
+    def __init__(self, name, make, units=1.0, unit="ops", heavy=False):
+        self.name = name
+        self.make = make
+        self.units = units
+        self.unit = unit
+        self.heavy = heavy
+
+
+def _base(data):
+    return lambda: (lambda: build_base_pdf(data, generated_at="—"))
+
+
+def _image(mp):
+    def make():
+        b = image_bytes(mp)
+        return lambda: image_to_pdf_page(b, f"foto_{mp}mp.jpg")
+    return make
+
+
+def _merge(pages):
+    def make():
+        parts = [build_base_pdf(minimal_data(), generated_at="—"), pdf_bytes(pages)]
+        return lambda: merge_pdfs(parts)
+    return make
+
+
+def _full(images, pdf_pages):
+    def make():
+        data = maximal_data(meds=20, anexos=images + len(pdf_pages))
+        uploads = [("foto_%d.jpg" % i, image_bytes(12)) for i in range(images)]
+        uploads += [("labs_%d.pdf" % i, pdf_bytes(p)) for i, p in enumerate(pdf_pages)]
+        return lambda: build_pdf_with_attachments(data, [Upload(n, b) for n, b in uploads])
+    return make
+
+
+CASES = [
+    Case("base/minima", _base(minimal_data()), unit="fichas"),
+    Case("base/maxima", _base(maximal_data()), unit="fichas"),
+    *[Case(f"base/meds_{n}", _base({"Medicamentos": medications(n)}), unit="fichas") for n in (1, 10, 100)],
+    *[Case(f"image/{mp}mp", _image(mp), units=mp, unit="MP", heavy=mp >= 50) for mp in (0.3, 2, 12, 50)],
+    *[Case(f"merge/{p}p", _merge(p), units=p + 1, unit="páginas", heavy=p >= 500) for p in (1, 50, 500)],
+    Case("full/3img+2pdf", _full(3, (5, 50)), unit="fichas"),
+    Case("full/10img+1pdf300", _full(10, (300,)), unit="fichas", heavy=True),
+]
+
+
+def run_case(case, min_time=0.5, max_repeat=50):
+    fn = case.make()
+    out = fn()  # calentamiento (importaciones, cachés de texto)
+
+    times = []
+    t_end = time.perf_counter() + min_time
+    while len(times) < max_repeat and (not times or time.perf_counter() < t_end):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    seconds = statistics.median(times)
+
+    with MemoryProbe(traced=True) as mem:
+        fn()
+
+    return {
+        "seconds": seconds,
+        "repeats": len(times),
+        "throughput": case.units / seconds if seconds else 0.0,
+        "unit": case.unit,
+        "out_bytes": len(out),
+        "peak_traced": mem.peak_traced,
+        "peak_rss": mem.peak_rss,
+    }
+
+
+def compare(results, baseline, threshold):
+    """Regresa la lista de regresiones (texto) de `results` contra `baseline`."""
+    problems = []
+    for name, cur in results.items():
+        old = baseline.get(name)
+        if not old:
+            continue
+        dt = cur["seconds"] - old["seconds"]
+        if dt > MIN_TIME_DELTA and cur["seconds"] > old["seconds"] * (1 + threshold):
+            problems.append(f"{name}: tiempo {old['seconds'] * 1000:.1f} -> {cur['seconds'] * 1000:.1f} ms")
+        dm = cur["peak_traced"] - old["peak_traced"]
+        if dm > MIN_MEM_DELTA and cur["peak_traced"] > old["peak_traced"] * (1 + threshold):
+            problems.append(
+                f"{name}: memoria {old['peak_traced'] / 2**20:.1f} -> {cur['peak_traced'] / 2**20:.1f} MB"
+            )
+    return problems
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark del pipeline de PDF.")
+    parser.add_argument("-k", dest="pattern", default="", help="Solo casos cuyo nombre contenga este texto")
+    parser.add_argument("--quick", action="store_true", help="Omite los casos pesados (50 MP, 500 páginas)")
+    parser.add_argument("--min-time", type=float, default=0.5, help="Segundos mínimos de medición por caso")
+    parser.add_argument("--save", metavar="JSON", help="Guarda los resultados como línea base")
+    parser.add_argument("--compare", metavar="JSON", help="Compara contra una línea base guardada")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Regresión relativa tolerada en tiempo y memoria (default: 0.25 = 25%%)")
+    args = parser.parse_args(argv)
+
+    cases = [c for c in CASES if args.pattern in c.name and not (args.quick and c.heavy)]
+    results = {}
+    print(f"{'caso':<22}{'tiempo':>11}{'throughput':>22}{'salida':>11}{'tracemalloc':>13}{'RSS':>10}")
+    for case in cases:
+        r = results[case.name] = run_case(case, min_time=args.min_time)
+        print(
+            f"{case.name:<22}{r['seconds'] * 1000:>8.1f} ms"
+            f"{r['throughput']:>12.1f} {r['unit'] + '/s':<9}"
+            f"{r['out_bytes'] / 1024:>8.0f} KB"
+            f"{r['peak_traced'] / 2**20:>10.1f} MB"
+            f"{r['peak_rss'] / 2**20:>7.1f} MB",
+            flush=True,
+        )
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Línea base guardada en {args.save}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        problems = compare(results, baseline, args.threshold)
+        if problems:
+            print(f"REGRESIONES (umbral {args.threshold:.0%}):", file=sys.stderr)
+            for p in problems:
+                print(f"  {p}", file=sys.stderr)
+            return 1
+        print(f"Sin regresiones respecto a {args.compare} (umbral {args.threshold:.0%}).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
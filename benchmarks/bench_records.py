@@ -0,0 +1,131 @@
+"""Latencia de búsqueda y carga de fichas guardadas (`ficha.records`) a gran escala.
+
+Llena una base temporal con N fichas sintéticas (guardadas con `save_many`, en lotes),
+y mide sobre pacientes al azar: búsqueda por CURP, por teléfono, por prefijo de nombre,
+por texto libre (FTS5) y la carga del `data` completo. Reporta p50/p95/máximo.
+
+Uso::
+
+    python -m benchmarks.bench_records                    # 100 000 fichas
+    python -m benchmarks.bench_records -n 20000 --queries 500
+    python -m benchmarks.bench_records --db fichas.sqlite  # reutiliza/crea esa base
+
+Con --max-ms el proceso termina con código 1 si el p95 de alguna búsqueda lo excede.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from ficha.records import RecordStore
+
+_NOMBRES = ("María", "José", "Juan", "Guadalupe", "Francisco", "Rosa", "Antonio", "Carmen", "Jesús",
+            "Ana", "Luis", "Josefina", "Pedro", "Teresa", "Miguel", "Sofía", "Héctor", "Elena")
+_APELLIDOS = ("Hernández", "García", "Martínez", "López", "González", "Pérez", "Rodríguez", "Sánchez",
+              "Ramírez", "Cruz", "Flores", "Gómez", "Morales", "Vázquez", "Jiménez", "Reyes", "Díaz",
+              "Torres", "Gutiérrez", "Ruiz", "Mendoza", "Aguilar", "Ortiz", "Castillo", "Núñez")
+_TEXTO = ("hipertensión control diario revisión mensual ajuste dosis glucosa ayunas metformina "
+          "losartán alergia penicilina exantema caída previa marcapasos insulina prótesis parcial "
+          "colecistectomía apendicectomía fractura cadera catarata retinopatía neuropatía").split()
+
+
+def synthetic(i, rnd) -> dict:
+    nombre = f"{rnd.choice(_NOMBRES)} {rnd.choice(_APELLIDOS)} {rnd.choice(_APELLIDOS)}"
+    letters = "".join(rnd.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ") for _ in range(4))
+    curp = f"{letters}{rnd.randint(0, 999999):06d}{'HM'[i % 2]}DF{letters[:3]}{i % 100:02d}"[:18]
+    texto = lambda n: " ".join(rnd.choice(_TEXTO) for _ in range(n))  # noqa: E731
+    return {
+        "Fecha de elaboración": f"20{rnd.randint(20, 26)}-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}",
+        "Nombre completo": nombre,
+        "CURP": curp,
+        "Teléfono del paciente": f"55 {rnd.randint(1000, 9999)} {i % 10000:04d}",
+        "Teléfono de contacto": f"+52 33{rnd.randint(10000000, 99999999)}",
+        "Domicilio": f"Calle {rnd.choice(_APELLIDOS)} {rnd.randint(1, 999)}, Col. Centro",
+        "Contacto de emergencia": f"{rnd.choice(_NOMBRES)} {rnd.choice(_APELLIDOS)}",
+        "Enfermedades": ["Hipertensión", "Diabetes"][: rnd.randint(0, 2)],
+        "Otros relevantes": texto(8),
+        "Cirugías/hospitalizaciones": texto(12),
+        "Medicamentos": [
+            {"nombre": rnd.choice(("Metformina", "Losartán", "Insulina", "Aspirina")), "dosis": "50 mg",
+             "frecuencia": "c/12h", "para_que": texto(3)}
+            for _ in range(rnd.randint(0, 6))
+        ],
+        "Cuáles y reacción": texto(4),
+    }
+
+
+def _percentiles(samples):
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    return statistics.median(samples) * 1000, p95 * 1000, samples[-1] * 1000
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Latencia de búsqueda de fichas guardadas.")
+    parser.add_argument("-n", type=int, default=100_000, help="Fichas en la base (default: 100000)")
+    parser.add_argument("--queries", type=int, default=1000, help="Búsquedas por tipo (default: 1000)")
+    parser.add_argument("--batch", type=int, default=1000, help="Fichas por transacción al llenar")
+    parser.add_argument("--db", default=None, help="Base a usar (default: una temporal)")
+    parser.add_argument("--max-ms", type=float, default=None, help="Falla si algún p95 excede esto (ms)")
+    args = parser.parse_args(argv)
+
+    tmp = None
+    if args.db is None:
+        tmp = tempfile.TemporaryDirectory(prefix="ficha-bench-")
+        args.db = os.path.join(tmp.name, "fichas.sqlite")
+    store = RecordStore(args.db)
+    rnd = random.Random(0)
+
+    missing = args.n - store.count()
+    if missing > 0:
+        t0 = time.perf_counter()
+        store.save_many((synthetic(i, rnd) for i in range(missing)), batch=args.batch)
+        elapsed = time.perf_counter() - t0
+        print(f"Guardadas {missing} fichas en {elapsed:.1f}s ({missing / elapsed:.0f} fichas/s, "
+              f"lotes de {args.batch}); base: {os.path.getsize(args.db) / 1024 / 1024:.0f} MB")
+
+    # Pacientes reales de la base para las búsquedas
+    sample = [store.load(rid) for rid in rnd.sample(range(1, store.count() + 1), min(args.queries, store.count()))]
+    ids = rnd.sample(range(1, store.count() + 1), len(sample))
+    cases = {
+        "CURP": [d["CURP"] for d in sample],
+        "teléfono": [d["Teléfono del paciente"] for d in sample],
+        "nombre (prefijo)": [d["Nombre completo"][: rnd.randint(4, 12)] for d in sample],
+        "texto libre": [" ".join(d["Cirugías/hospitalizaciones"].split()[:2]) for d in sample],
+    }
+
+    print(f"{'búsqueda':<20}{'p50':>10}{'p95':>10}{'máx':>10}{'resultados':>12}")
+    problems = []
+    for name, queries in cases.items():
+        times, found = [], 0
+        for q in queries:
+            t0 = time.perf_counter()
+            found += len(store.search(q))
+            times.append(time.perf_counter() - t0)
+        p50, p95, worst = _percentiles(times)
+        print(f"{name:<20}{p50:>8.2f}ms{p95:>8.2f}ms{worst:>8.2f}ms{found / len(queries):>12.1f}")
+        if args.max_ms is not None and p95 > args.max_ms:
+            problems.append(f"{name}: p95 {p95:.2f} ms > {args.max_ms:.2f} ms")
+
+    times = []
+    for rid in ids:
+        t0 = time.perf_counter()
+        store.load(rid)
+        times.append(time.perf_counter() - t0)
+    p50, p95, worst = _percentiles(times)
+    print(f"{'cargar ficha':<20}{p50:>8.2f}ms{p95:>8.2f}ms{worst:>8.2f}ms{1:>12.1f}")
+
+    if tmp is not None:
+        tmp.cleanup()
+    if problems:
+        for p in problems:
+            print(f"FALLA: {p}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
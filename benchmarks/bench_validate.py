@@ -0,0 +1,95 @@
+"""Latencia de la validación temprana de anexos (`ficha.validate`) y render con anexos hostiles.
+
+Para cada caso (válidos y dañados: PDF corrupto o con contraseña, PNG "bomba de
+descompresión", imagen truncada, extensión equivocada) mide `validate_attachment`, que
+solo lee encabezados, y reporta el veredicto. Después genera un PDF con todos juntos
+(skip_invalid=True) y lista los anexos omitidos.
+
+Uso::
+
+    python -m benchmarks.bench_validate
+    python -m benchmarks.bench_validate --workers 4
+"""
+import argparse
+import io
+import statistics
+import struct
+import sys
+import time
+import zlib
+
+from benchmarks.fixtures import Upload, image_bytes, maximal_data, pdf_bytes
+from ficha.errors import AttachmentError
+from ficha.pdf import write_pdf_with_attachments
+from ficha.validate import validate_attachment
+
+
+def _png_bomb(width, height) -> bytes:
+    """PNG gris de width x height en ceros: unos KB comprimido, width*height bytes al decodificar."""
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+    comp = zlib.compressobj(9)
+    row = b"\0" * (width + 1)
+    idat = b"".join(comp.compress(row) for _ in range(height)) + comp.flush()
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", ihdr) + chunk(b"IDAT", idat) + chunk(b"IEND", b"")
+
+
+def _encrypted_pdf() -> bytes:
+    from PyPDF2 import PdfReader, PdfWriter
+
+    writer = PdfWriter()
+    for page in PdfReader(io.BytesIO(pdf_bytes(2))).pages:
+        writer.add_page(page)
+    writer.encrypt("secreto")
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+def cases():
+    yield Upload("foto 12 MP.jpg", image_bytes(12))
+    yield Upload("captura.png", image_bytes(2, "PNG"))
+    yield Upload("labs 200 págs.pdf", pdf_bytes(200))
+    yield Upload("foto_con_extension.pdf", image_bytes(2))
+    yield Upload("dañado.pdf", b"%PDF-1.4\n" + bytes(range(256)) * 200)
+    yield Upload("con_contraseña.pdf", _encrypted_pdf())
+    yield Upload("bomba 400 MP.png", _png_bomb(20000, 20000))
+    yield Upload("truncada.jpg", image_bytes(4)[:20000])
+    yield Upload("notas.txt", b"no es un anexo")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Validación temprana de anexos.")
+    parser.add_argument("--workers", type=int, default=None, help="Procesos del pool al generar")
+    parser.add_argument("--repeat", type=int, default=20, help="Repeticiones por caso (default: 20)")
+    args = parser.parse_args(argv)
+
+    uploads = list(cases())
+    print(f"{'anexo':<26}{'mediana':>10}  veredicto")
+    for uf in uploads:
+        times = []
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            try:
+                info = validate_attachment(uf.name, uf.getvalue())
+                verdict = f"{info.kind} ({info.format}, {info.pages or info.pixels / 1e6:.0f}"
+                verdict += " págs.)" if info.pages else " MP)"
+            except AttachmentError as e:
+                verdict = f"rechazado: {e.reason}"
+            times.append(time.perf_counter() - t0)
+        print(f"{uf.name:<26}{statistics.median(times) * 1000:>8.2f}ms  {verdict}")
+
+    t0 = time.perf_counter()
+    out = io.BytesIO()
+    skipped = write_pdf_with_attachments(out, maximal_data(), uploads, workers=args.workers, skip_invalid=True)
+    print(f"\nPDF con los {len(uploads)} anexos: {time.perf_counter() - t0:.2f}s, "
+          f"{len(out.getvalue()) / 1024:.0f} KB, {len(skipped)} omitidos")
+    for e in skipped:
+        print(f"  {e.name}: {e.reason}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
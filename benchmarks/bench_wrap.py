@@ -0,0 +1,82 @@
+"""Micro-benchmark: partido de texto con `simpleSplit` vs. el motor memoizado de ficha.text.
+
+Uso::
+
+    python -m benchmarks.bench_wrap [-n REPETICIONES]
+
+Mide el costo de partir los textos de una ficha típica (etiqueta + valor) con la ruta
+original (`simpleSplit` sobre "etiqueta: valor"), con el motor en frío (cachés vacíos) y
+en caliente (segundo render en adelante), y verifica que las líneas sean idénticas.
+"""
+import argparse
+import random
+import time
+
+from reportlab.lib.utils import simpleSplit
+
+from ficha import text
+from ficha.template import MAX_W, Label, wrap_field
+
+FONT, SIZE = "Helvetica", 10
+
+OPTIONS = ["", "No", "Sí", "No sabe", "—", "Camina solo", "Con bastón", "Independiente", "Requiere ayuda",
+           "Conservada", "Olvidos leves", "A término sin complicaciones", "Parcial", "Superior"]
+WORDS = ("hipertensión control diario con revisión mensual ajuste de dosis según glucosa en ayunas "
+         "metformina losartán 50 mg cada 12 horas alergia penicilina exantema").split()
+
+
+def sample_fields(n_fields=90, seed=0):
+    """Pares (etiqueta, valor) parecidos a los de una ficha real: mayoría de opciones cortas."""
+    rnd = random.Random(seed)
+    fields = []
+    for i in range(n_fields):
+        label = f"Campo de la ficha número {i % 45}"
+        if rnd.random() < 0.75:
+            value = rnd.choice(OPTIONS)
+        else:
+            value = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(5, 60)))
+        fields.append((label, value or "—"))
+    return fields
+
+
+def _bench(fn, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t0) / repeat
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--repeat", type=int, default=200, help="Renders simulados por caso")
+    args = parser.parse_args(argv)
+
+    fields = sample_fields()
+    labels = {label: Label(label) for label, _ in fields}
+
+    def original():
+        return [simpleSplit(f"{label}: {value}", FONT, SIZE, MAX_W) for label, value in fields]
+
+    def engine():
+        return [list(wrap_field(labels[label], value)) for label, value in fields]
+
+    assert original() == engine(), "el motor no reproduce las líneas de simpleSplit"
+
+    def cold():
+        text.clear_caches()
+        engine()
+
+    t_orig = _bench(original, args.repeat)
+    t_cold = _bench(cold, max(1, args.repeat // 10))
+    engine()
+    t_warm = _bench(engine, args.repeat)
+
+    print(f"{len(fields)} campos por ficha, {args.repeat} repeticiones")
+    print(f"{'simpleSplit (actual)':<24}{t_orig * 1000:8.3f} ms/ficha")
+    print(f"{'motor en frío':<24}{t_cold * 1000:8.3f} ms/ficha  ({t_orig / t_cold:4.1f}x)")
+    print(f"{'motor en caliente':<24}{t_warm * 1000:8.3f} ms/ficha  ({t_orig / t_warm:4.1f}x)")
+    print(f"cachés: {text.cache_info()['wrap_continued']}")
+
+
+if __name__ == "__main__":
+    main()
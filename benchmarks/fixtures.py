@@ -0,0 +1,91 @@
+"""Entradas sintéticas para los benchmarks: fichas, imágenes y PDFs de tamaño controlado."""
+import io
+import random
+from functools import lru_cache
+
+from PIL import Image, ImageDraw
+from PyPDF2 import PdfReader, PdfWriter
+
+from ficha.pdf import build_base_pdf
+from ficha.template import FICHA
+
+_WORDS = ("hipertensión control diario con revisión mensual ajuste de dosis según glucosa en ayunas "
+          "metformina losartán cada 12 horas alergia penicilina exantema caída previa").split()
+
+
+def _field_keys(steps=FICHA):
+    for step in steps:
+        if step[0] == "field" and isinstance(step[2], str):
+            yield step[2]
+        elif step[0] == "when":
+            yield from _field_keys(step[2])
+
+
+def minimal_data() -> dict:
+    return {}
+
+
+def maximal_data(meds=20, anexos=10, seed=0) -> dict:
+    """Todos los campos llenos (mezcla de opciones cortas y texto libre largo), sexo femenino."""
+    rnd = random.Random(seed)
+    data = {}
+    for i, key in enumerate(_field_keys()):
+        if i % 4 == 0:
+            data[key] = " ".join(rnd.choice(_WORDS) for _ in range(rnd.randint(10, 60)))
+        else:
+            data[key] = rnd.choice(["No", "Sí", "No sabe"])
+    data["Sexo"] = "Femenino"
+    data["Enfermedades"] = ["Hipertensión", "Diabetes", "EPOC/asma"]
+    data["Riesgo meds"] = ["Anticoagulantes", "Insulina/hipoglucemiantes"]
+    data["Medicamentos"] = medications(meds, seed)
+    data["Anexos"] = [f"analisis_{i}.pdf" for i in range(anexos)]
+    return data
+
+
+def medications(n, seed=0) -> list:
+    rnd = random.Random(seed)
+    return [
+        {
+            "nombre": f"Medicamento {i}",
+            "dosis": f"{rnd.choice([5, 10, 50, 100])} mg",
+            "frecuencia": rnd.choice(["c/8h", "c/12h", "c/24h"]),
+            "para_que": " ".join(rnd.choice(_WORDS) for _ in range(rnd.randint(1, 12))),
+        }
+        for i in range(1, n + 1)
+    ]
+
+
+@lru_cache(maxsize=None)
+def image_bytes(megapixels: float, fmt="JPEG") -> bytes:
+    """Imagen tipo "foto de un resultado": fondo claro con renglones de texto simulados."""
+    w = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    h = int(w * 3 / 4)
+    img = Image.new("RGB", (w, h), (235, 232, 225))
+    draw = ImageDraw.Draw(img)
+    step = max(8, h // 60)
+    for y in range(step, h - step, step):
+        draw.rectangle([w // 20, y, w - w // 20 - (y * 7) % (w // 3), y + step // 3], fill=(60, 60, 70))
+    out = io.BytesIO()
+    img.save(out, format=fmt, quality=90)
+    return out.getvalue()
+
+
+@lru_cache(maxsize=None)
+def pdf_bytes(pages: int) -> bytes:
+    """PDF de `pages` páginas (copias de una ficha base: texto real, no páginas vacías)."""
+    page = PdfReader(io.BytesIO(build_base_pdf(maximal_data(meds=5), generated_at="—"))).pages[0]
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_page(page)
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+class Upload(io.BytesIO):
+    """Upload en memoria con la interfaz de un UploadedFile de Streamlit."""
+
+    def __init__(self, name, data):
+        super().__init__(data)
+        self.name = name
+        self.size = len(data)
@@ -0,0 +1,21 @@
+"""Librería de renderizado de la ficha médica (importable sin levantar la UI).
+
+Las funciones públicas se cargan bajo demanda: importar un submódulo ligero (p. ej.
+`ficha.cache`) no arrastra ReportLab, PyPDF2 ni Pillow.
+"""
+__all__ = [
+    "AttachmentError",
+    "PathUpload",
+    "build_base_pdf",
+    "build_pdf_with_attachments",
+    "image_to_pdf_page",
+    "merge_pdfs",
+    "write_pdf_with_attachments",
+]
+
+
+def __getattr__(name):
+    if name in __all__:
+        from ficha import pdf
+        return getattr(pdf, name)
+    raise AttributeError(f"module 'ficha' has no attribute {name!r}")
@@ -0,0 +1,202 @@
+"""Render por lotes de fichas desde un export JSONL.
+
+Cada línea del archivo es un objeto JSON con la forma::
+
+    {"id": "paciente-001", "data": {...}, "anexos": ["labs/bh.pdf", "labs/rx.jpg"]}
+
+``data`` es el mismo dict que arma el formulario y ``anexos`` son rutas a los
+archivos adjuntos (relativas al directorio del JSONL). Un anexo también puede ser
+``{"ruta": "labs/bh.pdf", "paginas": "1-3,última"}`` para anexar solo esas páginas.
+``id`` es opcional; si falta se usa el número de línea.
+
+Uso::
+
+    python -m ficha.batch registros.jsonl -o salida/ -j 4
+    python -m ficha.batch registros.jsonl --guardar fichas.sqlite   # y guarda las fichas
+
+Con ``--guardar`` cada registro que se genera bien se guarda en la base de fichas
+(`ficha.records`), en transacciones por lotes.
+
+Un anexo dañado, cifrado o que excede los límites de `ficha.validate` hace fallar su
+registro; con ``--omitir-invalidos`` el registro se genera sin él y se reporta cada
+anexo omitido y por qué.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from ficha.images import DEFAULT_DPI, DEFAULT_QUALITY
+from ficha.memory import MemoryProbe
+from ficha.pdf import PathUpload, build_base_pdf, write_pdf_with_attachments
+from ficha.records import RecordStore
+
+# Fichas por transacción al guardar con --guardar
+SAVE_BATCH = 1000
+
+
+def _safe_name(text: str) -> str:
+    return re.sub(r"[^\w.-]+", "_", str(text)).strip("_") or "registro"
+
+
+def iter_records(path):
+    """Lee el JSONL línea por línea y regresa (número de línea, registro o error)."""
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_no, None, f"JSON inválido: {e}"
+                continue
+            if not isinstance(rec, dict) or not isinstance(rec.get("data"), dict):
+                yield line_no, None, "falta el dict 'data'"
+                continue
+            yield line_no, rec, None
+
+
+def render_record(rec: dict, base_dir: str, out_dir: str, dpi=DEFAULT_DPI, quality=DEFAULT_QUALITY,
+                  deterministic=False, optimize=False, target_bytes=None, skip_invalid=False) -> dict:
+    """Renderiza un registro y escribe el PDF en out_dir. Corre dentro del pool."""
+    t0 = time.perf_counter()
+    data = dict(rec["data"])
+    anexos = [a if isinstance(a, dict) else {"ruta": a} for a in rec.get("anexos") or []]
+    uploads = [PathUpload(os.path.join(base_dir, a["ruta"])) for a in anexos]
+    pages = [a.get("paginas") for a in anexos]
+    data.setdefault("Anexos", [f"{u.name} (páginas {p})" if p else u.name for u, p in zip(uploads, pages)])
+
+    out_path = os.path.join(out_dir, f"{_safe_name(rec['id'])}.pdf")
+    tmp_path = out_path + ".tmp"
+    base = None
+    if deterministic:
+        base = build_base_pdf(data, generated_at=data.get("Fecha de elaboración") or "—", invariant=True)
+    try:
+        with MemoryProbe() as mem:
+            skipped = write_pdf_with_attachments(tmp_path, data, uploads, dpi=dpi, quality=quality, base_pdf=base,
+                                                 pages=pages, optimize=optimize, target_bytes=target_bytes,
+                                                 skip_invalid=skip_invalid)
+    except BaseException:
+        # Sin .tmp a medias en la salida (se acumularían entre corridas)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, out_path)
+
+    return {
+        "path": out_path,
+        "bytes": os.path.getsize(out_path),
+        "seconds": time.perf_counter() - t0,
+        "anexos": len(uploads) - len(skipped),
+        "omitidos": [(e.name, e.reason) for e in skipped],
+        "peak_rss": mem.peak_rss,
+        "data": data,
+    }
+
+
+def run(jsonl_path, out_dir, jobs=None, max_pending=None, dpi=DEFAULT_DPI, quality=DEFAULT_QUALITY,
+        deterministic=False, records=None, optimize=False, target_bytes=None, skip_invalid=False, out=sys.stdout,
+        err=sys.stderr) -> int:
+    """Reparte los registros en un pool de procesos y reporta cada resultado. Regresa el # de fallas.
+
+    Con `records` (un `RecordStore`) guarda ahí el `data` de cada registro generado.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    base_dir = os.path.dirname(os.path.abspath(jsonl_path))
+    jobs = jobs or os.cpu_count() or 1
+    # Ventana acotada de trabajos en vuelo: el JSONL se consume en streaming
+    max_pending = max_pending or jobs * 4
+
+    ok = failed = 0
+    total_bytes = 0
+    t_start = time.perf_counter()
+    to_save = []
+
+    def report(rid, fut):
+        nonlocal ok, failed, total_bytes
+        try:
+            res = fut.result()
+        except Exception as e:
+            failed += 1
+            print(f"FALLA {rid}: {type(e).__name__}: {e}", file=err)
+            return
+        ok += 1
+        total_bytes += res["bytes"]
+        print(
+            f"OK    {rid}  {res['seconds']:.2f}s  {res['bytes'] / 1024:.0f} KB  "
+            f"{res['anexos']} anexos  pico {res['peak_rss'] / 1024 / 1024:.1f} MB  -> {res['path']}",
+            file=out,
+        )
+        for name, reason in res["omitidos"]:
+            print(f"OMITE {rid}: {name}: {reason}", file=err)
+        if records is not None:
+            to_save.append(res["data"])
+            if len(to_save) >= SAVE_BATCH:
+                records.save_many(to_save, batch=SAVE_BATCH)
+                to_save.clear()
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        pending = {}
+        for line_no, rec, error in iter_records(jsonl_path):
+            if error:
+                failed += 1
+                print(f"FALLA linea_{line_no}: {error}", file=err)
+                continue
+            rec.setdefault("id", f"linea_{line_no}")
+            fut = pool.submit(render_record, rec, base_dir, out_dir, dpi, quality, deterministic, optimize,
+                              target_bytes, skip_invalid)
+            pending[fut] = rec["id"]
+            if len(pending) >= max_pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    report(pending.pop(fut), fut)
+        for fut in list(pending):
+            report(pending.pop(fut), fut)
+    if records is not None and to_save:
+        records.save_many(to_save, batch=SAVE_BATCH)
+
+    elapsed = time.perf_counter() - t_start
+    total = ok + failed
+    rate = ok / elapsed if elapsed > 0 else 0.0
+    print(
+        f"Total: {total} registros, {ok} OK, {failed} fallas, {elapsed:.1f}s "
+        f"({rate:.2f} registros/s, {total_bytes / 1024 / 1024:.1f} MB)",
+        file=out,
+    )
+    return failed
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Genera fichas PDF por lotes desde un JSONL.")
+    parser.add_argument("jsonl", help="Archivo JSONL con un registro por línea")
+    parser.add_argument("-o", "--out-dir", default="salida", help="Directorio de salida (default: salida)")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Procesos en paralelo (default: # de CPUs)")
+    parser.add_argument("--dpi", type=int, default=DEFAULT_DPI,
+                        help=f"Resolución de las imágenes anexas (default: {DEFAULT_DPI}; 0 = original)")
+    parser.add_argument("--quality", type=int, default=DEFAULT_QUALITY,
+                        help=f"Calidad JPEG de las imágenes anexas (default: {DEFAULT_QUALITY})")
+    parser.add_argument("--deterministic", action="store_true",
+                        help="'Generado:' = fecha de elaboración y PDFs reproducibles byte a byte")
+    parser.add_argument("--optimizar", action="store_true",
+                        help="Optimiza el tamaño de cada PDF (sin pérdida; ver ficha.optimize)")
+    parser.add_argument("--max-mb", type=float, default=None,
+                        help="Tamaño máximo de cada PDF: baja la calidad de las imágenes hasta que quepa")
+    parser.add_argument("--guardar", metavar="DB", default=None,
+                        help="Guarda las fichas generadas en esa base SQLite (búsqueda y recarga en la UI)")
+    parser.add_argument("--omitir-invalidos", action="store_true",
+                        help="Genera el registro sin los anexos dañados o fuera de límites (y los reporta)")
+    args = parser.parse_args(argv)
+
+    failed = run(args.jsonl, args.out_dir, jobs=args.jobs, dpi=args.dpi or None, quality=args.quality,
+                 deterministic=args.deterministic, records=RecordStore(args.guardar) if args.guardar else None,
+                 optimize=args.optimizar, target_bytes=int(args.max_mb * 1024 * 1024) if args.max_mb else None,
+                 skip_invalid=args.omitir_invalidos)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
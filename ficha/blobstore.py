@@ -0,0 +1,257 @@
+"""Almacén en disco direccionado por contenido (SHA-256) para anexos y páginas convertidas.
+
+Los mismos pacientes regresan con los mismos PDFs de laboratorio y las mismas fotos; con
+el almacén cada contenido se guarda una sola vez y sobrevive a reinicios:
+
+- los blobs viven en `objects/ab/cd/<sha256>` bajo la raíz,
+- un índice SQLite (`index.sqlite`, modo WAL) lleva tamaño y último uso de cada blob, y
+  la tabla `keys` asocia llaves arbitrarias (p. ej. `page_key` de una imagen convertida)
+  con el blob de su resultado,
+- las escrituras son atómicas: se escribe a un temporal y se renombra (`os.replace`)
+  dentro de una transacción `BEGIN IMMEDIATE`, igual que el desalojo, así que varios
+  procesos (workers del pool, servicios de render) pueden compartir la raíz sin pisarse,
+- al pasar de `max_bytes` se desalojan los blobs usados hace más tiempo; los usados en
+  los últimos `grace` segundos no se tocan (un render podría estar por abrirlos).
+
+Tiene la interfaz del caché de páginas (`get`/`put`/`in`), así que sirve como `cache=`
+de `write_pdf_with_attachments`; `get` regresa la ruta del blob (una parte en disco), no
+bytes. Con `store=` además los uploads se guardan en el almacén y viajan como rutas.
+
+Configuración: FICHA_BLOB_DIR (sin ella no hay almacén) y FICHA_BLOB_MAX_MB (default 1024).
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from ficha.cache import upload_hash
+from ficha.spool import is_spooled
+
+_CHUNK = 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    digest TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS blobs_last_used ON blobs (last_used);
+CREATE TABLE IF NOT EXISTS keys (
+    key TEXT PRIMARY KEY,
+    digest TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS keys_digest ON keys (digest);
+"""
+
+
+def _key_text(key) -> str:
+    return key if isinstance(key, str) else json.dumps(key, ensure_ascii=False, default=str)
+
+
+class BlobStore:
+    """Blobs inmutables por SHA-256 bajo `root`, con índice SQLite y desalojo por tamaño."""
+
+    def __init__(self, root, max_bytes=1024 * 1024 * 1024, grace=600):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.grace = grace
+        self._tmp = os.path.join(root, "tmp")
+        os.makedirs(self._tmp, exist_ok=True)
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._db().executescript(_SCHEMA)
+
+    # ----------------------------
+    # Índice
+    # ----------------------------
+    def _db(self):
+        # Una conexión por hilo (y por proceso: una conexión no sobrevive a un fork)
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(os.path.join(self.root, "index.sqlite"), timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db, self._local.pid = db, os.getpid()
+        return db
+
+    @contextmanager
+    def _transaction(self):
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def path_for(self, digest) -> str:
+        return os.path.join(self.root, "objects", digest[:2], digest[2:4], digest)
+
+    # ----------------------------
+    # Blobs
+    # ----------------------------
+    def _commit_temp(self, tmp, digest, size):
+        final = self.path_for(digest)
+        os.makedirs(os.path.dirname(final), exist_ok=True)
+        now = time.time()
+        with self._transaction() as db:
+            # Renombrar siempre (aunque ya exista, el contenido es el mismo) dentro de la
+            # transacción: el desalojo, que también la toma, nunca ve el archivo a medias
+            os.replace(tmp, final)
+            db.execute(
+                "INSERT INTO blobs (digest, size, created, last_used) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(digest) DO UPDATE SET last_used = excluded.last_used",
+                (digest, size, now, now),
+            )
+        return final
+
+    def _write_temp(self, chunks):
+        fd, tmp = tempfile.mkstemp(dir=self._tmp)
+        h = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for block in chunks:
+                    h.update(block)
+                    f.write(block)
+                    size += len(block)
+                f.flush()
+                os.fsync(f.fileno())
+        except BaseException:
+            os.remove(tmp)
+            raise
+        return tmp, h.hexdigest(), size
+
+    def put_part(self, part) -> str:
+        """Guarda bytes o un archivo (leído por bloques). Regresa su digest."""
+        if is_spooled(part):
+            def chunks():
+                with open(part, "rb") as f:
+                    yield from iter(lambda: f.read(_CHUNK), b"")
+            tmp, digest, size = self._write_temp(chunks())
+        else:
+            tmp, digest, size = self._write_temp([part])
+        try:
+            self._commit_temp(tmp, digest, size)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self.evict()
+        return digest
+
+    def add_upload(self, uf) -> str:
+        """Guarda un upload (sin `getvalue` si trae buffer o ruta). Regresa la ruta del blob."""
+        # El caso común es un archivo que ya se subió antes: se hashea sin escribir nada
+        digest = upload_hash(uf)
+        if self.open_blob(digest):
+            return self.path_for(digest)
+        path = getattr(uf, "path", None)
+        if path:
+            digest = self.put_part(path)
+        elif hasattr(uf, "getbuffer"):
+            digest = self.put_part(uf.getbuffer())
+        else:
+            digest = self.put_part(uf.getvalue())
+        return self.path_for(digest)
+
+    def open_blob(self, digest):
+        """Ruta del blob (marcándolo como usado) o None si no está."""
+        path = self.path_for(digest)
+        with self._transaction() as db:
+            found = db.execute("SELECT 1 FROM blobs WHERE digest = ?", (digest,)).fetchone()
+            if found and os.path.exists(path):
+                db.execute("UPDATE blobs SET last_used = ? WHERE digest = ?", (time.time(), digest))
+                return path
+            if found:
+                # Borrado a mano: se limpia el índice
+                db.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+                db.execute("DELETE FROM keys WHERE digest = ?", (digest,))
+        return None
+
+    # ----------------------------
+    # Interfaz de caché (llave -> blob)
+    # ----------------------------
+    def get(self, key):
+        row = self._db().execute("SELECT digest FROM keys WHERE key = ?", (_key_text(key),)).fetchone()
+        path = self.open_blob(row[0]) if row else None
+        if path is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return path
+
+    def __contains__(self, key):
+        row = self._db().execute(
+            "SELECT 1 FROM keys JOIN blobs USING (digest) WHERE key = ?", (_key_text(key),)
+        ).fetchone()
+        return row is not None
+
+    def put(self, key, value):
+        """`value` son bytes o la ruta de un archivo (se copia al almacén)."""
+        digest = self.put_part(value)
+        with self._transaction() as db:
+            db.execute("INSERT OR REPLACE INTO keys (key, digest) VALUES (?, ?)", (_key_text(key), digest))
+
+    # ----------------------------
+    # Desalojo
+    # ----------------------------
+    def evict(self) -> int:
+        """Borra blobs (del más viejo en uso al más nuevo) hasta quedar en `max_bytes`."""
+        with self._transaction() as db:
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+            if total <= self.max_bytes:
+                return 0
+            victims = []
+            cutoff = time.time() - self.grace
+            for digest, size in db.execute(
+                "SELECT digest, size FROM blobs WHERE last_used < ? ORDER BY last_used", (cutoff,)
+            ):
+                if total <= self.max_bytes:
+                    break
+                victims.append(digest)
+                total -= size
+            for digest in victims:
+                try:
+                    os.remove(self.path_for(digest))
+                except FileNotFoundError:
+                    pass
+                db.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+                db.execute("DELETE FROM keys WHERE digest = ?", (digest,))
+        self.evictions += len(victims)
+        return len(victims)
+
+    def stats(self) -> dict:
+        count, total = self._db().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        return {
+            "entries": count,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+_store = None
+_lock = threading.Lock()
+
+
+def get_blob_store():
+    """El almacén configurado con FICHA_BLOB_DIR (compartido en el proceso), o None."""
+    global _store
+    root = os.environ.get("FICHA_BLOB_DIR")
+    if not root:
+        return None
+    with _lock:
+        if _store is None or _store.root != root:
+            _store = BlobStore(root, max_bytes=int(os.environ.get("FICHA_BLOB_MAX_MB", 1024)) * 1024 * 1024)
+        return _store
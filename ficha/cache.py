@@ -0,0 +1,121 @@
+"""Caché LRU acotado por bytes para las páginas de anexos ya convertidas.
+
+Streamlit vuelve a ejecutar todo el script en cada interacción, pero los módulos
+importados sobreviven entre reruns (y entre sesiones del mismo servidor), así que una
+instancia a nivel de módulo basta para no reconvertir los mismos uploads.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from ficha.spool import is_spooled, read_part
+
+# Tamaño por defecto del caché de páginas (MB)
+PAGE_CACHE_MB = int(os.environ.get("FICHA_PAGE_CACHE_MB", 64))
+
+_CHUNK = 1024 * 1024
+
+
+def content_hash(source) -> str:
+    """SHA-256 de bytes en memoria o de un archivo en disco (leído por bloques)."""
+    h = hashlib.sha256()
+    if is_spooled(source):
+        with open(source, "rb") as f:
+            for block in iter(lambda: f.read(_CHUNK), b""):
+                h.update(block)
+    else:
+        h.update(source)
+    return h.hexdigest()
+
+
+def upload_hash(uf) -> str:
+    """SHA-256 de un upload sin copiarlo: ruta en disco, memoryview del BytesIO o getvalue()."""
+    path = getattr(uf, "path", None)
+    if path:
+        return content_hash(path)
+    if hasattr(uf, "getbuffer"):
+        return hashlib.sha256(uf.getbuffer()).hexdigest()
+    return content_hash(uf.getvalue())
+
+
+def data_hash(data: dict) -> str:
+    """Hash canónico del dict de la ficha (independiente del orden de las llaves)."""
+    canonical = json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ByteLRUCache:
+    """Diccionario LRU cuyo límite es la suma de tamaños (len) de los valores.
+
+    Seguro para usarse desde varios hilos (cada sesión de Streamlit corre en el suyo).
+    Valores más grandes que `max_item_bytes` no se guardan para no vaciar el caché entero.
+    """
+
+    def __init__(self, max_bytes, max_item_bytes=None):
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_item_bytes if max_item_bytes is not None else max_bytes // 4
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def __contains__(self, key):
+        # Sin contar acierto/fallo ni mover la llave
+        with self._lock:
+            return key in self._data
+
+    def put(self, key, value):
+        if is_spooled(value):
+            value = read_part(value)
+        size = len(value)
+        if size > self.max_item_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._data[key] = value
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+def page_key(name: str, digest: str, dpi, quality) -> tuple:
+    """Llave de una página convertida: el nombre se dibuja en el título, así que cuenta."""
+    return ("page", digest, name, dpi, quality)
+
+
+# Caché compartido del proceso para las páginas de imágenes convertidas
+page_cache = ByteLRUCache(PAGE_CACHE_MB * 1024 * 1024)
@@ -0,0 +1,5 @@
+"""Ajustes por defecto de la conversión de anexos (sin dependencias, barato de importar)."""
+
+# Resolución y calidad por defecto para las páginas de anexos
+DEFAULT_DPI = 150
+DEFAULT_QUALITY = 85
@@ -0,0 +1,14 @@
+"""Errores de la librería (sin dependencias, para poder importarlos desde cualquier módulo)."""
+
+
+class AttachmentError(ValueError):
+    """Un anexo no se pudo convertir o validar."""
+
+    def __init__(self, name, reason):
+        super().__init__(f"{name}: {reason}")
+        self.name = name
+        self.reason = reason
+
+    def __reduce__(self):
+        # Para que viaje intacta desde el pool de procesos
+        return type(self), (self.name, self.reason)
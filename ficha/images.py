@@ -0,0 +1,171 @@
+"""Conversión de imágenes adjuntas: remuestreo a la resolución del recuadro donde se dibujan."""
+import hashlib
+import io
+from collections import namedtuple
+
+from PIL import Image, ImageOps
+
+from ficha.defaults import DEFAULT_DPI, DEFAULT_QUALITY  # noqa: F401
+from ficha.spool import part_size
+
+
+def target_pixels(img_w, img_h, box_w, box_h, dpi):
+    """Tamaño en píxeles que ocupa la imagen al ajustarse a un recuadro (en puntos) a `dpi`.
+
+    Nunca agranda: si la imagen ya es más chica que el objetivo regresa su tamaño original.
+    """
+    scale = min(box_w / img_w, box_h / img_h)
+    px_per_pt = dpi / 72.0
+    tw = max(1, round(img_w * scale * px_per_pt))
+    th = max(1, round(img_h * scale * px_per_pt))
+    if tw >= img_w or th >= img_h:
+        return img_w, img_h
+    return tw, th
+
+
+# Orientaciones EXIF que intercambian ancho y alto
+_SWAPS_AXES = (5, 6, 7, 8)
+
+
+def _orientation(img):
+    """Valor EXIF de orientación (1 = normal); solo lee el encabezado."""
+    return img.getexif().get(0x0112, 1)
+
+
+# Datos del encabezado de una imagen (sin decodificar píxeles)
+ImageProbe = namedtuple("ImageProbe", "format width height mode orientation bits")
+
+
+def _open(source):
+    """Abre (sin decodificar) una imagen dada como bytes o como ruta."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return Image.open(io.BytesIO(source))
+    return Image.open(source)
+
+
+def probe_image(source) -> ImageProbe:
+    """Lee solo el encabezado: formato, tamaño, modo de color, orientación EXIF y bits por canal.
+
+    `source` son los bytes de la imagen o la ruta al archivo.
+    """
+    with _open(source) as img:
+        return ImageProbe(
+            format=img.format,
+            width=img.width,
+            height=img.height,
+            mode=img.mode,
+            orientation=_orientation(img),
+            bits=getattr(img, "bits", 8),
+        )
+
+
+def can_passthrough(probe: ImageProbe, box_w: float, box_h: float, dpi=DEFAULT_DPI) -> bool:
+    """True si el JPEG original puede incrustarse tal cual (sin decodificar ni recodificar).
+
+    Requiere JPEG de 8 bits en RGB o escala de grises (los CMYK de Adobe suelen venir
+    invertidos), sin rotación EXIF pendiente y que ya quepa en la resolución objetivo.
+    """
+    if probe.format != "JPEG" or probe.mode not in ("RGB", "L"):
+        return False
+    if probe.orientation != 1 or probe.bits != 8:
+        return False
+    if dpi and target_pixels(probe.width, probe.height, box_w, box_h, dpi) != (probe.width, probe.height):
+        return False
+    return True
+
+
+class JpegImage:
+    """JPEG listo para `canvas.drawImage` que ReportLab incrusta con DCTDecode sin decodificarlo.
+
+    Con un ImageReader, drawImage decodifica todos los píxeles solo para calcular el nombre
+    del XObject; este objeto expone `jpeg_fh` y un nombre basado en el hash del contenido.
+    """
+
+    def __init__(self, data: bytes, size):
+        self.data = data
+        self.size = size
+        self._name = "jpeg-" + hashlib.md5(data).hexdigest()
+
+    def jpeg_fh(self):
+        return io.BytesIO(self.data)
+
+    def getSize(self):
+        return self.size
+
+    def __str__(self):
+        return self._name
+
+
+def _has_alpha(img):
+    return img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info)
+
+
+def _to_bitonal(img):
+    # Umbral sin tramado: los bordes suavizados del remuestreo vuelven a blanco y negro
+    return img.point(lambda v: 255 if v >= 128 else 0).convert("1", dither=Image.Dither.NONE)
+
+
+def downsample_image(source, box_w: float, box_h: float,
+                     dpi=DEFAULT_DPI, quality=DEFAULT_QUALITY):
+    """Remuestrea una imagen (bytes o ruta) al tamaño de su recuadro y la recodifica.
+
+    Regresa (datos, formato, (ancho, alto)). Una imagen bitonal sigue bitonal y una con
+    paleta sigue con paleta (PNG: escaneos en blanco y negro y gráficas comprimen mucho
+    mejor así); con transparencia sale PNG y el resto JPEG. Si no hace falta reducirla, o
+    si lo recodificado no queda más chico que el original, regresa `source` tal cual con
+    su formato original (salvo JPEG y rotación EXIF, que siempre se recodifican: el JPEG
+    que podía ir tal cual ya lo incrustó `can_passthrough`).
+    Para JPEG usa `Image.draft` para que libjpeg decodifique directamente a 1/2, 1/4 u 1/8
+    de escala, así un escaneo enorme nunca se expande completo en memoria. Para el resto de
+    formatos se decodifica una vez y se reduce enseguida con `reduce` (filtro de caja barato)
+    antes del remuestreo fino.
+    """
+    with _open(source) as img:
+        orientation = _orientation(img)
+        ow, oh = (img.height, img.width) if orientation in _SWAPS_AXES else img.size
+        tw, th = target_pixels(ow, oh, box_w, box_h, dpi)
+        original = None if img.format == "JPEG" or orientation != 1 else (source, img.format, img.size)
+        if original and (tw, th) == (ow, oh):
+            return original
+
+        if img.format == "JPEG" and (tw, th) != (ow, oh):
+            # draft trabaja en la orientación almacenada (antes de rotar)
+            request = (th, tw) if orientation in _SWAPS_AXES else (tw, th)
+            img.draft("L" if img.mode == "L" else "RGB", request)
+        if orientation != 1:
+            img = ImageOps.exif_transpose(img)
+
+        mode = img.mode
+        colors = len(img.getcolors(256) or ()) if mode == "P" else 0
+        if img.width > tw or img.height > th:
+            # Paleta y bitonal solo admiten vecino más cercano al redimensionar: se
+            # remuestrean en color/gris y al final se regresan a su modo
+            if mode == "P":
+                img = img.convert("RGBA" if _has_alpha(img) else "RGB")
+            elif mode == "1":
+                img = img.convert("L")
+        if img.mode not in ("1", "L", "LA", "P", "RGB", "RGBA", "CMYK"):
+            img = img.convert("RGB")
+
+        factor = min(img.width // tw, img.height // th)
+        if factor >= 2:
+            img = img.reduce(factor)
+        if img.width > tw or img.height > th:
+            img = img.resize((tw, th), Image.LANCZOS)
+        if mode == "1" and img.mode != "1":
+            img = _to_bitonal(img)
+        elif mode == "P" and img.mode != "P":
+            img = img.quantize(colors or 256, method=Image.Quantize.FASTOCTREE, dither=Image.Dither.NONE)
+
+        out = io.BytesIO()
+        if _has_alpha(img) or img.mode in ("1", "P"):
+            img.save(out, format="PNG", optimize=True)
+            fmt = "PNG"
+        else:
+            if img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            img.save(out, format="JPEG", quality=quality, optimize=True)
+            fmt = "JPEG"
+        if original and out.tell() >= part_size(source):
+            return original
+        return out.getvalue(), fmt, img.size
@@ -0,0 +1,141 @@
+"""Render incremental: reutiliza la ficha base y el PDF final si las entradas no cambiaron.
+
+Pensado para vivir en `st.session_state`: cada sesión guarda su último resultado, así un
+rerun (p. ej. el que dispara el botón de descarga) o volver a pulsar "Generar PDF" sin
+cambios regresa el archivo ya generado sin volver a renderizar nada.
+"""
+import os
+import tempfile
+import weakref
+from datetime import datetime
+
+from ficha.cache import data_hash, upload_hash
+from ficha.defaults import DEFAULT_DPI, DEFAULT_QUALITY
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class RenderMemo:
+    """Memo de la última ficha base y del último PDF final de una sesión.
+
+    - La base se indexa por el hash canónico de `data` (más el texto de "Generado:").
+    - El PDF final se indexa por la llave de la base más los hashes de los anexos y los
+      ajustes de conversión; se guarda en un archivo temporal que vive lo que el memo.
+
+    Con deterministic=True la línea "Generado:" usa la fecha de elaboración en vez de la
+    hora actual y el PDF se genera sin fecha de creación ni ID aleatorio, así que la misma
+    entrada da siempre los mismos bytes. Sin él la llave incluye la hora (a resolución de
+    minuto), por lo que la base se reutiliza solo dentro del mismo minuto.
+
+    Con `remote` (un `ficha.service.RenderClient`) el PDF se genera en el servicio de
+    render: localmente no se dibuja la base ni se importa la pila de PDF. `session`
+    identifica a la sesión ante el planificador del servicio.
+    """
+
+    def __init__(self, deterministic=False, remote=None, session=None):
+        self.deterministic = deterministic
+        self.remote = remote
+        self.session = session
+        self.base_key = None
+        self.base = None
+        self.final_key = None
+        self.final_path = None
+        # Anexos omitidos (AttachmentError) al generar el PDF final
+        self.skipped = []
+        self.hits = 0
+        self.misses = 0
+        self._finalizer = None
+
+    def _generated_at(self, data):
+        if self.deterministic:
+            return data.get("Fecha de elaboración") or "—"
+        return datetime.now().strftime("%Y-%m-%d %H:%M")
+
+    def base_pdf(self, data: dict):
+        """Regresa (llave, bytes) de la ficha base, renderizándola solo si cambió."""
+        generated_at = self._generated_at(data)
+        key = (data_hash(data), generated_at)
+        if key != self.base_key:
+            from ficha.pdf import build_base_pdf  # carga perezosa de la pila de PDF
+
+            self.base = build_base_pdf(data, generated_at=generated_at, invariant=self.deterministic)
+            self.base_key = key
+        return key, self.base
+
+    def _final_key(self, base_key, uploads, dpi, quality, pages, optimize=False, target_bytes=None):
+        pages = tuple(pages) if pages else (None,) * len(uploads)
+        return (base_key, tuple((uf.name, upload_hash(uf)) for uf in uploads), pages, dpi, quality,
+                optimize, target_bytes)
+
+    def key_for(self, data: dict, uploads, dpi=DEFAULT_DPI, quality=DEFAULT_QUALITY, pages=None,
+                optimize=False, target_bytes=None):
+        """La llave con la que `render` indexaría estas entradas (sin renderizar nada)."""
+        uploads = list(uploads or [])
+        base_key = (data_hash(data), self._generated_at(data))
+        return self._final_key(base_key, uploads, dpi, quality, pages, optimize, target_bytes)
+
+    def render(self, data: dict, uploads, dpi=DEFAULT_DPI, quality=DEFAULT_QUALITY, pages=None,
+               optimize=False, target_bytes=None, skip_invalid=False, **kwargs):
+        """Regresa (ruta del PDF final, reutilizado?). kwargs van a write_pdf_with_attachments.
+
+        `optimize` y `target_bytes` (ver ficha.optimize) son parte de la llave. Con
+        skip_invalid=True los anexos que no pasan la validación se omiten; quedan en
+        `self.skipped` (también al reutilizar).
+        """
+        uploads = list(uploads or [])
+        pages = list(pages) if pages else [None] * len(uploads)
+        if self.remote is not None:
+            base_key, base = (data_hash(data), self._generated_at(data)), None
+        else:
+            base_key, base = self.base_pdf(data)
+        key = self._final_key(base_key, uploads, dpi, quality, pages, optimize, target_bytes)
+        if key == self.final_key and self.final_path and os.path.exists(self.final_path):
+            if self.skipped and not skip_invalid:
+                raise self.skipped[0]
+            self.hits += 1
+            return self.final_path, True
+
+        self.misses += 1
+        fd, path = tempfile.mkstemp(suffix=".pdf", prefix="ficha-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                if self.remote is not None:
+                    # workers/cache son del servicio; solo viaja el trace (spans del cliente)
+                    skipped = self.remote.write(
+                        f, data, uploads, dpi=dpi, quality=quality, pages=pages, generated_at=base_key[1],
+                        invariant=self.deterministic, optimize=optimize, target_bytes=target_bytes,
+                        skip_invalid=skip_invalid, session=self.session, trace=kwargs.get("trace"),
+                    )
+                else:
+                    from ficha.pdf import write_pdf_with_attachments
+
+                    skipped = write_pdf_with_attachments(
+                        f, data, uploads, dpi=dpi, quality=quality, base_pdf=base, pages=pages,
+                        optimize=optimize, target_bytes=target_bytes, skip_invalid=skip_invalid, **kwargs,
+                    )
+        except BaseException:
+            _remove(path)
+            raise
+        self._set_final(key, path)
+        self.skipped = skipped
+        return path, False
+
+    def _set_final(self, key, path):
+        if self._finalizer is not None:
+            self._finalizer()  # borra el archivo anterior
+        self.final_key = key
+        self.final_path = path
+        # Borra el archivo cuando la sesión (y con ella el memo) desaparece
+        self._finalizer = weakref.finalize(self, _remove, path)
+
+    def clear(self):
+        if self._finalizer is not None:
+            self._finalizer()
+        self._finalizer = None
+        self.base_key = self.base = self.final_key = self.final_path = None
+        self.skipped = []
@@ -0,0 +1,179 @@
+"""Generación del PDF como trabajo en segundo plano, con progreso y cancelación.
+
+La UI lanza un `RenderJob` y sigue respondiendo; el trabajo corre en su propio hilo y
+reporta su avance a través de un `ProgressTrace`, el mismo mecanismo de spans que usa
+ficha.metrics: cada etapa (spool, validación, caché, conversión, ficha base, merge) y
+cada anexo convertido, unido u omitido avanza la barra. La cancelación es cooperativa:
+el siguiente span que se abre después de `cancel()` lanza `RenderCancelled`.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from ficha.metrics import Trace
+
+RUNNING = "en curso"
+DONE = "listo"
+FAILED = "error"
+CANCELLED = "cancelado"
+
+STAGE_LABELS = {
+    "spool": "Preparando anexos",
+    "validate": "Revisando anexos",
+    "cache": "Buscando páginas ya convertidas",
+    "convert": "Convirtiendo anexos",
+    "base": "Dibujando la ficha",
+    "merge": "Uniendo páginas",
+    "optimize": "Optimizando el tamaño del PDF",
+    "remote_render": "Generando en el servicio de render",
+}
+
+# Etapas que cuentan como un paso de la barra (además de cada anexo convertido/unido)
+_STEPS = ("spool", "validate", "cache", "base")
+
+# Pasos de la barra que ya no ocurren cuando un anexo se omite en cada etapa
+_SKIPPED_STEPS = {"validate": 2, "convert": 2, "merge": 1}
+
+
+class RenderCancelled(Exception):
+    """El usuario canceló la generación."""
+
+
+class ProgressTrace(Trace):
+    """Trace que además lleva la etapa actual, el avance (0–1) y el estado de cada anexo.
+
+    `attachments` es el número de uploads: con él se estima el total de pasos (4 etapas,
+    una conversión y una unión por anexo, más la ficha base en el merge); los aciertos de
+    caché se descuentan al salir de la etapa "cache".
+    """
+
+    def __init__(self, attachments, names=None, memory=False, **kwargs):
+        super().__init__(memory=memory, **kwargs)
+        self.names = list(names or [])
+        self.items = {}
+        self._open = []
+        # Posición en la cola del planificador mientras espera lugar (0: ya corre)
+        self.queue_position = 0
+        self._done = 0
+        self._total = len(_STEPS) + attachments + (attachments + 1)
+        self._cancel = threading.Event()
+
+    @property
+    def stage(self) -> str:
+        # Las etapas se anidan (la ficha base se dibuja durante la conversión)
+        if self._open:
+            return STAGE_LABELS.get(self._open[-1], self._open[-1])
+        if self.queue_position:
+            return f"En cola (posición {self.queue_position})"
+        return "En espera"
+
+    @property
+    def progress(self) -> float:
+        return min(1.0, self._done / self._total) if self._total else 0.0
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def _check(self):
+        if self._cancel.is_set():
+            raise RenderCancelled()
+
+    def _name(self, i):
+        return self.names[i] if 0 <= i < len(self.names) else f"anexo {i + 1}"
+
+    @contextmanager
+    def span(self, stage, **attrs):
+        self._check()
+        self._open.append(stage)
+        try:
+            with super().span(stage, **attrs) as s:
+                yield s
+        finally:
+            self._open.pop()
+        if stage == "cache":
+            self._total -= s.attrs.get("hits", 0)
+        if stage in _STEPS:
+            self._done += 1
+
+    def add(self, stage, seconds, **fields):
+        s = super().add(stage, seconds, **fields)
+        if stage == "convert_attachment":
+            self.items[self._name(fields["attachment"])] = f"convertido ({seconds:.1f} s)"
+        elif stage == "merge_part" and fields.get("part", 0) > 0:
+            # La parte 0 es la ficha base
+            self.items[self._name(fields["part"] - 1)] = f"unido ({fields.get('pages', 0)} págs.)"
+        elif stage == "skip_attachment":
+            self.items[self._name(fields["attachment"])] = f"omitido: {fields['reason']}"
+            self._done += _SKIPPED_STEPS.get(fields.get("during"), 0)
+        if stage in ("convert_attachment", "merge_part"):
+            self._done += 1
+        self._check()
+        return s
+
+
+class RenderJob:
+    """Corre `fn()` en un hilo daemon. `key` identifica las entradas (para no duplicar).
+
+    `fn` debe pasar `trace` al render. Si se da `after` (otro RenderJob), se espera a que
+    ese termine antes de empezar: dos renders no tocan a la vez el mismo RenderMemo. Con
+    `ticket` (de `ficha.scheduler`), además espera su turno en el planificador del proceso
+    y lo libera al terminar.
+    """
+
+    def __init__(self, key, fn, trace: ProgressTrace, after=None, ticket=None):
+        self.key = key
+        self.trace = trace
+        self.state = RUNNING
+        self.result = None
+        self.error = None
+        self.started = time.perf_counter()
+        self.seconds = None
+        self._fn = fn
+        self._after = after
+        self._ticket = ticket
+        self._thread = threading.Thread(target=self._run, name="ficha-render", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            if self._after is not None:
+                self._after.wait()
+            if self._ticket is not None:
+                self._wait_turn()
+            self.result = self._fn()
+            self.state = DONE
+        except RenderCancelled:
+            self.state = CANCELLED
+        except Exception as e:
+            self.error = e
+            self.state = CANCELLED if self.trace.cancelled else FAILED
+        finally:
+            if self._ticket is not None:
+                self._ticket.release()
+            self.seconds = time.perf_counter() - self.started
+
+    def _wait_turn(self):
+        def cancelled():
+            self.trace.queue_position = self._ticket.position
+            return self.trace.cancelled
+
+        admitted = self._ticket.wait(cancelled)
+        self.trace.queue_position = 0
+        self.trace.add("queue", self._ticket.waited)
+        if not admitted:
+            raise RenderCancelled()
+
+    @property
+    def running(self) -> bool:
+        return self.state == RUNNING
+
+    def cancel(self):
+        self.trace.cancel()
+
+    def wait(self, timeout=None) -> bool:
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
@@ -0,0 +1,63 @@
+"""Medición del pico de memoria de un render."""
+import os
+import threading
+import tracemalloc
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss() -> int:
+    """RSS actual del proceso en bytes (0 si la plataforma no expone /proc)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+class MemoryProbe:
+    """Mide el pico de memoria dentro de un bloque `with`.
+
+    - `peak_rss`: pico de RSS por encima del RSS inicial, muestreado cada `interval` s en un
+      hilo aparte (incluye los búferes en C de Pillow/zlib que tracemalloc no ve).
+    - `peak_traced`: pico de asignaciones de Python vía tracemalloc (solo si `traced=True`;
+      tracemalloc hace más lento el render).
+
+    Solo mide este proceso: lo que consumen los procesos del pool no se incluye.
+    """
+
+    def __init__(self, interval=0.005, traced=False):
+        self.interval = interval
+        self.traced = traced
+        self.peak_rss = 0
+        self.peak_traced = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._started_tracing = False
+
+    def __enter__(self):
+        self._base = current_rss()
+        self._peak = self._base
+        if self.traced:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            tracemalloc.reset_peak()
+        self._thread = threading.Thread(target=self._sample, name="ficha-memprobe", daemon=True)
+        self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self._peak = max(self._peak, current_rss())
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._peak = max(self._peak, current_rss())
+        self.peak_rss = self._peak - self._base
+        if self.traced:
+            self.peak_traced = tracemalloc.get_traced_memory()[1]
+            if self._started_tracing:
+                tracemalloc.stop()
+        return False
@@ -0,0 +1,324 @@
+"""Merge de PDFs por páginas, copiando objetos por demanda y escribiendo en streaming.
+
+`PdfMerger` carga cada documento completo en un `PdfWriter` (todas las páginas, sus
+recursos, el outline y los destinos) y lo escribe al final. `PageMerger` en cambio:
+
+- abre cada PDF una sola vez (el archivo del spool se lee por demanda, no completo),
+- por cada página copia su diccionario y los objetos que alcanza (contenido, fuentes,
+  imágenes) y los escribe al archivo de salida en cuanto los copia; los streams pasan
+  tal cual, sin decodificar ni recomprimir,
+- suelta el caché de objetos del lector cada tantas páginas, así que la memoria no
+  crece con el tamaño del documento,
+- escribe una sola vez los anexos idénticos (mismo hash): el segundo solo agrega sus
+  diccionarios de página, apuntando a los objetos ya escritos,
+- con una selección de páginas ("1-3,7") copia solo esas páginas y lo que alcanzan.
+
+No se copian outline, destinos con nombre ni formularios de los anexos, solo páginas.
+Los PDFs cifrados sin contraseña de apertura (solo de permisos) se descifran al leerlos.
+"""
+import hashlib
+import io
+import time
+
+from PyPDF2 import PdfReader
+from PyPDF2.errors import DependencyError, FileNotDecryptedError
+from PyPDF2.generic import (
+    ArrayObject,
+    DictionaryObject,
+    IndirectObject,
+    NameObject,
+    NullObject,
+    NumberObject,
+    StreamObject,
+)
+
+from ficha.cache import content_hash
+from ficha.errors import AttachmentError
+from ficha.pages import parse_pages
+from ficha.spool import is_spooled
+
+_HEADER = b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n"
+_CATALOG_ID = 1
+_PAGES_ID = 2
+
+# Cada cuántos objetos resueltos se vacía el caché del lector
+_READER_CACHE_LIMIT = 512
+
+
+class PartStats:
+    """Costo de agregar un documento al merge."""
+
+    __slots__ = ("name", "pages", "objects", "bytes_out", "seconds", "duplicate")
+
+    def __init__(self, name):
+        self.name = name
+        self.pages = 0
+        self.objects = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+        self.duplicate = False
+
+
+class _CountingWriter:
+    def __init__(self, f):
+        self.f = f
+        self.pos = 0
+        self.md5 = hashlib.md5()
+
+    def write(self, data):
+        self.f.write(data)
+        self.pos += len(data)
+        self.md5.update(data)
+
+
+def _pdf_error(name, e) -> AttachmentError:
+    if isinstance(e, FileNotDecryptedError):
+        return AttachmentError(name, "PDF protegido con contraseña")
+    if isinstance(e, DependencyError):
+        return AttachmentError(name, f"PDF cifrado que no se puede abrir ({e})")
+    return AttachmentError(name, f"PDF inválido ({type(e).__name__}: {e})")
+
+
+def _open_reader(source, name):
+    """Abre el PDF (bytes o ruta) una sola vez. Regresa (lector, archivo a cerrar o None)."""
+    fh = open(source, "rb") if is_spooled(source) else None
+    try:
+        reader = PdfReader(fh or io.BytesIO(source), strict=False)
+        n_pages = len(reader.pages)
+    except Exception as e:
+        if fh:
+            fh.close()
+        if isinstance(e, OSError):
+            raise
+        raise _pdf_error(name, e) from e
+    if not n_pages:
+        if fh:
+            fh.close()
+        raise AttachmentError(name, "el PDF no tiene páginas")
+    return reader, fh
+
+
+class PageMerger:
+    """Escribe en `out` (archivo binario) las páginas de cada documento agregado con `add`.
+
+    Uso::
+
+        merger = PageMerger(f)
+        merger.add(base_pdf, "ficha")
+        merger.add("/spool/labs.pdf", "labs.pdf")
+        merger.close()  # escribe el árbol de páginas, la tabla xref y el trailer
+    """
+
+    def __init__(self, out):
+        self._out = _CountingWriter(out)
+        self._out.write(_HEADER)
+        self._offsets = {}
+        self._next_id = _PAGES_ID + 1
+        self._kids = []
+        # (hash del documento, número de objeto, generación) -> número en la salida
+        self._ids = {}
+        # hash -> {índice de página: diccionario ya traducido} (para repetir un anexo idéntico)
+        self._pages = {}
+        # hash -> número de páginas del documento
+        self._counts = {}
+        self.stats = []
+
+    def _alloc(self):
+        n = self._next_id
+        self._next_id += 1
+        return n
+
+    def _write(self, num, obj):
+        self._offsets[num] = self._out.pos
+        self._out.write(b"%d 0 obj\n" % num)
+        obj.write_to_stream(self._out, None)
+        self._out.write(b"\nendobj\n")
+
+    # ----------------------------
+    # Copia de objetos
+    # ----------------------------
+    def _ref(self, digest, ref, pending):
+        key = (digest, ref.idnum, ref.generation)
+        if key in self._ids:
+            num = self._ids[key]
+            # None: página del anexo que no se eligió
+            return NullObject() if num is None else IndirectObject(num, 0, None)
+        num = self._ids[key] = self._alloc()
+        pending.append((ref, num))
+        return IndirectObject(num, 0, None)
+
+    def _copy(self, digest, obj, pending):
+        """Copia un objeto directo traduciendo sus referencias (las nuevas van a `pending`)."""
+        if isinstance(obj, IndirectObject):
+            return self._ref(digest, obj, pending)
+        if isinstance(obj, StreamObject):
+            new = type(obj)()
+            new._data = obj._data
+            for k, v in obj.items():
+                # /Length se recalcula al escribir; copiarlo arrastraría un objeto de más
+                if k != "/Length":
+                    new[k] = self._copy(digest, v, pending)
+            return new
+        if isinstance(obj, DictionaryObject):
+            new = DictionaryObject()
+            for k, v in obj.items():
+                new[k] = self._copy(digest, v, pending)
+            return new
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(self._copy(digest, v, pending) for v in obj)
+        return obj
+
+    def _drain(self, reader, digest, pending, stats):
+        while pending:
+            ref, num = pending.pop()
+            obj = reader.get_object(ref)
+            if obj is None or (isinstance(obj, DictionaryObject) and obj.get("/Type") in ("/Pages", "/Catalog")):
+                # Referencias al árbol de páginas o al catálogo del anexo (p. ej. desde
+                # anotaciones): no se copian, arrastrarían el documento entero
+                obj = NullObject()
+            else:
+                obj = self._copy(digest, obj, pending)
+            self._write(num, obj)
+            stats.objects += 1
+
+    @staticmethod
+    def _trim_cache(reader):
+        # Se conservan solo los object streams (descomprimirlos de nuevo sería caro)
+        if len(reader.resolved_objects) > _READER_CACHE_LIMIT:
+            reader.resolved_objects = {
+                k: v for k, v in reader.resolved_objects.items()
+                if isinstance(v, StreamObject) and v.get("/Type") == "/ObjStm"
+            }
+
+    def _add_page(self, page_dict):
+        num = self._alloc()
+        self._write(num, page_dict)
+        self._kids.append(IndirectObject(num, 0, None))
+
+    def _register_pages(self, reader, digest, wanted):
+        # Las páginas se numeran antes de copiar nada: las referencias entre páginas
+        # (enlaces, anotaciones) apuntan a la página ya traducida, o a null si no se eligió
+        for i, page in enumerate(reader.pages):
+            ref = page.indirect_reference
+            if ref is None:
+                continue
+            key = (digest, ref.idnum, ref.generation)
+            if i in wanted and self._ids.get(key) is None:
+                self._ids[key] = self._alloc()
+            elif key not in self._ids:
+                self._ids[key] = None
+
+    def _copy_page(self, reader, digest, page, stats):
+        pending = []
+        new = DictionaryObject()
+        for k, v in page.items():
+            if k != "/Parent":
+                new[NameObject(k)] = self._copy(digest, v, pending)
+        new[NameObject("/Parent")] = IndirectObject(_PAGES_ID, 0, None)
+        self._drain(reader, digest, pending, stats)
+        ref = page.indirect_reference
+        num = self._ids[(digest, ref.idnum, ref.generation)] if ref is not None else self._alloc()
+        self._write(num, new)
+        self._kids.append(IndirectObject(num, 0, None))
+        self._trim_cache(reader)
+        return new
+
+    def _rollback(self, digest, kids, known, first_id):
+        # Las páginas ya escritas de un documento que falló salen del árbol; sus objetos
+        # quedan en el archivo sin referencias (los lectores los ignoran). Los números
+        # asignados desde `first_id` se olvidan: algunos nunca se escribieron, y volver a
+        # agregar el mismo documento los reutilizaría apuntando a nada
+        del self._kids[kids:]
+        done = self._pages[digest]
+        for i in [i for i in done if i not in known]:
+            del done[i]
+        for key in [k for k, num in self._ids.items() if num is not None and num >= first_id]:
+            del self._ids[key]
+
+    # ----------------------------
+    # API
+    # ----------------------------
+    def add(self, source, name, digest=None, pages=None, budget=None) -> PartStats:
+        """Agrega las páginas de `source` (bytes o ruta) y regresa su `PartStats`.
+
+        `pages` es una selección como "1-3,7" o "última" (ver `ficha.pages.parse_pages`);
+        None agrega todas. Con `budget` (segundos) lanza AttachmentError si copiar las
+        páginas tarda más. Si falla, el documento queda sin ninguna de sus páginas y se
+        pueden seguir agregando otros.
+        """
+        t0 = time.perf_counter()
+        deadline = t0 + budget if budget else None
+        start = self._out.pos
+        stats = PartStats(name)
+        digest = digest or content_hash(source)
+        done = self._pages.setdefault(digest, {})
+        checkpoint = (len(self._kids), set(done), self._next_id)
+
+        reader = fh = None
+        try:
+            n_pages = self._counts.get(digest)
+            if n_pages is None:
+                reader, fh = _open_reader(source, name)
+                n_pages = self._counts[digest] = len(reader.pages)
+            try:
+                wanted = parse_pages(pages, n_pages)
+            except ValueError as e:
+                raise AttachmentError(name, f"selección de páginas: {e}") from e
+            if wanted is None:
+                wanted = range(n_pages)
+
+            missing = {i for i in wanted if i not in done}
+            if missing:
+                if reader is None:
+                    reader, fh = _open_reader(source, name)
+                self._register_pages(reader, digest, missing)
+            for i in wanted:
+                if deadline is not None and time.perf_counter() > deadline:
+                    raise AttachmentError(name, f"tardó más de {budget:g} s en unirse")
+                if i in done:
+                    # Página de un anexo idéntico ya escrito: solo un diccionario de página nuevo
+                    self._add_page(done[i])
+                else:
+                    done[i] = self._copy_page(reader, digest, reader.pages[i], stats)
+        except (AttachmentError, OSError):
+            self._rollback(digest, *checkpoint)
+            raise
+        except Exception as e:
+            self._rollback(digest, *checkpoint)
+            raise _pdf_error(name, e) from e
+        finally:
+            if fh:
+                fh.close()
+
+        stats.duplicate = not missing
+        stats.pages = len(wanted)
+        stats.bytes_out = self._out.pos - start
+        stats.seconds = time.perf_counter() - t0
+        self.stats.append(stats)
+        return stats
+
+    def close(self):
+        """Escribe el árbol de páginas, el catálogo, la tabla xref y el trailer."""
+        self._write(_PAGES_ID, DictionaryObject({
+            NameObject("/Type"): NameObject("/Pages"),
+            NameObject("/Kids"): ArrayObject(self._kids),
+            NameObject("/Count"): NumberObject(len(self._kids)),
+        }))
+        self._write(_CATALOG_ID, DictionaryObject({
+            NameObject("/Type"): NameObject("/Catalog"),
+            NameObject("/Pages"): IndirectObject(_PAGES_ID, 0, None),
+        }))
+
+        xref_pos = self._out.pos
+        size = self._next_id
+        lines = [b"xref\n0 %d\n" % size, b"0000000000 65535 f \n"]
+        for num in range(1, size):
+            off = self._offsets.get(num)
+            lines.append(b"%010d 00000 n \n" % off if off is not None else b"0000000000 65535 f \n")
+        self._out.write(b"".join(lines))
+        # /ID derivado de lo escrito: el mismo contenido da los mismos bytes
+        doc_id = self._out.md5.hexdigest().encode()
+        self._out.write(
+            b"trailer\n<< /Size %d /Root %d 0 R /ID [<%s> <%s>] >>\nstartxref\n%d\n%%%%EOF\n"
+            % (size, _CATALOG_ID, doc_id, doc_id, xref_pos)
+        )
@@ -0,0 +1,258 @@
+"""Instrumentación por etapa del render (spans).
+
+Cada render puede llevar un `Trace` con un span por etapa (spool de uploads, conversión de
+cada anexo, ficha base, merge, transferencia): duración, bytes de entrada/salida, páginas
+y pico de RSS. Al terminar (`Trace.finish`) los spans se:
+
+- escriben como líneas JSON en el logger "ficha.metrics" (nivel INFO),
+- acumulan en un registro del proceso exportable en formato de texto de Prometheus, ya
+  sea a un archivo (FICHA_METRICS_FILE, para el textfile collector de node_exporter) o
+  por HTTP (FICHA_METRICS_PORT, `start_metrics_server`).
+
+Desactivado (sin FICHA_METRICS=1 y sin pedir un Trace explícito) se usa `NULL_TRACE`,
+cuyos spans no miden nada: el costo es una llamada a función por etapa.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from ficha.memory import MemoryProbe
+
+logger = logging.getLogger("ficha.metrics")
+
+# Cubetas (s) del histograma de duración total del render
+RENDER_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def enabled() -> bool:
+    return os.environ.get("FICHA_METRICS") == "1"
+
+
+class Span:
+    __slots__ = ("stage", "seconds", "bytes_in", "bytes_out", "pages", "peak_rss", "attrs")
+
+    def __init__(self, stage, **attrs):
+        self.stage = stage
+        self.seconds = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.pages = 0
+        self.peak_rss = 0
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def as_dict(self) -> dict:
+        d = {
+            "stage": self.stage,
+            "ms": round(self.seconds * 1000, 2),
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "pages": self.pages,
+            "peak_rss": self.peak_rss,
+        }
+        d.update(self.attrs)
+        return d
+
+
+class Trace:
+    """Spans de un render."""
+
+    def __init__(self, render_id=None, registry=None, memory=True):
+        self.render_id = render_id or uuid.uuid4().hex[:12]
+        self.registry = registry if registry is not None else REGISTRY
+        self.memory = memory
+        self.spans = []
+        self._lock = threading.Lock()
+        self._t0 = time.perf_counter()
+
+    def __bool__(self):
+        return True
+
+    @contextmanager
+    def span(self, stage, **attrs):
+        """Mide el bloque; el código puede llenar bytes_in/bytes_out/pages del span que recibe."""
+        s = Span(stage, **attrs)
+        probe = MemoryProbe() if self.memory else None
+        if probe:
+            probe.__enter__()
+        t0 = time.perf_counter()
+        try:
+            yield s
+        finally:
+            s.seconds = time.perf_counter() - t0
+            if probe:
+                probe.__exit__(None, None, None)
+                s.peak_rss = probe.peak_rss
+            self._append(s)
+
+    def add(self, stage, seconds, **fields):
+        """Registra un span medido en otro lado (p. ej. dentro de un proceso del pool)."""
+        s = Span(stage)
+        s.seconds = seconds
+        for k, v in fields.items():
+            if k in ("bytes_in", "bytes_out", "pages", "peak_rss"):
+                setattr(s, k, v)
+            else:
+                s.attrs[k] = v
+        self._append(s)
+        return s
+
+    def _append(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def rows(self) -> list:
+        return [s.as_dict() for s in self.spans]
+
+    def finish(self):
+        """Cierra el trace: log estructurado, registro de Prometheus y archivo de métricas."""
+        total = time.perf_counter() - self._t0
+        for s in self.spans:
+            logger.info(json.dumps({"event": "span", "render_id": self.render_id, **s.as_dict()}, ensure_ascii=False))
+        logger.info(json.dumps({"event": "render", "render_id": self.render_id, "ms": round(total * 1000, 2),
+                                "spans": len(self.spans)}))
+        self.registry.observe(self.spans, total)
+        path = os.environ.get("FICHA_METRICS_FILE")
+        if path:
+            self.registry.write_textfile(path)
+        return total
+
+
+class _NullSpan:
+    """Span que acepta asignaciones y las descarta."""
+
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        pass
+
+    def __getattr__(self, name):
+        return 0
+
+    def set(self, **attrs):
+        pass
+
+
+class _NullTrace:
+    _span = _NullSpan()
+
+    def __bool__(self):
+        return False
+
+    @contextmanager
+    def span(self, stage, **attrs):
+        yield self._span
+
+    def add(self, stage, seconds, **fields):
+        return self._span
+
+    def rows(self):
+        return []
+
+    def finish(self):
+        return 0.0
+
+
+NULL_TRACE = _NullTrace()
+
+
+def new_trace(force=False, **kwargs):
+    """Un Trace real si las métricas están activas (o force=True); si no, NULL_TRACE."""
+    if force or enabled():
+        return Trace(**kwargs)
+    return NULL_TRACE
+
+
+class Registry:
+    """Acumulados del proceso por etapa, en formato de exposición de Prometheus."""
+
+    def __init__(self, buckets=RENDER_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._render_count = 0
+        self._render_sum = 0.0
+        self._render_buckets = [0] * len(buckets)
+
+    def observe(self, spans, total_seconds):
+        with self._lock:
+            for s in spans:
+                acc = self._stages.setdefault(s.stage, [0, 0.0, 0, 0, 0])
+                acc[0] += 1
+                acc[1] += s.seconds
+                acc[2] += s.bytes_in
+                acc[3] += s.bytes_out
+                acc[4] += s.pages
+            self._render_count += 1
+            self._render_sum += total_seconds
+            for i, b in enumerate(self.buckets):
+                if total_seconds <= b:
+                    self._render_buckets[i] += 1
+
+    def render(self) -> str:
+        with self._lock:
+            stages = {k: list(v) for k, v in self._stages.items()}
+            count, total, buckets = self._render_count, self._render_sum, list(self._render_buckets)
+        out = []
+        metrics = (
+            ("ficha_stage_calls_total", "counter", "Veces que se ejecutó la etapa", 0),
+            ("ficha_stage_seconds_total", "counter", "Segundos acumulados por etapa", 1),
+            ("ficha_stage_bytes_in_total", "counter", "Bytes de entrada por etapa", 2),
+            ("ficha_stage_bytes_out_total", "counter", "Bytes de salida por etapa", 3),
+            ("ficha_stage_pages_total", "counter", "Páginas producidas por etapa", 4),
+        )
+        for name, kind, help_text, idx in metrics:
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+            for stage, acc in sorted(stages.items()):
+                out.append(f'{name}{{stage="{stage}"}} {acc[idx]}')
+        out.append("# HELP ficha_render_seconds Duración total del render")
+        out.append("# TYPE ficha_render_seconds histogram")
+        for b, n in zip(self.buckets, buckets):
+            out.append(f'ficha_render_seconds_bucket{{le="{b}"}} {n}')
+        out.append(f'ficha_render_seconds_bucket{{le="+Inf"}} {count}')
+        out.append(f"ficha_render_seconds_sum {total}")
+        out.append(f"ficha_render_seconds_count {count}")
+        return "\n".join(out) + "\n"
+
+    def write_textfile(self, path):
+        """Escritura atómica (para que el collector nunca lea un archivo a medias)."""
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+
+REGISTRY = Registry()
+
+
+def start_metrics_server(port, host="127.0.0.1", registry=None):
+    """Sirve GET /metrics en un hilo de fondo. Regresa el servidor (para `shutdown`)."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    registry = registry or REGISTRY
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="ficha-metrics", daemon=True).start()
+    return server
@@ -0,0 +1,435 @@
+"""Optimización de tamaño del PDF final, después del merge.
+
+`PageMerger` copia los streams tal cual y escribe cada objeto suelto con una tabla xref
+clásica. Esta pasada reescribe el documento completo:
+
+- quita las capas de texto de los filtros (ASCII85/ASCIIHex encima de Flate/DCT, +25 %
+  en cada imagen: así vienen anexos hechos con ReportLab y páginas convertidas que ya
+  estaban en caché) y comprime con Flate (nivel 9) los streams que no son imágenes,
+- deduplica objetos idénticos de todas las partes: fuentes, diccionarios de recursos,
+  imágenes repetidas (dos anexos con la misma foto, el logo de cada página...). Se itera
+  hasta un punto fijo, así que un objeto que solo difería en a qué duplicado apuntaba
+  también se une,
+- agrupa los objetos que no son streams en object streams comprimidos y escribe una
+  tabla xref en stream (PDF 1.5+),
+- descarta lo que no se alcanza desde el catálogo.
+
+Con `target_bytes` (modo "tamaño objetivo") si el resultado no cabe se recodifican las
+imágenes (JPEG, o raster Flate RGB/gris de 8 bits) con calidad cada vez menor (ver
+`TARGET_QUALITIES`) hasta que quepa o se acaben los pasos; cada paso se reporta con su
+tamaño y tiempo. Una imagen solo se reemplaza si la versión nueva es más chica.
+
+La memoria no crece con el tamaño de los anexos: los datos de los streams ya procesados
+van a un archivo temporal y solo los diccionarios se quedan en memoria.
+"""
+import base64
+import hashlib
+import io
+import os
+import re
+import shutil
+import tempfile
+import time
+import zlib
+from collections import namedtuple
+
+from PyPDF2 import PdfReader
+from PyPDF2.generic import (
+    ArrayObject,
+    DictionaryObject,
+    IndirectObject,
+    NameObject,
+    NullObject,
+    NumberObject,
+    StreamObject,
+)
+
+from ficha.spool import is_spooled
+
+_HEADER = b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n"
+
+# Objetos por object stream
+_OBJSTM_SIZE = 100
+
+# Calidades JPEG que prueba el modo de tamaño objetivo, en orden
+TARGET_QUALITIES = (75, 60, 45, 30, 20)
+
+# Se reescriben como referencias nuevas, nunca se unen: una página debe aparecer una sola
+# vez en el árbol aunque dos anexos idénticos tengan páginas idénticas
+_NO_DEDUP = ("/Page", "/Pages", "/Catalog")
+
+_ASCII_FILTERS = ("/ASCII85Decode", "/A85", "/ASCIIHexDecode", "/AHx")
+
+# Un paso de la optimización: tamaño del archivo resultante y lo que tardó
+OptimizeStep = namedtuple("OptimizeStep", "step quality bytes_out seconds")
+
+
+def _ascii_decode(name, data) -> bytes:
+    data = re.sub(rb"\s+", b"", bytes(data))
+    if name in ("/ASCII85Decode", "/A85"):
+        if data.startswith(b"<~"):
+            data = data[2:]
+        return base64.a85decode(data.split(b"~>")[0])
+    data = data.split(b">")[0]
+    return bytes.fromhex((data + b"0" * (len(data) % 2)).decode("ascii"))
+
+
+def _filters(stream):
+    filters = stream.get("/Filter")
+    parms = stream.get("/DecodeParms")
+    if filters is None:
+        return [], []
+    if not isinstance(filters, ArrayObject):
+        filters, parms = [filters], [parms]
+    elif not isinstance(parms, ArrayObject):
+        parms = [parms] * len(filters) if parms is None else [parms]
+    parms = list(parms) + [None] * (len(filters) - len(parms))
+    return [str(f) for f in filters], parms
+
+
+class _Stream:
+    """Stream ya procesado: su diccionario (sin /Length) y dónde quedaron sus datos."""
+
+    __slots__ = ("dict", "offset", "length", "digest", "image")
+
+    def __init__(self, d, offset, length, digest, image):
+        self.dict = d
+        self.offset = offset
+        self.length = length
+        self.digest = digest
+        self.image = image
+
+
+def _image_mode(d):
+    """Modo de Pillow si la imagen se puede recodificar como JPEG; None si no."""
+    if d.get("/Subtype") != "/Image" or d.get("/ImageMask") or d.get("/BitsPerComponent") != 8 or "/Decode" in d:
+        return None
+    return {"/DeviceRGB": "RGB", "/DeviceGray": "L"}.get(d.get("/ColorSpace"))
+
+
+class _Document:
+    """Objetos alcanzables del PDF, con los streams ya limpios en un spool en disco."""
+
+    def __init__(self, source, spool):
+        self.spool = spool
+        self.objects = {}
+        fh = open(source, "rb") if is_spooled(source) else None
+        try:
+            reader = PdfReader(fh or io.BytesIO(source), strict=False)
+            self.root = reader.trailer.raw_get("/Root").idnum
+            info = reader.trailer.raw_get("/Info") if "/Info" in reader.trailer else None
+            self.info = info.idnum if isinstance(info, IndirectObject) else None
+            self._load(reader)
+        finally:
+            if fh:
+                fh.close()
+        self.canon = {num: num for num in self.objects}
+        # Las máscaras de transparencia no se recodifican con pérdida (dejarían halos)
+        for obj in self.objects.values():
+            smask = obj.dict.raw_get("/SMask") if isinstance(obj, _Stream) and "/SMask" in obj.dict else None
+            if isinstance(smask, IndirectObject) and isinstance(self.objects.get(smask.idnum), _Stream):
+                self.objects[smask.idnum].image = False
+
+    def _load(self, reader):
+        todo = [self.root] + ([self.info] if self.info else [])
+        seen = set(todo)
+        while todo:
+            num = todo.pop()
+            obj = reader.get_object(IndirectObject(num, 0, reader))
+            if obj is None:
+                obj, refs = NullObject(), ()
+            elif isinstance(obj, StreamObject):
+                obj = self._spool_stream(obj)
+                refs = _refs(obj.dict)
+            else:
+                refs = _refs(obj)
+            self.objects[num] = obj
+            for ref in refs:
+                if ref not in seen:
+                    seen.add(ref)
+                    todo.append(ref)
+            # Los datos ya están en el spool: el caché del lector no debe retenerlos
+            reader.resolved_objects.pop((0, num), None)
+
+    def _spool_stream(self, stream):
+        data = stream._data
+        filters, parms = _filters(stream)
+        while filters and filters[0] in _ASCII_FILTERS:
+            data = _ascii_decode(filters.pop(0), data)
+            parms.pop(0)
+        d = DictionaryObject({NameObject(k): v for k, v in stream.items()
+                              if k not in ("/Length", "/Filter", "/DecodeParms")})
+        image = d.get("/Subtype") == "/Image"
+        if not image and not any(parms):
+            if not filters:
+                packed = zlib.compress(data, 9)
+                if len(packed) < len(data):
+                    data, filters = packed, ["/FlateDecode"]
+            elif filters == ["/FlateDecode"]:
+                try:
+                    data = self._deflate(zlib.decompress(data), data)
+                except zlib.error:
+                    pass
+        if filters:
+            d[NameObject("/Filter")] = (NameObject(filters[0]) if len(filters) == 1
+                                        else ArrayObject(NameObject(f) for f in filters))
+        if any(parms):
+            d[NameObject("/DecodeParms")] = (parms[0] if len(parms) == 1
+                                             else ArrayObject(p if p is not None else NullObject() for p in parms))
+        return self.write_data(d, data, image=image and _image_mode(d) is not None and
+                               filters in (["/DCTDecode"], ["/FlateDecode"]) and not any(parms))
+
+    @staticmethod
+    def _deflate(raw, current):
+        packed = zlib.compress(raw, 9)
+        return packed if len(packed) < len(current) else current
+
+    def write_data(self, d, data, image=False):
+        self.spool.seek(0, os.SEEK_END)
+        offset = self.spool.tell()
+        self.spool.write(data)
+        return _Stream(d, offset, len(data), hashlib.sha256(data).digest(), image)
+
+    def read_data(self, stream) -> bytes:
+        self.spool.seek(stream.offset)
+        return self.spool.read(stream.length)
+
+    # ----------------------------
+    # Deduplicación
+    # ----------------------------
+    def dedup(self) -> int:
+        """Une objetos idénticos (hasta un punto fijo). Regresa cuántos se eliminaron."""
+        while True:
+            groups = {}
+            for num in sorted(self.objects):
+                if self.canon[num] != num:
+                    continue
+                obj = self.objects[num]
+                d = obj.dict if isinstance(obj, _Stream) else obj
+                if isinstance(d, DictionaryObject) and d.get("/Type") in _NO_DEDUP:
+                    continue
+                key = _serialize(d, self.canon)
+                if isinstance(obj, _Stream):
+                    key += b"\x00stream" + obj.digest
+                groups.setdefault(key, []).append(num)
+            changed = False
+            for nums in groups.values():
+                for num in nums[1:]:
+                    self.canon[num] = nums[0]
+                    changed = True
+            if not changed:
+                break
+            # Los que apuntaban a un objeto ya unido apuntan ahora a su canónico
+            for num, target in self.canon.items():
+                self.canon[num] = self.canon[target]
+        return sum(1 for num, target in self.canon.items() if num != target)
+
+
+def _refs(obj):
+    if isinstance(obj, IndirectObject):
+        yield obj.idnum
+    elif isinstance(obj, DictionaryObject):
+        for v in obj.values():
+            yield from _refs(v)
+    elif isinstance(obj, ArrayObject):
+        for v in obj:
+            yield from _refs(v)
+
+
+def _remap(obj, canon):
+    if isinstance(obj, IndirectObject):
+        return IndirectObject(canon.get(obj.idnum, obj.idnum), 0, None)
+    if isinstance(obj, DictionaryObject):
+        return DictionaryObject({k: _remap(v, canon) for k, v in obj.items()})
+    if isinstance(obj, ArrayObject):
+        return ArrayObject(_remap(v, canon) for v in obj)
+    return obj
+
+
+def _serialize(obj, canon) -> bytes:
+    buf = io.BytesIO()
+    _remap(obj, canon).write_to_stream(buf, None)
+    return buf.getvalue()
+
+
+# ----------------------------
+# Recodificación de imágenes
+# ----------------------------
+def _recompress(doc, stream, quality):
+    """Datos JPEG de la imagen a `quality`, o None si no se puede o no queda más chica."""
+    from PIL import Image
+
+    d = stream.dict
+    mode = _image_mode(d)
+    data = doc.read_data(stream)
+    try:
+        if d.get("/Filter") == "/DCTDecode":
+            img = Image.open(io.BytesIO(data))
+            img.draft(mode, img.size)
+            img = img.convert(mode)
+        else:
+            img = Image.frombytes(mode, (int(d["/Width"]), int(d["/Height"])), zlib.decompress(data))
+    except Exception:
+        return None
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=quality, optimize=True)
+    return out.getvalue() if out.tell() < len(data) else None
+
+
+def _with_quality(doc, streams, quality):
+    """Copia de `streams` con las imágenes recodificadas a `quality` (las que se achican)."""
+    result = dict(streams)
+    for num, stream in streams.items():
+        if not stream.image or doc.canon[num] != num:
+            continue
+        data = _recompress(doc, stream, quality)
+        if data is None:
+            continue
+        d = DictionaryObject(stream.dict)
+        d[NameObject("/Filter")] = NameObject("/DCTDecode")
+        d.pop("/DecodeParms", None)
+        result[num] = doc.write_data(d, data, image=True)
+    return result
+
+
+# ----------------------------
+# Escritura
+# ----------------------------
+class _CountingWriter:
+    def __init__(self, f):
+        self.f = f
+        self.pos = 0
+        self.md5 = hashlib.md5()
+
+    def write(self, data):
+        self.f.write(data)
+        self.pos += len(data)
+        self.md5.update(data)
+
+
+def _write(doc, streams, f):
+    """Escribe el documento: streams sueltos, el resto en object streams, xref en stream."""
+    out = _CountingWriter(f)
+    out.write(_HEADER)
+    canon = doc.canon
+    live = sorted(num for num in doc.objects if canon[num] == num)
+    entries = {}
+
+    for num in live:
+        obj = doc.objects[num]
+        if not isinstance(obj, _Stream):
+            continue
+        stream = streams[num]
+        d = _remap(stream.dict, canon)
+        d[NameObject("/Length")] = NumberObject(stream.length)
+        entries[num] = (1, out.pos, 0)
+        out.write(b"%d 0 obj\n" % num)
+        d.write_to_stream(out, None)
+        out.write(b"\nstream\n")
+        out.write(doc.read_data(stream))
+        out.write(b"\nendstream\nendobj\n")
+
+    next_id = max(doc.objects) + 1
+    plain = [num for num in live if not isinstance(doc.objects[num], _Stream)]
+    for start in range(0, len(plain), _OBJSTM_SIZE):
+        chunk = plain[start:start + _OBJSTM_SIZE]
+        stm_id, next_id = next_id, next_id + 1
+        index, body = [], io.BytesIO()
+        for i, num in enumerate(chunk):
+            index.append(b"%d %d" % (num, body.tell()))
+            _remap(doc.objects[num], canon).write_to_stream(body, None)
+            body.write(b"\n")
+            entries[num] = (2, stm_id, i)
+        head = b" ".join(index) + b"\n"
+        data = zlib.compress(head + body.getvalue(), 9)
+        entries[stm_id] = (1, out.pos, 0)
+        out.write(b"%d 0 obj\n<< /Type /ObjStm /N %d /First %d /Filter /FlateDecode /Length %d >>\nstream\n"
+                  % (stm_id, len(chunk), len(head), len(data)))
+        out.write(data)
+        out.write(b"\nendstream\nendobj\n")
+
+    xref_id = next_id
+    size = xref_id + 1
+    xref_pos = out.pos
+    entries[xref_id] = (1, xref_pos, 0)
+    rows = b"".join(
+        b"%c%s%s" % (t, a.to_bytes(4, "big"), b.to_bytes(2, "big"))
+        for t, a, b in (entries.get(num, (0, 0, 0 if num else 65535)) for num in range(size))
+    )
+    data = zlib.compress(rows, 9)
+    # /ID derivado de lo escrito: el mismo contenido da los mismos bytes
+    doc_id = out.md5.hexdigest().encode()
+    info = b" /Info %d 0 R" % canon[doc.info] if doc.info else b""
+    out.write(b"%d 0 obj\n<< /Type /XRef /Size %d /W [1 4 2] /Root %d 0 R%s /ID [<%s> <%s>] "
+              b"/Filter /FlateDecode /Length %d >>\nstream\n"
+              % (xref_id, size, canon[doc.root], info, doc_id, doc_id, len(data)))
+    out.write(data)
+    out.write(b"\nendstream\nendobj\nstartxref\n%d\n%%%%EOF\n" % xref_pos)
+    return out.pos
+
+
+# ----------------------------
+# API
+# ----------------------------
+def optimize_pdf(source, out, target_bytes=None, qualities=TARGET_QUALITIES, trace=None) -> list:
+    """Escribe en `out` (ruta o archivo binario) la versión optimizada de `source` (bytes o ruta).
+
+    Regresa un `OptimizeStep` por paso: "read" (lectura y limpieza de streams), "dedup",
+    "write" y, con `target_bytes`, un "quality" por cada calidad probada. El último paso
+    es el que quedó en `out`; si su `bytes_out` sigue arriba de `target_bytes` es que ni la
+    calidad más baja alcanzó. `trace` recibe un span "optimize_step" por paso.
+    """
+    steps = []
+
+    def step(name, t0, bytes_out=0, quality=None):
+        s = OptimizeStep(name, quality, bytes_out, time.perf_counter() - t0)
+        steps.append(s)
+        if trace:
+            trace.add("optimize_step", s.seconds, step=name, quality=quality, bytes_out=bytes_out)
+        return s
+
+    with tempfile.TemporaryDirectory(prefix="ficha-opt-") as tmp:
+        with open(os.path.join(tmp, "streams"), "w+b") as spool:
+            t0 = time.perf_counter()
+            doc = _Document(source, spool)
+            step("read", t0)
+            t0 = time.perf_counter()
+            doc.dedup()
+            step("dedup", t0)
+
+            streams = {num: obj for num, obj in doc.objects.items() if isinstance(obj, _Stream)}
+            if target_bytes is None:
+                t0 = time.perf_counter()
+                step("write", t0, _write_to(out, lambda f: _write(doc, streams, f)))
+                return steps
+
+            # Cada intento va a un temporal; el que queda se copia a `out`
+            best = os.path.join(tmp, "best.pdf")
+            t0 = time.perf_counter()
+            with open(best, "wb") as f:
+                size = _write(doc, streams, f)
+            step("write", t0, size)
+            images = any(streams[num].image for num in streams if doc.canon[num] == num)
+            for quality in qualities if images else ():
+                if size <= target_bytes:
+                    break
+                t0 = time.perf_counter()
+                attempt = os.path.join(tmp, "attempt.pdf")
+                with open(attempt, "wb") as f:
+                    size = _write(doc, _with_quality(doc, streams, quality), f)
+                os.replace(attempt, best)
+                step("quality", t0, size, quality)
+            _write_to(out, lambda f: _copy_file(best, f))
+    return steps
+
+
+def _write_to(out, fn):
+    if isinstance(out, (str, os.PathLike)):
+        with open(out, "wb") as f:
+            return fn(f)
+    return fn(out)
+
+
+def _copy_file(path, f):
+    with open(path, "rb") as src:
+        shutil.copyfileobj(src, f, 1024 * 1024)
@@ -0,0 +1,79 @@
+"""Selección de páginas de los PDFs anexos ("1-3,7", "última", "5-última").
+
+`parse_pages` no tiene dependencias (la UI la usa para validar mientras se escribe);
+`page_count` importa PyPDF2 solo cuando se llama.
+"""
+import io
+import re
+
+from ficha.spool import is_spooled
+
+ALL_PAGES = ("", "todas", "todo", "all")
+LAST_PAGE = ("última", "ultima", "u", "last")
+
+_ITEM = re.compile(r"^(\w+)?\s*(-)?\s*(\w+)?$")
+
+
+def _page_number(token, n_pages):
+    if token.lower() in LAST_PAGE:
+        return n_pages
+    if not token.isdigit():
+        raise ValueError(f"'{token}' no es un número de página")
+    return int(token)
+
+
+def parse_pages(spec, n_pages):
+    """Índices (base 0, en el orden escrito, sin repetir) que selecciona `spec`.
+
+    `spec` usa números de página desde 1 separados por comas: "1-3,7", "última",
+    "5-última", "2-" (de la 2 al final) o "-3" (de la 1 a la 3). Vacío o "todas" regresa
+    None (todas las páginas). Lanza ValueError con un mensaje para el usuario.
+    """
+    spec = (spec or "").strip()
+    if spec.lower() in ALL_PAGES:
+        return None
+    selected, seen = [], set()
+    for item in spec.split(","):
+        item = item.strip()
+        m = _ITEM.match(item)
+        if not item or not m:
+            raise ValueError(f"no se entiende '{item}' (usa p. ej. 1-3,7 o última)")
+        start, dash, end = m.groups()
+        if not dash:
+            first = last = _page_number(start, n_pages)
+        else:
+            first = _page_number(start, n_pages) if start else 1
+            last = _page_number(end, n_pages) if end else n_pages
+        for page in (first, last):
+            if not 1 <= page <= n_pages:
+                raise ValueError(f"la página {page} no existe (el PDF tiene {n_pages})")
+        if first > last:
+            raise ValueError(f"rango invertido '{item}'")
+        for page in range(first - 1, last):
+            if page not in seen:
+                seen.add(page)
+                selected.append(page)
+    return selected
+
+
+def page_count(source, name="PDF") -> int:
+    """Número de páginas leyendo solo la tabla xref y el /Count del árbol de páginas.
+
+    No recorre el árbol ni carga las páginas; en un PDF en disco solo lee el final del
+    archivo y un par de objetos. Lanza AttachmentError si el PDF no se puede abrir.
+    """
+    from PyPDF2 import PdfReader
+
+    from ficha.merge import _pdf_error
+
+    fh = open(source, "rb") if is_spooled(source) else None
+    try:
+        reader = PdfReader(fh or io.BytesIO(source), strict=False)
+        return int(reader.trailer["/Root"].get_object()["/Pages"].get_object()["/Count"])
+    except OSError:
+        raise
+    except Exception as e:
+        raise _pdf_error(name, e) from e
+    finally:
+        if fh:
+            fh.close()
@@ -0,0 +1,506 @@
+"""Renderizado de la ficha médica a PDF (sin dependencias de Streamlit)."""
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from functools import partial
+
+# PDF (ReportLab)
+from reportlab import rl_config
+from reportlab.lib.pagesizes import LETTER
+from reportlab.pdfgen import canvas
+from reportlab.lib.units import inch
+from reportlab.lib.utils import ImageReader
+from PIL import Image
+
+from ficha.cache import content_hash, page_key
+from ficha.errors import AttachmentError
+from ficha.images import (
+    DEFAULT_DPI,
+    DEFAULT_QUALITY,
+    JpegImage,
+    can_passthrough,
+    downsample_image,
+    probe_image,
+)
+from ficha.merge import PageMerger
+from ficha.metrics import new_trace
+from ficha.optimize import optimize_pdf
+from ficha.spool import SPOOL_THRESHOLD, Spool, is_spooled, part_size, read_part
+from ficha.template import render_ficha
+from ficha.validate import BUDGET_GRACE, DEFAULT_LIMITS, budget, sniff_kind, validate_attachment
+from ficha.workers import get_process_pool
+
+
+# Sin la capa ASCII85 que ReportLab pone encima de Flate/DCT en cada página e imagen
+# (+25 % de tamaño; solo sirve para PDFs que viajan como texto). Aplica a todo el proceso
+# (también a los workers del pool, que importan este módulo)
+rl_config.useA85 = 0
+
+
+# ----------------------------
+# Helpers PDF
+# ----------------------------
+def build_base_pdf(data: dict, generated_at=None, invariant=False) -> bytes:
+    """Construye PDF base (ficha + listado de anexos) y regresa bytes.
+
+    `generated_at` es el texto de la línea "Generado:" (por defecto la hora actual). Con
+    invariant=True ReportLab omite la fecha de creación y el ID aleatorio del documento:
+    los mismos datos producen exactamente los mismos bytes.
+    """
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer, pagesize=LETTER, invariant=1 if invariant else None)
+    render_ficha(c, data, generated_at or datetime.now().strftime("%Y-%m-%d %H:%M"))
+    c.save()
+    return buffer.getvalue()
+
+
+def image_to_pdf_page(image_bytes: bytes, title: str, dpi=DEFAULT_DPI, quality=DEFAULT_QUALITY) -> bytes:
+    """Convierte una imagen a un PDF (1 página) y regresa bytes."""
+    buf = io.BytesIO()
+    write_image_page(buf, image_bytes, title, dpi=dpi, quality=quality)
+    return buf.getvalue()
+
+
+def write_image_page(out, image, title: str, dpi=DEFAULT_DPI, quality=DEFAULT_QUALITY):
+    """Escribe en `out` (ruta o archivo binario) un PDF de 1 página con la imagen.
+
+    `image` son los bytes de la imagen o la ruta al archivo. Un JPEG que ya cabe en la
+    resolución objetivo se incrusta sin decodificar ni recodificar; el resto se remuestrea
+    a `dpi` para el recuadro donde se dibuja y se recodifica con `quality`. Con dpi=None
+    se incrusta a resolución original.
+    """
+    c = canvas.Canvas(out, pagesize=LETTER)
+    width, height = LETTER
+
+    left = 0.75 * inch
+    right = 0.75 * inch
+    top = height - 0.75 * inch
+    bottom = 0.75 * inch
+
+    c.setFont("Helvetica-Bold", 12)
+    c.drawString(left, top, f"Anexo (Imagen): {title}")
+    y = top - 18
+
+    box_w = width - left - right
+    box_h = (y - bottom)
+
+    probe = probe_image(image)
+    if can_passthrough(probe, box_w, box_h, dpi):
+        # Camino rápido: el JPEG ya cabe en la resolución objetivo, se incrusta tal cual
+        embed_jpeg, (img_w, img_h) = True, (probe.width, probe.height)
+    elif dpi:
+        image, fmt, (img_w, img_h) = downsample_image(image, box_w, box_h, dpi=dpi, quality=quality)
+        embed_jpeg = fmt == "JPEG"
+    else:
+        embed_jpeg, (img_w, img_h) = False, (probe.width, probe.height)
+
+    scale = min(box_w / img_w, box_h / img_h)
+    draw_w = img_w * scale
+    draw_h = img_h * scale
+
+    x = left + (box_w - draw_w) / 2
+    y_img = bottom + (box_h - draw_h) / 2
+
+    if embed_jpeg:
+        drawable = JpegImage(read_part(image), (img_w, img_h))
+    elif is_spooled(image):
+        drawable = ImageReader(image)
+    else:
+        drawable = ImageReader(io.BytesIO(image))
+    c.drawImage(drawable, x, y_img, width=draw_w, height=draw_h, preserveAspectRatio=True, mask="auto")
+    c.showPage()
+    c.save()
+
+
+def merge_pdfs(pdf_bytes_list: list[bytes]) -> bytes:
+    out = io.BytesIO()
+    write_merged_pdf(pdf_bytes_list, out)
+    return out.getvalue()
+
+
+def write_merged_pdf(parts, out, names=None, digests=None, pages=None, on_part=None, budget=None,
+                     on_error=None) -> list:
+    """Une las partes (bytes o rutas a PDFs en disco) y escribe el resultado en `out`.
+
+    Usa `PageMerger`: cada parte se abre una vez, sus páginas se copian por demanda y
+    las partes idénticas se escriben una sola vez. `names` (para los mensajes de error),
+    `digests` (hashes ya calculados) y `pages` (selección de páginas por parte, p. ej.
+    "1-3,7") son opcionales. `on_part(i, stats)` se llama al terminar cada parte.
+    `budget` son los segundos máximos por parte; con `on_error(i, error)` una parte que
+    lanza AttachmentError se omite en lugar de abortar. Regresa un `PartStats` por parte unida.
+    """
+    names = names or [f"parte {i + 1}" for i in range(len(parts))]
+    digests = digests or [None] * len(parts)
+    pages = pages or [None] * len(parts)
+    if isinstance(out, (str, os.PathLike)):
+        with open(out, "wb") as f:
+            return write_merged_pdf(parts, f, names, digests, pages, on_part, budget, on_error)
+    merger = PageMerger(out)
+    for i, (part, name, digest, selection) in enumerate(zip(parts, names, digests, pages)):
+        try:
+            stats = merger.add(part, name, digest, selection, budget=budget)
+        except AttachmentError as e:
+            if on_error is None:
+                raise
+            on_error(i, e)
+            continue
+        if on_part:
+            on_part(i, stats)
+    merger.close()
+    return merger.stats
+
+
+def attachment_kind(name: str, source=None):
+    """"pdf", "image" o None (el archivo no se anexa).
+
+    Con `source` (bytes o ruta) el tipo sale del contenido (ver ficha.validate.sniff_kind);
+    sin él, de la extensión (solo como pista, p. ej. para etiquetar).
+    """
+    if source is not None:
+        return sniff_kind(source)
+    lower = name.lower()
+    if lower.endswith(".pdf"):
+        return "pdf"
+    if lower.endswith((".png", ".jpg", ".jpeg")):
+        return "image"
+    return None
+
+
+def convert_attachment(name: str, source, dpi=DEFAULT_DPI, quality=DEFAULT_QUALITY, spool_dir=None, kind=None):
+    """Convierte un anexo a una parte PDF (None si el tipo no se anexa). Corre en el pool de procesos.
+
+    `source` son bytes o una ruta; con `spool_dir` la página de una imagen se escribe a un
+    archivo en ese directorio y se regresa su ruta en lugar de los bytes. `kind` es el
+    tipo ya detectado (si no, se lee del contenido).
+    """
+    kind = kind or attachment_kind(name, source)
+    if kind == "pdf":
+        # Se une página por página (ficha.merge abre cada PDF una sola vez)
+        return source
+    if kind == "image":
+        try:
+            if spool_dir is None:
+                return image_to_pdf_page(source, name, dpi=dpi, quality=quality)
+            fd, path = tempfile.mkstemp(suffix=".pdf", dir=spool_dir)
+            with os.fdopen(fd, "wb") as f:
+                write_image_page(f, source, name, dpi=dpi, quality=quality)
+            return path
+        except (SyntaxError, ValueError, OSError, Image.DecompressionBombError) as e:
+            # Datos dañados tras un encabezado válido (p. ej. imagen truncada); los OSError
+            # con errno son del sistema (disco), no de la imagen
+            if getattr(e, "errno", None) is not None:
+                raise
+            raise AttachmentError(name, f"imagen inválida ({e})") from None
+    return None
+
+
+def convert_within_budget(name, source, dpi=DEFAULT_DPI, quality=DEFAULT_QUALITY, spool_dir=None, kind=None,
+                          limits=DEFAULT_LIMITS):
+    """`convert_attachment` con el presupuesto de tiempo y memoria de `limits` (ver ficha.validate.budget)."""
+    with budget(name, limits.seconds, limits.memory):
+        return convert_attachment(name, source, dpi, quality, spool_dir, kind)
+
+
+def _convert_timed(name, source, dpi, quality, spool_dir, kind=None, limits=DEFAULT_LIMITS):
+    t0 = time.perf_counter()
+    part = convert_within_budget(name, source, dpi, quality, spool_dir, kind, limits)
+    return part, time.perf_counter() - t0
+
+
+def _wait_converted(future, name, seconds, retry=None):
+    """Resultado de una conversión en el pool.
+
+    Respaldo del presupuesto: si el worker no responde (atorado dentro de código C, donde
+    SIGALRM no interrumpe) se deja de esperar `seconds` + gracia después de que empezó;
+    el worker queda ocupado hasta que termine por su cuenta.
+
+    Si un worker muere, todos los trabajos pendientes del pool fallan, no solo el que lo
+    mató. `retry` (sin argumentos, regresa un future nuevo) reenvía el trabajo una vez al
+    pool recreado: solo si vuelve a fallar se culpa a este anexo.
+    """
+    started, retried = None, False
+    while True:
+        try:
+            return future.result(timeout=1.0 if seconds else None)
+        except BrokenProcessPool:
+            # El SO mató a un worker (OOM, señal); get_process_pool ya da uno nuevo
+            if retry is not None and not retried:
+                future, started, retried = retry(), None, True
+                continue
+            again = " también al reintentar" if retried else ""
+            raise AttachmentError(name, f"el proceso de conversión terminó inesperadamente{again} "
+                                        "(¿memoria insuficiente?)") from None
+        except TimeoutError:
+            if started is None and future.running():
+                started = time.perf_counter()
+            if started is not None and time.perf_counter() - started > seconds + BUDGET_GRACE:
+                raise AttachmentError(name, f"tardó más de {seconds:g} s") from None
+
+
+@contextmanager
+def _cancel_on_error(futures):
+    """Cancela los trabajos del pool que no han empezado si el render falla: el pool es
+    compartido y no deben seguir ocupando workers de otras sesiones."""
+    try:
+        yield
+    except BaseException:
+        for f in futures.values():
+            f.cancel()
+        raise
+
+
+def _convert_inline(name, source, dpi, quality, spool_dir, kind=None, limits=DEFAULT_LIMITS):
+    """`_convert_timed` en el proceso actual.
+
+    Fuera del hilo principal (p. ej. el de una sesión de Streamlit) SIGALRM no aplica: la
+    conversión corre en un hilo aparte y se deja de esperar tras `limits.seconds` (el hilo
+    termina por su cuenta). Mientras se perfila corre en el mismo hilo, sin ese tope,
+    porque cProfile solo ve el hilo que lo activó.
+    """
+    args = (name, source, dpi, quality, spool_dir, kind, limits)
+    if (not limits.seconds or threading.current_thread() is threading.main_thread()
+            or sys.getprofile() is not None):
+        return _convert_timed(*args)
+    result = {}
+
+    def run():
+        try:
+            result["value"] = _convert_timed(*args)
+        except BaseException as e:
+            result["error"] = e
+
+    worker = threading.Thread(target=run, name="ficha-convert", daemon=True)
+    worker.start()
+    worker.join(limits.seconds)
+    if worker.is_alive():
+        raise AttachmentError(name, f"tardó más de {limits.seconds:g} s")
+    if "error" in result:
+        raise result.pop("error")
+    return result["value"]
+
+
+def build_pdf_with_attachments(data: dict, uploads, dpi=DEFAULT_DPI, quality=DEFAULT_QUALITY, workers=None,
+                               spool_threshold=SPOOL_THRESHOLD, cache=None, trace=None, pages=None,
+                               store=None, optimize=False, target_bytes=None, skip_invalid=False,
+                               limits=DEFAULT_LIMITS) -> bytes:
+    """PDF final = ficha + anexos como páginas."""
+    out = io.BytesIO()
+    write_pdf_with_attachments(out, data, uploads, dpi=dpi, quality=quality, workers=workers,
+                               spool_threshold=spool_threshold, cache=cache, trace=trace, pages=pages,
+                               store=store, optimize=optimize, target_bytes=target_bytes,
+                               skip_invalid=skip_invalid, limits=limits)
+    return out.getvalue()
+
+
+def write_pdf_with_attachments(out, data: dict, uploads, dpi=DEFAULT_DPI, quality=DEFAULT_QUALITY, workers=None,
+                               spool_threshold=SPOOL_THRESHOLD, cache=None, base_pdf=None, trace=None, pages=None,
+                               store=None, optimize=False, target_bytes=None, skip_invalid=False,
+                               limits=DEFAULT_LIMITS) -> list:
+    """Escribe el PDF final (ficha + anexos) directo en `out` (ruta o archivo binario).
+
+    Los uploads de `spool_threshold` bytes o más y las páginas convertidas pasan por un
+    spool en disco (spool_threshold=None lo desactiva y todo se queda en memoria). Con
+    workers > 1 los anexos se convierten en el pool de procesos compartido mientras se
+    dibuja la ficha base (si hay varios PDFs, también se validan ahí en paralelo); el
+    orden final es el de carga. Si el render falla, los trabajos pendientes del pool se
+    cancelan.
+
+    Antes de cualquier trabajo pesado cada anexo se valida leyendo solo encabezados
+    (`ficha.validate.validate_attachment` con `limits`): el tipo sale del contenido, no de
+    la extensión. Convertir y unir cada anexo tiene además un presupuesto de tiempo y
+    memoria (`limits.seconds`, `limits.memory`). Un anexo que no pasa lanza
+    AttachmentError; con skip_invalid=True se omite y el PDF se genera con los demás.
+    Regresa la lista de AttachmentError de los anexos omitidos (nombre y motivo).
+
+    Con `cache` (un ByteLRUCache, p. ej. `ficha.cache.page_cache`) las páginas de imágenes
+    ya convertidas con el mismo contenido y ajustes se reutilizan en vez de reconvertirse.
+    `base_pdf` permite pasar la ficha base ya renderizada (ver ficha.incremental).
+    `pages` es una lista paralela a `uploads` con la selección de páginas de cada PDF
+    ("1-3,7", "última"; None = todas); en las imágenes se ignora.
+
+    Con `store` (un `ficha.blobstore.BlobStore`) los uploads se guardan en el almacén por
+    contenido (una sola copia aunque se suban muchas veces) y viajan como rutas; si no se
+    da `cache`, las páginas convertidas también van al almacén.
+
+    Con optimize=True el documento unido pasa por `ficha.optimize.optimize_pdf` (sin
+    pérdida: filtros ASCII fuera, Flate, deduplicación, object streams). `target_bytes`
+    (implica optimize) además baja la calidad de las imágenes hasta que el PDF quepa.
+
+    `trace` (ficha.metrics.Trace) recibe un span por etapa; quien lo pasa lo cierra con
+    `finish()`. Sin él se crea uno propio solo si FICHA_METRICS=1. Los spans de cada anexo
+    (convert_attachment, merge_part, skip_attachment) se agregan en cuanto ese anexo
+    termina, así que el trace sirve también para reportar progreso (ver ficha.jobs).
+    """
+    own_trace = trace is None
+    if own_trace:
+        trace = new_trace()
+    if store is not None and cache is None:
+        cache = store
+    skipped = []
+
+    with Spool(threshold=spool_threshold or float("inf")) as spool:
+        with trace.span("spool") as sp:
+            spool_dir = spool.path if spool_threshold else None
+            items = [(uf.name, (store or spool).add_upload(uf)) for uf in uploads or []]
+            if trace:
+                sp.bytes_in = sum(part_size(src) for _, src in items)
+        selections = list(pages or [None] * len(items))
+
+        def skip(i, error, stage):
+            if not skip_invalid:
+                raise error
+            skipped.append(error)
+            kinds[i] = None
+            trace.add("skip_attachment", 0, attachment=i, during=stage, reason=error.reason)
+
+        kinds = [None] * len(items)
+        dpis = [dpi] * len(items)
+        with trace.span("validate") as sp:
+            # Con pool, los PDFs se validan en paralelo (leer la xref y el árbol de páginas es
+            # lo que tarda); las imágenes solo leen su encabezado y se validan aquí
+            pdfs = [i for i, (_, src) in enumerate(items) if sniff_kind(src) == "pdf"]
+
+            def submit_validate(i):
+                return get_process_pool(workers).submit(validate_attachment, *items[i], selections[i], limits)
+
+            futures = {}
+            if workers and workers > 1 and len(pdfs) > 1:
+                futures = {i: submit_validate(i) for i in pdfs}
+            with _cancel_on_error(futures):
+                for i, (name, src) in enumerate(items):
+                    try:
+                        if i in futures:
+                            info = _wait_converted(futures[i], name, limits.seconds, partial(submit_validate, i))
+                        else:
+                            info = validate_attachment(name, src, selections[i], limits)
+                    except AttachmentError as e:
+                        skip(i, e, "validate")
+                        continue
+                    kinds[i] = info.kind
+                    if info.pixels and not dpi and limits.max_pixels and info.pixels > limits.max_pixels:
+                        # A resolución original no cabe en el presupuesto: se remuestrea
+                        dpis[i] = DEFAULT_DPI
+            sp.set(skipped=len(skipped), parallel=len(futures))
+
+        converted = [None] * len(items)
+        keys = [None] * len(items)
+        todo = []
+        with trace.span("cache") as sp:
+            for i, (name, src) in enumerate(items):
+                if kinds[i] is None:
+                    continue
+                if cache is not None and kinds[i] == "image":
+                    keys[i] = page_key(name, content_hash(src), dpis[i], quality)
+                    converted[i] = cache.get(keys[i])
+                if converted[i] is None:
+                    todo.append(i)
+            sp.set(hits=sum(kind is not None for kind in kinds) - len(todo))
+
+        def converted_one(i, seconds):
+            if trace:
+                trace.add("convert_attachment", seconds, attachment=i, kind=kinds[i],
+                          bytes_in=part_size(items[i][1]),
+                          bytes_out=part_size(converted[i]) if converted[i] is not None else 0)
+
+        with trace.span("convert", attachments=len(todo), workers=workers or 1):
+            if workers and workers > 1 and todo:
+                # También con un solo anexo: en el pool corre con su presupuesto de memoria
+                def submit_convert(i):
+                    return get_process_pool(workers).submit(_convert_timed, *items[i], dpis[i], quality, spool_dir,
+                                                            kinds[i], limits)
+
+                futures = {i: submit_convert(i) for i in todo}
+                with _cancel_on_error(futures):
+                    base = _base_pdf(trace, data, base_pdf)
+                    for i, f in futures.items():
+                        try:
+                            converted[i], seconds = _wait_converted(f, items[i][0], limits.seconds,
+                                                                    partial(submit_convert, i))
+                        except AttachmentError as e:
+                            skip(i, e, "convert")
+                            continue
+                        converted_one(i, seconds)
+            else:
+                base = _base_pdf(trace, data, base_pdf)
+                for i in todo:
+                    try:
+                        converted[i], seconds = _convert_inline(*items[i], dpis[i], quality, spool_dir, kinds[i],
+                                                                limits)
+                    except AttachmentError as e:
+                        skip(i, e, "convert")
+                        continue
+                    converted_one(i, seconds)
+
+        for i in todo:
+            if keys[i] is not None and converted[i] is not None:
+                cache.put(keys[i], converted[i])
+
+        # Parte del merge -> índice del anexo (-1: la ficha base)
+        owners = [-1] + [i for i in range(len(items)) if kinds[i] is not None and converted[i] is not None]
+
+        def merged_one(p, s):
+            trace.add("merge_part", s.seconds, part=owners[p] + 1, pages=s.pages,
+                      bytes_out=s.bytes_out, objects=s.objects, duplicate=s.duplicate)
+
+        def merge_failed(p, error):
+            if owners[p] < 0:
+                raise error
+            skip(owners[p], error, "merge")
+
+        # Con optimización el merge va a un temporal y el resultado optimizado a `out`
+        optimize = optimize or target_bytes is not None
+        merged = os.path.join(spool.path, "unido.pdf") if optimize else out
+        with trace.span("merge") as sp:
+            parts = [base] + [converted[i] for i in owners[1:]]
+            names = ["ficha"] + [items[i][0] for i in owners[1:]]
+            part_pages = [None] + [selections[i] if kinds[i] == "pdf" else None for i in owners[1:]]
+            stats = write_merged_pdf(parts, merged, names, pages=part_pages,
+                                     on_part=merged_one if trace else None, budget=limits.seconds,
+                                     on_error=merge_failed)
+            sp.pages = sum(s.pages for s in stats)
+            if trace:
+                sp.bytes_in = sum(part_size(p) for p in parts)
+                sp.bytes_out = _out_size(merged)
+
+        if optimize:
+            with trace.span("optimize", target_bytes=target_bytes) as sp:
+                steps = optimize_pdf(merged, out, target_bytes=target_bytes, trace=trace)
+                sp.bytes_in = os.path.getsize(merged)
+                sp.bytes_out = steps[-1].bytes_out
+                sp.set(fits=target_bytes is None or sp.bytes_out <= target_bytes)
+
+    if own_trace:
+        trace.finish()
+    return skipped
+
+
+def _out_size(out):
+    return os.path.getsize(out) if isinstance(out, (str, os.PathLike)) else out.tell()
+
+
+def _base_pdf(trace, data, base_pdf):
+    with trace.span("base", reused=base_pdf is not None) as sp:
+        base = base_pdf or build_base_pdf(data)
+        sp.bytes_out = len(base)
+    return base
+
+
+class PathUpload:
+    """Adjunto en disco con la interfaz mínima de un UploadedFile de Streamlit (name/getvalue)."""
+
+    def __init__(self, path, name=None):
+        self.path = path
+        self.name = name or os.path.basename(path)
+
+    def getvalue(self) -> bytes:
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def __repr__(self):
+        return f"PathUpload({self.path!r})"
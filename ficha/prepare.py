@@ -0,0 +1,162 @@
+"""Conversión anticipada de anexos: empieza en cuanto se suben, no al pulsar "Generar PDF".
+
+Cada imagen subida se manda a convertir en segundo plano (al pool de procesos, o a un
+hilo si solo hay un proceso) mientras el usuario sigue llenando el formulario. El
+`Preconverter` tiene la misma interfaz que el caché de páginas (`get`/`put`), así que
+se pasa como `cache=` al render: al generar, las páginas ya convertidas salen del
+preconvertidor (esperando a las que aún estén en curso) y solo se dibuja la ficha base
+y se unen las partes.
+
+Cada imagen se valida (`ficha.validate`) antes de convertirse y la conversión corre con
+el presupuesto de tiempo y memoria por anexo. Los PDFs no necesitan conversión; la UI los
+valida al subirlos.
+"""
+import threading
+import time
+
+from ficha.cache import page_key, upload_hash
+from ficha.defaults import DEFAULT_DPI, DEFAULT_QUALITY
+from ficha.validate import BUDGET_GRACE, DEFAULT_LIMITS
+from ficha.workers import get_background_executor, get_process_pool
+
+PENDING = "pendiente"
+READY = "lista"
+FAILED = "error"
+
+
+class _Job:
+    __slots__ = ("name", "future", "started", "seconds")
+
+    def __init__(self, name, future):
+        self.name = name
+        self.future = future
+        self.started = time.perf_counter()
+        self.seconds = None
+
+
+def _convert(name, source, dpi, quality):
+    from ficha.pdf import convert_within_budget
+    from ficha.validate import validate_attachment
+
+    info = validate_attachment(name, source)
+    return convert_within_budget(name, source, dpi, quality, kind=info.kind)
+
+
+def _is_image(uf) -> bool:
+    """Si el upload es una imagen, por sus primeros bytes (sin copiar el upload entero)."""
+    from ficha.validate import SNIFF_BYTES, sniff_kind
+
+    if not hasattr(uf, "getbuffer"):
+        return sniff_kind(uf.getvalue()) == "image"
+    with uf.getbuffer() as buf:
+        head = bytes(buf[:SNIFF_BYTES])
+    return sniff_kind(head) == "image"
+
+
+class Preconverter:
+    """Conversiones en segundo plano de los uploads de una sesión, indexadas por `page_key`.
+
+    `cache` (opcional, p. ej. `ficha.cache.page_cache`) recibe cada página al terminar,
+    para que otras sesiones también la aprovechen; el preconvertidor conserva su propio
+    resultado aunque el caché lo rechace por tamaño.
+
+    `get` espera a una conversión en curso a lo más `seconds` (más una gracia) desde que
+    empezó: en un hilo (workers=1) el presupuesto no la interrumpe, y el render no debe
+    quedarse esperándola. Si no llegó, el render convierte con su propio presupuesto.
+    """
+
+    def __init__(self, cache=None, workers=None, dpi=DEFAULT_DPI, quality=DEFAULT_QUALITY,
+                 seconds=DEFAULT_LIMITS.seconds):
+        self.cache = cache
+        self.workers = workers
+        self.dpi = dpi
+        self.quality = quality
+        self.seconds = seconds
+        self._jobs = {}
+        # file_id del upload -> llave (None: no es imagen)
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def _executor(self):
+        if self.workers and self.workers > 1:
+            return get_process_pool(self.workers)
+        return get_background_executor()
+
+    def submit(self, uf):
+        """Empieza a convertir el upload si es una imagen. Regresa su llave (o None).
+
+        La llave se calcula una vez por `file_id` (en cada rerun se vuelve a llamar).
+        """
+        file_id = getattr(uf, "file_id", None)
+        if file_id is not None and file_id in self._keys:
+            key = self._keys[file_id]
+        else:
+            key = page_key(uf.name, upload_hash(uf), self.dpi, self.quality) if _is_image(uf) else None
+            if file_id is not None:
+                self._keys[file_id] = key
+        if key is None:
+            return None
+        with self._lock:
+            if key in self._jobs:
+                return key
+            if self.cache is not None and key in self.cache:
+                future = None
+            else:
+                future = self._executor().submit(_convert, uf.name, uf.getvalue(), self.dpi, self.quality)
+            job = self._jobs[key] = _Job(uf.name, future)
+        if future is not None:
+            future.add_done_callback(lambda f, key=key, job=job: self._done(key, job, f))
+        return key
+
+    def _done(self, key, job, future):
+        job.seconds = time.perf_counter() - job.started
+        if self.cache is not None and not future.cancelled() and future.exception() is None:
+            self.cache.put(key, future.result())
+
+    def status(self, key):
+        """(estado, detalle): PENDING, READY (tamaño y segundos) o FAILED (mensaje)."""
+        job = self._jobs.get(key)
+        if job is None or job.future is None:
+            return READY, "en caché"
+        if not job.future.done():
+            return PENDING, f"{time.perf_counter() - job.started:.0f} s"
+        if job.future.cancelled():
+            return FAILED, "cancelada"
+        error = job.future.exception()
+        if error is not None:
+            return FAILED, str(getattr(error, "reason", error))
+        seconds = job.seconds if job.seconds is not None else time.perf_counter() - job.started
+        return READY, f"{len(job.future.result()) / 1024:.0f} KB en {seconds:.1f} s"
+
+    def pending(self) -> int:
+        return sum(1 for j in self._jobs.values() if j.future is not None and not j.future.done())
+
+    def retain(self, keys):
+        """Olvida (y cancela si no empezaron) las conversiones de uploads que ya no están."""
+        keys = set(keys)
+        with self._lock:
+            for key in [k for k in self._jobs if k not in keys]:
+                job = self._jobs.pop(key)
+                if job.future is not None:
+                    job.future.cancel()
+            for file_id in [f for f, k in self._keys.items() if k is not None and k not in keys]:
+                del self._keys[file_id]
+
+    # Interfaz de caché para write_pdf_with_attachments
+    def get(self, key):
+        job = self._jobs.get(key)
+        if job is not None and job.future is not None:
+            timeout = None
+            if self.seconds:
+                timeout = max(0.0, job.started + self.seconds + BUDGET_GRACE - time.perf_counter())
+            try:
+                return job.future.result(timeout=timeout)
+            except Exception:
+                # Falló o no llegó a tiempo: el render vuelve a convertir (con su presupuesto)
+                # y reporta el error con su contexto
+                return None
+        return self.cache.get(key) if self.cache is not None else None
+
+    def put(self, key, value):
+        if self.cache is not None:
+            self.cache.put(key, value)
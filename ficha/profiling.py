@@ -0,0 +1,177 @@
+"""Perfilado bajo demanda de renders lentos.
+
+Con FICHA_PROFILE=1 se perfila una muestra de los renders (FICHA_PROFILE_SAMPLE, fracción
+de 0 a 1; 0.1 por defecto) y con `RenderProfiler(force=True)` (p. ej. desde ?profile=1 en
+la URL) uno en particular. El render corre dentro de cProfile, que hace más lento el código
+Python del hilo perfilado (del orden de 1.5-2x). Si tarda más que el umbral
+(FICHA_PROFILE_THRESHOLD, en segundos) o si se forzó, se guardan en FICHA_PROFILE_DIR:
+
+- `<id>.pstats`: para `python -m pstats` o snakeviz,
+- `<id>.collapsed`: pilas colapsadas ("a;b;c microsegundos") para flamegraph.pl/speedscope,
+- `<id>.json`: duración y características anónimas de la entrada (número de anexos,
+  bytes totales, tipos, número de medicamentos y de campos llenos). Nunca nombres ni valores.
+
+cProfile solo ve el proceso actual: en los renders de la muestra la conversión sigue en el
+pool y en el perfil solo aparece la espera. Solo un perfil forzado convierte los anexos en
+serie (workers=None) para que la conversión aparezca; ese render es más lento.
+"""
+import cProfile
+import json
+import os
+import pstats
+import random
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+PROFILE_THRESHOLD = float(os.environ.get("FICHA_PROFILE_THRESHOLD", "2.0"))
+PROFILE_SAMPLE = float(os.environ.get("FICHA_PROFILE_SAMPLE", "0.1"))
+PROFILE_DIR = os.environ.get("FICHA_PROFILE_DIR") or os.path.join(tempfile.gettempdir(), "ficha-perfiles")
+
+# Profundidad máxima de las pilas reconstruidas (cortes en recursiones profundas)
+_MAX_DEPTH = 64
+_MIN_SECONDS = 1e-6
+
+
+def enabled() -> bool:
+    return os.environ.get("FICHA_PROFILE") == "1"
+
+
+def _upload_size(uf) -> int:
+    size = getattr(uf, "size", None)
+    if size is not None:
+        return size
+    path = getattr(uf, "path", None)
+    if path:
+        return os.path.getsize(path)
+    return len(uf.getvalue())
+
+
+def input_tags(data: dict, uploads) -> dict:
+    """Características de la entrada sin datos del paciente."""
+    from ficha.pdf import attachment_kind
+
+    uploads = list(uploads or [])
+    kinds = {}
+    for uf in uploads:
+        kind = attachment_kind(uf.name) or "otro"
+        kinds[kind] = kinds.get(kind, 0) + 1
+    return {
+        "anexos": len(uploads),
+        "anexos_bytes": sum(_upload_size(uf) for uf in uploads),
+        "anexos_tipos": kinds,
+        "medicamentos": len(data.get("Medicamentos") or []),
+        "campos_llenos": sum(1 for v in data.values() if v not in (None, "", [], "—")),
+    }
+
+
+# ----------------------------
+# Pilas colapsadas
+# ----------------------------
+def _func_name(func) -> str:
+    filename, line, name = func
+    if filename == "~":
+        return name  # funciones en C: "<built-in method ...>"
+    return f"{os.path.basename(filename)}:{line}:{name}"
+
+
+def collapsed_stacks(stats: pstats.Stats) -> list:
+    """Pilas "raíz;...;hoja microsegundos" a partir de las aristas llamador→llamado de cProfile.
+
+    cProfile no guarda pilas completas: el tiempo de cada función se reparte entre sus
+    llamadores en proporción al tiempo acumulado de cada arista (la aproximación usual de
+    flameprof y similares). Las ramas de menos del 0.01% del total se omiten.
+    """
+    callees = {}
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+    roots = [f for f, v in stats.stats.items() if not v[4]]
+    cutoff = max(_MIN_SECONDS, sum(stats.stats[r][3] for r in roots) * 1e-4)
+
+    totals = {}
+
+    def walk(func, share, stack):
+        tt, ct = stats.stats[func][2:4]
+        # Con recursión el tiempo acumulado de las aristas puede exceder el del nodo
+        frac = min(share / ct, 1.0) if ct else 0.0
+        self_s = tt * frac
+        if self_s >= _MIN_SECONDS:
+            key = ";".join(stack)
+            totals[key] = totals.get(key, 0.0) + self_s
+        if len(stack) >= _MAX_DEPTH:
+            return
+        kids = [(c, e * frac) for c, e in callees.get(func, ()) if _func_name(c) not in stack]
+        spent = sum(e for _, e in kids)
+        scale = min(1.0, (share - self_s) / spent) if spent > 0 else 0.0
+        for callee, kid_share in kids:
+            if kid_share * scale >= cutoff:
+                walk(callee, kid_share * scale, stack + (_func_name(callee),))
+
+    for root in roots:
+        walk(root, stats.stats[root][3], (_func_name(root),))
+    return [f"{k} {int(v * 1e6)}" for k, v in sorted(totals.items()) if v * 1e6 >= 1]
+
+
+# ----------------------------
+# Perfilador
+# ----------------------------
+class RenderProfiler:
+    """Perfila el bloque `with` y guarda el perfil si supera el umbral.
+
+    Inactivo (sin force, y sin FICHA_PROFILE=1 o fuera de la muestra `sample`) no hace
+    nada. Después del bloque, `seconds` tiene la duración y `saved` la lista de archivos
+    escritos (vacía si no se guardó).
+    """
+
+    def __init__(self, tags=None, threshold=None, out_dir=None, force=False, sample=None):
+        self.tags = tags or {}
+        self.threshold = PROFILE_THRESHOLD if threshold is None else threshold
+        self.out_dir = out_dir or PROFILE_DIR
+        self.force = force
+        sample = PROFILE_SAMPLE if sample is None else sample
+        self.active = force or (enabled() and random.random() < sample)
+        self.seconds = 0.0
+        self.saved = []
+        self._profile = None
+
+    def __bool__(self):
+        return self.active
+
+    def __enter__(self):
+        if self.active:
+            self._profile = cProfile.Profile()
+            self._t0 = time.perf_counter()
+            self._profile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.active:
+            return False
+        self._profile.disable()
+        self.seconds = time.perf_counter() - self._t0
+        if self.force or self.seconds >= self.threshold:
+            self.save(error=exc_type.__name__ if exc_type else None)
+        return False
+
+    def save(self, error=None) -> list:
+        os.makedirs(self.out_dir, exist_ok=True)
+        stem = os.path.join(
+            self.out_dir, f"{datetime.now():%Y%m%d-%H%M%S}_{self.seconds:.2f}s_{uuid.uuid4().hex[:8]}"
+        )
+        stats = pstats.Stats(self._profile)
+        stats.dump_stats(stem + ".pstats")
+        with open(stem + ".collapsed", "w", encoding="utf-8") as f:
+            f.write("\n".join(collapsed_stacks(stats)) + "\n")
+        meta = {
+            "seconds": round(self.seconds, 4),
+            "threshold": self.threshold,
+            "forced": self.force,
+            "error": error,
+            **self.tags,
+        }
+        with open(stem + ".json", "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        self.saved = [stem + ext for ext in (".pstats", ".collapsed", ".json")]
+        return self.saved
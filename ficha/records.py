@@ -0,0 +1,250 @@
+"""Fichas guardadas (SQLite), para recargar el formulario de un paciente que regresa.
+
+Cada ficha generada se guarda completa (el mismo `data` del formulario, como JSON) junto
+con columnas normalizadas para buscarla rápido aunque haya cientos de miles:
+
+- CURP (en mayúsculas, sin espacios): índice exacto,
+- nombre normalizado (minúsculas, sin acentos ni signos): índice para búsqueda por prefijo,
+- teléfonos del paciente y del contacto (solo los últimos 10 dígitos): índices exactos,
+- el resto del texto libre (domicilio, antecedentes, medicamentos, alergias...) en una
+  tabla FTS5 sin contenido (`records_fts`, rowid = id de la ficha).
+
+`save_many` guarda en transacciones por lotes (una por cada `batch` fichas); la UI guarda
+una ficha por PDF generado y `ficha.batch --guardar` todo el lote.
+
+Configuración: FICHA_RECORDS_DB (ruta de la base; sin ella no se guarda nada).
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from contextlib import contextmanager
+
+# El índice de prefijos de 1 letra es para búsquedas como "Luis A": sin él FTS5 recorre
+# todos los términos que empiezan con "a" (bases creadas antes no lo tienen; solo son más
+# lentas con esas búsquedas)
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY,
+    saved_at REAL NOT NULL,
+    nombre TEXT NOT NULL,
+    curp TEXT,
+    name_norm TEXT NOT NULL,
+    phone TEXT,
+    contact_phone TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS records_curp ON records (curp, saved_at);
+CREATE INDEX IF NOT EXISTS records_name ON records (name_norm, saved_at);
+CREATE INDEX IF NOT EXISTS records_phone ON records (phone);
+CREATE INDEX IF NOT EXISTS records_contact_phone ON records (contact_phone);
+CREATE VIRTUAL TABLE IF NOT EXISTS records_fts USING fts5(
+    nombre, texto, content='', tokenize='unicode61 remove_diacritics 2', prefix='1 2 3 4'
+);
+"""
+
+_CURP = re.compile(r"^[A-Z]{4}\d{6}[A-Z0-9]{8}$")
+
+# Campos que ya tienen su propia columna (o no son texto libre)
+_NOT_FREE_TEXT = ("Nombre completo", "CURP", "Teléfono del paciente", "Teléfono de contacto",
+                  "Fecha de elaboración", "Anexos")
+
+_COLUMNS = "id, nombre, curp, phone, saved_at, json_extract(data, '$.\"Fecha de elaboración\"')"
+
+
+def normalize_name(text) -> str:
+    """Minúsculas, sin acentos ni signos: "José  Pérez-López" -> "jose perez lopez"."""
+    text = unicodedata.normalize("NFKD", str(text or ""))
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    return " ".join(re.sub(r"[^\w]+", " ", text).split())
+
+
+def normalize_phone(text) -> str:
+    """Solo dígitos, los últimos 10 (sin lada internacional)."""
+    return re.sub(r"\D+", "", str(text or ""))[-10:]
+
+
+def normalize_curp(text) -> str:
+    return re.sub(r"\s+", "", str(text or "")).upper()
+
+
+def _free_text(data) -> str:
+    parts = []
+    for key, value in data.items():
+        if key in _NOT_FREE_TEXT or not value:
+            continue
+        if isinstance(value, list):
+            for item in value:
+                parts.extend(item.values() if isinstance(item, dict) else [item])
+        else:
+            parts.append(value)
+    return " ".join(str(p) for p in parts if p)
+
+
+def _row(data, saved_at):
+    return (
+        saved_at,
+        str(data.get("Nombre completo") or ""),
+        normalize_curp(data.get("CURP")) or None,
+        normalize_name(data.get("Nombre completo")),
+        normalize_phone(data.get("Teléfono del paciente")) or None,
+        normalize_phone(data.get("Teléfono de contacto")) or None,
+        json.dumps(data, ensure_ascii=False, default=str),
+    )
+
+
+def _fts_query(text) -> str:
+    # Cada palabra como prefijo ("pere" encuentra "Pérez"); entre comillas para que los
+    # signos no se lean como sintaxis de FTS5
+    return " ".join(f'"{w}"*' for w in normalize_name(text).split())
+
+
+class RecordStore:
+    """Fichas guardadas en la base SQLite `path` (modo WAL; segura entre hilos y procesos)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._db().executescript(_SCHEMA)
+
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db, self._local.pid = db, os.getpid()
+        return db
+
+    @contextmanager
+    def _transaction(self):
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    # ----------------------------
+    # Guardar
+    # ----------------------------
+    def _insert(self, db, data, saved_at):
+        row = _row(data, saved_at)
+        rid = db.execute(
+            "INSERT INTO records (saved_at, nombre, curp, name_norm, phone, contact_phone, data) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)", row,
+        ).lastrowid
+        db.execute("INSERT INTO records_fts (rowid, nombre, texto) VALUES (?, ?, ?)",
+                   (rid, row[1], _free_text(data)))
+        return rid
+
+    def save(self, data: dict) -> int:
+        """Guarda una ficha. Regresa su id."""
+        with self._transaction() as db:
+            return self._insert(db, data, time.time())
+
+    def save_many(self, records, batch=1000) -> int:
+        """Guarda un iterable de dicts `data` en transacciones de `batch` fichas. Regresa cuántas."""
+        n = 0
+        records = iter(records)
+        while True:
+            with self._transaction() as db:
+                count = 0
+                for data in records:
+                    self._insert(db, data, time.time())
+                    count += 1
+                    if count == batch:
+                        break
+            n += count
+            if count < batch:
+                return n
+
+    # ----------------------------
+    # Buscar
+    # ----------------------------
+    def _summaries(self, sql, args):
+        return [
+            {"id": r[0], "nombre": r[1], "curp": r[2], "telefono": r[3], "guardada": r[4], "fecha": r[5]}
+            for r in self._db().execute(sql, args)
+        ]
+
+    def search(self, query, limit=20) -> list:
+        """Fichas que coinciden con `query`, de la más reciente a la más vieja.
+
+        Según lo escrito: CURP completa (índice exacto), teléfono de 7 o más dígitos
+        (del paciente o del contacto), o texto: prefijo del nombre normalizado más
+        búsqueda de texto completo en el resto de los campos.
+        """
+        query = (query or "").strip()
+        if not query:
+            return []
+        curp = normalize_curp(query)
+        if _CURP.match(curp):
+            return self._summaries(
+                f"SELECT {_COLUMNS} FROM records WHERE curp = ? ORDER BY saved_at DESC LIMIT ?", (curp, limit))
+        digits = normalize_phone(query)
+        if len(digits) >= 7 and not re.search(r"[^\d\s()+-]", query):
+            return self._summaries(
+                f"SELECT {_COLUMNS} FROM records WHERE id IN ("
+                "SELECT id FROM records WHERE phone = ? UNION SELECT id FROM records WHERE contact_phone = ?"
+                ") ORDER BY saved_at DESC LIMIT ?", (digits, digits, limit))
+        name = normalize_name(query)
+        if not name:
+            return []
+        # Rango en vez de LIKE: así SQLite usa el índice de name_norm. Las más recientes
+        # entre todas las que empiezan así (no las primeras en orden alfabético)
+        ids = [r[0] for r in self._db().execute(
+            "SELECT id FROM records WHERE name_norm >= ? AND name_norm < ? ORDER BY saved_at DESC LIMIT ?",
+            (name, name + "\uffff", limit),
+        )]
+        # Texto completo también: una coincidencia fuera del nombre puede ser más reciente.
+        # Si el nombre ya llenó `limit`, solo cuentan las posteriores a la más vieja de esas
+        # (rowid crece con cada ficha guardada). Las más recientes primero (rowid DESC no
+        # ordena por relevancia: con palabras comunes calcular `rank` sobre miles de
+        # coincidencias es lo lento)
+        after = min(ids) if len(ids) == limit else 0
+        ids += [r[0] for r in self._db().execute(
+            "SELECT rowid FROM records_fts WHERE records_fts MATCH ? AND rowid > ? ORDER BY rowid DESC LIMIT ?",
+            (_fts_query(query), after, limit),
+        )]
+        ids = list(dict.fromkeys(ids))
+        return self._summaries(
+            f"SELECT {_COLUMNS} FROM records WHERE id IN ({','.join('?' * len(ids))}) "
+            "ORDER BY saved_at DESC LIMIT ?", (*ids, limit),
+        )
+
+    def latest_by_curp(self, curp):
+        """La ficha más reciente de esa CURP (dict `data`) o None."""
+        row = self._db().execute(
+            "SELECT data FROM records WHERE curp = ? ORDER BY saved_at DESC LIMIT 1", (normalize_curp(curp),)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def load(self, record_id):
+        """El dict `data` de la ficha o None."""
+        row = self._db().execute("SELECT data FROM records WHERE id = ?", (record_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def count(self) -> int:
+        return self._db().execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+
+_store = None
+_lock = threading.Lock()
+
+
+def get_record_store():
+    """La base configurada con FICHA_RECORDS_DB (compartida en el proceso), o None."""
+    global _store
+    path = os.environ.get("FICHA_RECORDS_DB")
+    if not path:
+        return None
+    with _lock:
+        if _store is None or _store.path != path:
+            _store = RecordStore(path)
+        return _store
@@ -0,0 +1,191 @@
+"""Planificador de renders compartido por todas las sesiones del servidor.
+
+Cada sesión de Streamlit genera su PDF en su propio hilo; sin un límite, un turno entero
+generando a la vez satura la CPU y la memoria (varios merges de anexos grandes al mismo
+tiempo). El `RenderScheduler` del proceso (`get_scheduler`) decide quién corre:
+
+- a lo más `max_running` renders a la vez (el resto espera en cola, con su posición),
+- admisión por memoria: la suma estimada de los renders en curso (bytes de anexos) no
+  pasa de `memory_budget`; un render más grande que el presupuesto corre solo,
+- equidad entre sesiones: al liberarse un lugar pasa primero la sesión con menos renders
+  en curso y, entre iguales, el que llegó antes; si ese no cabe todavía por memoria,
+  los que vienen detrás esperan con él (nadie se le adelanta),
+- cola acotada (`max_queued` renders y `memory_budget` bytes en espera): si está llena,
+  `submit` lanza `SchedulerBusy` de inmediato, en vez de acumular trabajo hasta quedarse
+  sin memoria.
+
+Configuración: FICHA_MAX_RENDERS (default 2), FICHA_MAX_QUEUED (default 20) y
+FICHA_RENDER_MEMORY_MB (default 512).
+"""
+import itertools
+import os
+import threading
+import time
+
+# Memoria fija de un render aparte de sus anexos (ReportLab, la ficha base, el merge)
+BASE_COST = 8 * 1024 * 1024
+
+
+def _env_int(name, default):
+    try:
+        return max(1, int(os.environ.get(name, "")))
+    except ValueError:
+        return default
+
+
+class SchedulerBusy(Exception):
+    """La cola de renders está llena: hay que reintentar en unos segundos."""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class Ticket:
+    """Un render en la cola (o en curso) del planificador."""
+
+    __slots__ = ("session", "cost", "seq", "queued_at", "admitted_at", "state", "_scheduler")
+
+    def __init__(self, scheduler, session, cost, seq):
+        self._scheduler = scheduler
+        self.session = session
+        self.cost = cost
+        self.seq = seq
+        self.queued_at = time.perf_counter()
+        self.admitted_at = None
+        self.state = "queued"
+
+    @property
+    def position(self) -> int:
+        """1 = el siguiente en entrar; 0 si ya está corriendo (o salió de la cola)."""
+        return self._scheduler.position(self)
+
+    @property
+    def waited(self) -> float:
+        end = self.admitted_at if self.admitted_at is not None else time.perf_counter()
+        return end - self.queued_at
+
+    def wait(self, cancelled=None, poll=0.2) -> bool:
+        return self._scheduler.wait(self, cancelled, poll)
+
+    def release(self):
+        self._scheduler.release(self)
+
+
+class RenderScheduler:
+    def __init__(self, max_running=2, max_queued=20, memory_budget=512 * 1024 * 1024):
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self.memory_budget = memory_budget
+        self._cond = threading.Condition()
+        self._queue = []
+        self._running = []
+        self._seq = itertools.count()
+        self.rejected = 0
+
+    # ----------------------------
+    # Estado
+    # ----------------------------
+    def _session_running(self, session) -> int:
+        return sum(1 for t in self._running if t.session == session)
+
+    def _order(self):
+        # Menos renders en curso de la misma sesión primero; después, orden de llegada
+        return sorted(self._queue, key=lambda t: (self._session_running(t.session), t.seq))
+
+    def _fits(self, ticket) -> bool:
+        if not self._running:
+            return True
+        if len(self._running) >= self.max_running:
+            return False
+        return sum(t.cost for t in self._running) + ticket.cost <= self.memory_budget
+
+    def _admit(self):
+        # Se llama con el lock tomado: mete a correr en orden mientras quepan. El primero que
+        # no cabe detiene la admisión (no se le adelantan los más chicos que vienen detrás;
+        # si no, un render grande esperaría para siempre bajo tráfico constante de chicos)
+        admitted = False
+        for t in self._order():
+            if not self._fits(t):
+                break
+            self._queue.remove(t)
+            self._running.append(t)
+            t.state = "running"
+            t.admitted_at = time.perf_counter()
+            admitted = True
+        if admitted:
+            self._cond.notify_all()
+
+    def position(self, ticket) -> int:
+        with self._cond:
+            if ticket.state != "queued":
+                return 0
+            return self._order().index(ticket) + 1
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "running": len(self._running),
+                "queued": len(self._queue),
+                "running_bytes": sum(t.cost for t in self._running),
+                "queued_bytes": sum(t.cost for t in self._queue),
+                "rejected": self.rejected,
+            }
+
+    # ----------------------------
+    # API
+    # ----------------------------
+    def submit(self, session, attachment_bytes=0) -> Ticket:
+        """Pone en la cola un render de `session`. Lanza SchedulerBusy si no cabe."""
+        cost = BASE_COST + attachment_bytes
+        with self._cond:
+            queued_bytes = sum(t.cost for t in self._queue)
+            if len(self._queue) >= self.max_queued:
+                self.rejected += 1
+                raise SchedulerBusy(f"hay {len(self._queue)} fichas en espera")
+            if self._queue and queued_bytes + cost > self.memory_budget:
+                self.rejected += 1
+                raise SchedulerBusy(f"{queued_bytes / 1024 / 1024:.0f} MB de anexos en espera")
+            ticket = Ticket(self, session, cost, next(self._seq))
+            self._queue.append(ticket)
+            self._admit()
+            return ticket
+
+    def wait(self, ticket, cancelled=None, poll=0.2) -> bool:
+        """Bloquea hasta que el render puede correr. False si `cancelled()` se vuelve True."""
+        with self._cond:
+            while ticket.state == "queued":
+                if cancelled is not None and cancelled():
+                    self._queue.remove(ticket)
+                    ticket.state = "cancelled"
+                    self._admit()
+                    return False
+                self._cond.wait(poll)
+            return ticket.state == "running"
+
+    def release(self, ticket):
+        """Libera el lugar (o saca de la cola) del render. Idempotente."""
+        with self._cond:
+            if ticket.state == "running":
+                self._running.remove(ticket)
+            elif ticket.state == "queued":
+                self._queue.remove(ticket)
+            ticket.state = "done"
+            self._admit()
+
+
+_scheduler = None
+_lock = threading.Lock()
+
+
+def get_scheduler() -> RenderScheduler:
+    """El planificador del proceso (compartido por todas las sesiones)."""
+    global _scheduler
+    with _lock:
+        if _scheduler is None:
+            _scheduler = RenderScheduler(
+                max_running=_env_int("FICHA_MAX_RENDERS", 2),
+                max_queued=_env_int("FICHA_MAX_QUEUED", 20),
+                memory_budget=_env_int("FICHA_RENDER_MEMORY_MB", 512) * 1024 * 1024,
+            )
+        return _scheduler
@@ -0,0 +1,405 @@
+"""Servicio de render fuera del proceso de Streamlit (opcional).
+
+Con FICHA_RENDER_URL la UI no genera el PDF: lo pide por HTTP a uno o varios procesos de
+render, así que la capacidad de render escala aparte de los servidores de la UI. Cada
+proceso del servicio usa su propio planificador (`ficha.scheduler`), pool de procesos y
+caché de páginas, igual que el render local.
+
+Protocolo (POST /render, HTTP/1.1 con keep-alive):
+
+- cuerpo: una línea JSON (`data`, `generated_at`, `invariant`, `dpi`, `quality`,
+  `optimize`, `target_bytes`, `skip_invalid`, `session` y `attachments`: [{name, size,
+  pages}]) seguida
+  de los bytes de cada anexo, en orden y sin separador; el servidor los copia por bloques
+  al spool sin juntarlos en memoria,
+- 200: el PDF final (application/pdf, con Content-Length), enviado por bloques; con
+  skip_invalid, el encabezado X-Ficha-Skipped lleva [{name, reason}] de los anexos omitidos,
+- 422: {"name", "reason"} de un anexo que no se pudo agregar (AttachmentError),
+- 503 + Retry-After: el planificador del servicio está lleno (SchedulerBusy),
+- 400: petición mal formada; 500: error inesperado del render.
+
+`session` identifica a la sesión de la UI ante el planificador del servicio (equidad
+entre sesiones aunque todas lleguen desde el mismo servidor de UI); sin ella se usa la IP
+del cliente.
+
+GET /health regresa el estado del planificador en JSON.
+
+Para probar en una sola máquina::
+
+    python -m ficha.service --port 8701 &
+    python -m ficha.service --port 8702 &
+    FICHA_RENDER_URL=http://127.0.0.1:8701,http://127.0.0.1:8702 streamlit run main.py
+"""
+import http.client
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+from ficha.defaults import DEFAULT_DPI, DEFAULT_QUALITY
+from ficha.errors import AttachmentError
+from ficha.scheduler import SchedulerBusy, get_scheduler
+
+_CHUNK = 1024 * 1024
+_MAX_MANIFEST = 4 * 1024 * 1024
+RETRY_AFTER = 2
+
+
+def _upload_chunks(uf):
+    """Bytes de un upload por bloques, sin copiarlo entero si se puede evitar."""
+    path = getattr(uf, "path", None)
+    if path:
+        with open(path, "rb") as f:
+            yield from iter(lambda: f.read(_CHUNK), b"")
+        return
+    buf = uf.getbuffer() if hasattr(uf, "getbuffer") else memoryview(uf.getvalue())
+    for i in range(0, len(buf), _CHUNK):
+        yield buf[i:i + _CHUNK]
+
+
+def _upload_size(uf):
+    path = getattr(uf, "path", None)
+    if path:
+        return os.path.getsize(path)
+    size = getattr(uf, "size", None)
+    return size if size is not None else len(uf.getvalue())
+
+
+# ----------------------------
+# Servidor
+# ----------------------------
+def _check_manifest(manifest):
+    """Lanza ValueError si el manifiesto no tiene la forma del protocolo."""
+    if not isinstance(manifest, dict):
+        raise ValueError("el manifiesto debe ser un objeto JSON")
+    if not isinstance(manifest.get("data"), dict):
+        raise ValueError("'data' debe ser un objeto")
+    attachments = manifest.get("attachments", [])
+    if not isinstance(attachments, list):
+        raise ValueError("'attachments' debe ser una lista")
+    for i, a in enumerate(attachments):
+        if not (isinstance(a, dict) and isinstance(a.get("name"), str)
+                and type(a.get("size")) is int and a["size"] >= 0
+                and isinstance(a.get("pages"), (str, type(None)))):
+            raise ValueError(f"anexo {i}: se espera {{name: texto, size: entero, pages: texto o null}}")
+
+
+def _make_handler(workers, cache, store):
+    from http.server import BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _reply(self, status, body, content_type="application/json", headers=()):
+            if isinstance(body, (dict, list)):
+                body = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in headers:
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/health":
+                self._reply(404, {"reason": "no encontrado"})
+                return
+            self._reply(200, get_scheduler().stats())
+
+        def do_POST(self):
+            if self.path.split("?")[0] != "/render":
+                self.close_connection = True
+                self._reply(404, {"reason": "no encontrado"})
+                return
+            tmp = tempfile.mkdtemp(prefix="ficha-srv-")
+            try:
+                self._render(tmp)
+            finally:
+                shutil.rmtree(tmp, ignore_errors=True)
+
+        def _read_upload(self, dest, size):
+            with open(dest, "wb") as f:
+                while size:
+                    block = self.rfile.read(min(_CHUNK, size))
+                    if not block:
+                        raise ValueError("cuerpo incompleto")
+                    f.write(block)
+                    size -= len(block)
+
+        def _discard(self, size):
+            while size > 0:
+                block = self.rfile.read(min(_CHUNK, size))
+                if not block:
+                    break
+                size -= len(block)
+
+        def _render(self, tmp):
+            from ficha.pdf import PathUpload, build_base_pdf, write_pdf_with_attachments
+
+            try:
+                length = int(self.headers.get("Content-Length", ""))
+                line = self.rfile.readline(_MAX_MANIFEST)
+                manifest = json.loads(line)
+                _check_manifest(manifest)
+                attachments = manifest.get("attachments", [])
+            except ValueError as e:
+                self.close_connection = True
+                self._reply(400, {"reason": f"petición inválida ({e})"})
+                return
+
+            # Se admite antes de leer los anexos: si está lleno se contesta sin guardarlos
+            try:
+                ticket = get_scheduler().submit(manifest.get("session") or self.client_address[0], length)
+            except SchedulerBusy as e:
+                # Se descarta el cuerpo (por bloques) para que el cliente alcance a leer el 503
+                # y la conexión siga sirviendo
+                self._discard(length - len(line))
+                self._reply(503, {"reason": e.reason}, headers=[("Retry-After", str(RETRY_AFTER))])
+                return
+
+            try:
+                uploads = []
+                for i, a in enumerate(attachments):
+                    dest = os.path.join(tmp, f"{i:03d}{os.path.splitext(a['name'])[1].lower()}")
+                    self._read_upload(dest, int(a["size"]))
+                    uploads.append(PathUpload(dest, a["name"]))
+                ticket.wait()
+                t0 = time.perf_counter()
+                base = build_base_pdf(manifest["data"], generated_at=manifest.get("generated_at"),
+                                      invariant=manifest.get("invariant", False))
+                out = os.path.join(tmp, "final.pdf")
+                skipped = write_pdf_with_attachments(
+                    out, manifest["data"], uploads, dpi=manifest.get("dpi", DEFAULT_DPI),
+                    quality=manifest.get("quality", DEFAULT_QUALITY), workers=workers, cache=cache,
+                    store=store, base_pdf=base, pages=[a.get("pages") for a in attachments],
+                    optimize=manifest.get("optimize", False), target_bytes=manifest.get("target_bytes"),
+                    skip_invalid=manifest.get("skip_invalid", False),
+                )
+                seconds = time.perf_counter() - t0
+            except AttachmentError as e:
+                self._reply(422, {"name": e.name, "reason": e.reason})
+                return
+            except (KeyError, TypeError, ValueError) as e:
+                self.close_connection = True
+                self._reply(400, {"reason": f"petición inválida ({e})"})
+                return
+            except Exception as e:
+                self.close_connection = True
+                self._reply(500, {"reason": f"{type(e).__name__}: {e}"})
+                return
+            finally:
+                ticket.release()
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/pdf")
+            self.send_header("Content-Length", str(os.path.getsize(out)))
+            self.send_header("X-Ficha-Render-Seconds", f"{seconds:.3f}")
+            if skipped:
+                # JSON en ASCII (los encabezados HTTP son latin-1)
+                self.send_header("X-Ficha-Skipped", json.dumps([{"name": e.name, "reason": e.reason}
+                                                                 for e in skipped]))
+            self.end_headers()
+            with open(out, "rb") as f:
+                shutil.copyfileobj(f, self.wfile, _CHUNK)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def serve(port, host="127.0.0.1", workers=None, cache=None, store=None, background=True):
+    """Levanta el servicio de render. Regresa el servidor (para `shutdown`).
+
+    `cache` y `store` se pasan a `write_pdf_with_attachments` (ver ficha.blobstore).
+    Con background=True corre en un hilo daemon (para pruebas en el mismo proceso).
+    """
+    from http.server import ThreadingHTTPServer
+
+    server = ThreadingHTTPServer((host, port), _make_handler(workers, cache, store))
+    server.daemon_threads = True
+    if background:
+        threading.Thread(target=server.serve_forever, name="ficha-render-service", daemon=True).start()
+    else:
+        server.serve_forever()
+    return server
+
+
+# ----------------------------
+# Cliente
+# ----------------------------
+class RenderTimeout(TimeoutError):
+    """El servidor aceptó la petición pero no contestó dentro de `render_timeout`."""
+
+
+class RenderClient:
+    """Cliente del servicio de render, con reuso de conexiones y reparto entre servidores.
+
+    `urls` es una lista (o una cadena separada por comas) de http://host:puerto. Las
+    conexiones keep-alive quedan en un pool por servidor y se reutilizan entre renders (y
+    entre sesiones, si el cliente se comparte); las peticiones se reparten en turno y si
+    un servidor está lleno (503) o no responde al conectar se intenta con el siguiente.
+    `timeout` (s) aplica a conectar y a cada escritura del socket; ya enviada la petición,
+    la espera de la respuesta (cola + render en el servidor) usa `render_timeout`. Un
+    timeout a esas alturas no se reintenta en otro servidor: el primero puede seguir
+    generando el mismo PDF.
+    """
+
+    def __init__(self, urls, timeout=120.0, render_timeout=900.0):
+        if isinstance(urls, str):
+            urls = [u.strip() for u in urls.split(",") if u.strip()]
+        if not urls:
+            raise ValueError("se necesita al menos una URL del servicio de render")
+        self.servers = [urlsplit(u) for u in urls]
+        self.timeout = timeout
+        self.render_timeout = render_timeout
+        self._next = itertools.count()
+        self._idle = {s.netloc: [] for s in self.servers}
+        self._lock = threading.Lock()
+
+    def _acquire(self, server):
+        with self._lock:
+            idle = self._idle[server.netloc]
+            if idle:
+                return idle.pop(), True
+        return http.client.HTTPConnection(server.hostname, server.port or 80, timeout=self.timeout), False
+
+    def _release(self, server, conn, resp):
+        if resp.will_close:
+            conn.close()
+            return
+        with self._lock:
+            self._idle[server.netloc].append(conn)
+
+    def close(self):
+        with self._lock:
+            conns = [c for idle in self._idle.values() for c in idle]
+            for idle in self._idle.values():
+                idle.clear()
+        for conn in conns:
+            conn.close()
+
+    def _post(self, server, manifest, uploads, sizes):
+        head = json.dumps(manifest, ensure_ascii=True).encode("ascii") + b"\n"
+
+        def body():
+            yield head
+            for uf in uploads:
+                yield from _upload_chunks(uf)
+
+        headers = {"Content-Type": "application/x-ficha-render", "Content-Length": str(len(head) + sum(sizes))}
+        conn, reused = self._acquire(server)
+        try:
+            return conn, self._request(conn, body(), headers)
+        except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+            conn.close()
+            if not reused:
+                raise
+        # El servidor cerró la conexión keep-alive mientras estaba libre: una vez más con una nueva
+        conn = http.client.HTTPConnection(server.hostname, server.port or 80, timeout=self.timeout)
+        try:
+            return conn, self._request(conn, body(), headers)
+        except BaseException:
+            conn.close()
+            raise
+
+    def _request(self, conn, body, headers):
+        if conn.sock is None:
+            conn.connect()  # un error aquí (servidor caído) sí pasa al siguiente servidor
+        else:
+            conn.sock.settimeout(self.timeout)
+        try:
+            conn.request("POST", "/render", body=body, headers=headers)
+            # Enviada: el servidor la tiene en cola o generándose
+            conn.sock.settimeout(self.render_timeout)
+            return conn.getresponse()
+        except TimeoutError as e:
+            conn.close()
+            raise RenderTimeout(f"el servicio de render no respondió a tiempo ({e})") from e
+
+    def write(self, out, data: dict, uploads, dpi=DEFAULT_DPI, quality=DEFAULT_QUALITY, pages=None,
+              generated_at=None, invariant=False, optimize=False, target_bytes=None, skip_invalid=False,
+              session=None, trace=None):
+        """Genera el PDF en el servicio y lo escribe en `out` (archivo binario) por bloques.
+
+        Regresa la lista de AttachmentError de los anexos omitidos (con skip_invalid=True).
+        `session` es la llave de equidad en el planificador del servicio. Lanza
+        AttachmentError si un anexo no sirve, SchedulerBusy si todos los servidores están
+        llenos y RenderTimeout si el servidor que aceptó la petición no contesta a tiempo; si
+        ningún servidor acepta la conexión se propaga el último error de conexión.
+        """
+        from ficha.metrics import NULL_TRACE
+
+        trace = trace or NULL_TRACE
+        uploads = list(uploads or [])
+        pages = list(pages) if pages else [None] * len(uploads)
+        sizes = [_upload_size(uf) for uf in uploads]
+        manifest = {
+            "data": data, "generated_at": generated_at, "invariant": invariant, "dpi": dpi,
+            "quality": quality, "optimize": optimize, "target_bytes": target_bytes, "skip_invalid": skip_invalid,
+            "session": session,
+            "attachments": [{"name": uf.name, "size": s, "pages": p} for uf, s, p in zip(uploads, sizes, pages)],
+        }
+
+        start = next(self._next)
+        busy = error = None
+        for k in range(len(self.servers)):
+            server = self.servers[(start + k) % len(self.servers)]
+            with trace.span("remote_render", server=server.netloc) as sp:
+                sp.bytes_in = sum(sizes)
+                try:
+                    conn, resp = self._post(server, manifest, uploads, sizes)
+                except RenderTimeout:
+                    raise
+                except OSError as e:
+                    error = e
+                    continue
+                try:
+                    if resp.status == 200:
+                        sp.set(service_seconds=float(resp.getheader("X-Ficha-Render-Seconds", 0)))
+                        while block := resp.read(_CHUNK):
+                            out.write(block)
+                            sp.bytes_out += len(block)
+                        self._release(server, conn, resp)
+                        skipped = json.loads(resp.getheader("X-Ficha-Skipped") or "[]")
+                        return [AttachmentError(e["name"], e["reason"]) for e in skipped]
+                    payload = json.loads(resp.read() or b"{}")
+                except BaseException:
+                    conn.close()
+                    raise
+                self._release(server, conn, resp)
+                if resp.status == 503:
+                    busy = SchedulerBusy(payload.get("reason", "servicio de render ocupado"))
+                    continue
+                if resp.status == 422:
+                    raise AttachmentError(payload.get("name", "anexo"), payload.get("reason", ""))
+                raise RuntimeError(f"servicio de render: HTTP {resp.status} ({payload.get('reason', '')})")
+        raise busy or error
+
+
+def main(argv=None):
+    import argparse
+
+    from ficha.blobstore import get_blob_store
+    from ficha.cache import page_cache
+    from ficha.workers import default_workers
+
+    parser = argparse.ArgumentParser(description="Servicio HTTP de render de fichas.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8701)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Procesos del pool de conversión (default: FICHA_WORKERS o CPUs)")
+    args = parser.parse_args(argv)
+    print(f"Servicio de render en http://{args.host}:{args.port}", flush=True)
+    store = get_blob_store()
+    serve(args.port, args.host, workers=args.workers or default_workers(), cache=store or page_cache,
+          store=store, background=False)
+
+
+if __name__ == "__main__":
+    main()
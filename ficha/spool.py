@@ -0,0 +1,65 @@
+"""Spool en disco para anexos y partes intermedias grandes.
+
+Las partes de menos de `threshold` bytes se quedan en memoria como `bytes`; las mayores
+se escriben a archivos temporales y viajan como rutas (str). Así los procesos del pool
+reciben rutas en vez de megabytes serializados y PyPDF2 lee los PDFs del disco por
+demanda (con una ruta usa FileIO; con un stream copia todo a un BytesIO).
+"""
+import os
+import shutil
+import tempfile
+
+# Partes iguales o mayores a esto se mandan a disco
+SPOOL_THRESHOLD = int(os.environ.get("FICHA_SPOOL_THRESHOLD", 4 * 1024 * 1024))
+
+
+def is_spooled(part) -> bool:
+    """True si la parte es una ruta en disco (y no bytes en memoria)."""
+    return isinstance(part, (str, os.PathLike))
+
+
+def read_part(part) -> bytes:
+    if is_spooled(part):
+        with open(part, "rb") as f:
+            return f.read()
+    return part
+
+
+def part_size(part) -> int:
+    return os.path.getsize(part) if is_spooled(part) else len(part)
+
+
+class Spool:
+    """Directorio temporal con las partes de un render; se borra al salir del `with`."""
+
+    def __init__(self, threshold=SPOOL_THRESHOLD, dir=None):
+        self.threshold = threshold
+        self.path = tempfile.mkdtemp(prefix="ficha-", dir=dir)
+        self._n = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def new_path(self, suffix=".pdf") -> str:
+        self._n += 1
+        return os.path.join(self.path, f"parte-{self._n:04d}{suffix}")
+
+    def add_upload(self, uf):
+        """Regresa la parte de un upload: su ruta si ya está en disco, bytes si es chico
+        o una copia en el spool (sin pasar por `getvalue`) si es grande."""
+        path = getattr(uf, "path", None)
+        if path:
+            return path
+        size = getattr(uf, "size", None)
+        if size is None or size < self.threshold or not hasattr(uf, "getbuffer"):
+            return uf.getvalue()
+        dest = self.new_path(os.path.splitext(uf.name)[1].lower())
+        with open(dest, "wb") as f:
+            f.write(uf.getbuffer())  # memoryview del BytesIO: sin copia extra
+        return dest
@@ -0,0 +1,406 @@
+"""Plantilla precompilada de la ficha base.
+
+La estructura de la ficha (títulos de sección, subtítulos, etiquetas, reglas y el bloque
+condicional 1B) es fija; solo cambian los valores. `compile_template` convierte la
+descripción declarativa `FICHA` en una lista de pasos ya medidos (una vez por proceso):
+el ancho de cada etiqueta y su partición en líneas ya están calculados, así que cada
+render solo mide y acomoda el texto de los valores.
+
+La paginación también es medida (`layout` + `_Renderer.flow`): cada caja sabe su alto
+antes de dibujarse, los títulos no quedan solos al pie de una página y los campos largos
+se parten por líneas sin pasarse del margen. Con FICHA_TWO_COLUMNS=1 los campos cortos
+(Sí/No, números) van de dos en dos.
+"""
+import os
+from functools import lru_cache
+
+from reportlab.lib.pagesizes import LETTER
+from reportlab.lib.units import inch
+
+from ficha.text import split_state, wrap_continued
+
+PAGE_W, PAGE_H = LETTER
+LEFT = 0.75 * inch
+RIGHT = 0.75 * inch
+TOP = PAGE_H - 0.75 * inch
+BOTTOM = 0.75 * inch
+MAX_W = PAGE_W - LEFT - RIGHT
+# Dos columnas para campos cortos (FICHA_TWO_COLUMNS=1)
+GUTTER = 18
+COL_W = (MAX_W - GUTTER) / 2
+TWO_COLUMNS = os.environ.get("FICHA_TWO_COLUMNS") == "1"
+
+FIELD_FONT = "Helvetica"
+FIELD_SIZE = 10
+FIELD_LEADING = 12
+
+BLACK = (0, 0, 0)
+RED = (1, 0, 0)
+
+
+# ----------------------------
+# Descripción de la ficha
+# ----------------------------
+def _joined(key):
+    def get(data):
+        return ", ".join(data.get(key, [])) or "—"
+    return get
+
+
+def _fields(keys, red=False):
+    return [("field", k, k, red) for k in keys]
+
+
+def _is_female(data):
+    return (data.get("Sexo") or "").lower().startswith("fem")
+
+
+FICHA = [
+    ("section", "0) Registro de la información"),
+    *_fields(["Fecha de elaboración", "Registró (nombre)"]),
+
+    ("section", "1) Identificación"),
+    *_fields(["Nombre completo", "Edad", "Sexo", "CURP", "Domicilio", "Teléfono del paciente"]),
+
+    # Contacto de emergencia en ROJO
+    ("heading", "Contacto de emergencia", True),
+    *_fields(["Contacto de emergencia", "Parentesco", "Teléfono de contacto"], red=True),
+
+    ("heading", "Médico/Clínica habitual", False),
+    *_fields(["Médico tratante", "Teléfono médico", "Clínica/Hospital habitual"]),
+
+    # Obstétrico (solo si aplica)
+    ("when", _is_female, [
+        ("section", "1B) Antecedentes gineco-obstétricos (si aplica)"),
+        *_fields([
+            "Embarazos (G)", "Partos (P)", "Cesáreas (C)", "Abortos (A)",
+            "Complicaciones en embarazos/partos", "Menopausia (edad aprox.)", "Cirugías ginecológicas relevantes"
+        ]),
+    ]),
+
+    ("section", "2) Datos básicos"),
+    *_fields(["Peso (kg)", "Estatura (m)", "Presión usual", "Diabetes", "Última glucosa conocida"]),
+
+    ("section", "4) Antecedentes médicos"),
+    ("field", "Enfermedades diagnosticadas", _joined("Enfermedades"), False),
+    ("field", "Otros relevantes", "Otros relevantes", False),
+    ("field", "Cirugías / hospitalizaciones importantes", "Cirugías/hospitalizaciones", False),
+
+    ("section", "4B) Historial de infancia (clínicamente útil)"),
+    ("field", "Nacimiento (prematuro/complicaciones)", "Infancia - nacimiento", False),
+    ("field", "Infecciones graves SNC (meningitis/encefalitis)", "Infancia - SNC", False),
+    ("field", "Convulsiones febriles en infancia", "Infancia - convulsiones febriles", False),
+    ("field", "Traumatismo craneal importante en infancia", "Infancia - TCE", False),
+    ("field", "Enfermedades crónicas/congénitas desde infancia", "Infancia - crónicas", False),
+    ("field", "Desarrollo/Aprendizaje (retrasos significativos)", "Infancia - desarrollo", False),
+    ("field", "Otros antecedentes de infancia", "Infancia - otros", False),
+
+    ("section", "5) Medicamentos actuales"),
+    ("meds",),
+    ("field", "Medicamentos de riesgo (marcados)", _joined("Riesgo meds"), False),
+    ("field", "Última dosis conocida", "Última dosis conocida", False),
+
+    ("section", "6) Alergias y reacciones"),
+    *_fields(["Alergia a medicamentos", "Cuáles y reacción", "Alergias alimentos/otras", "Alergia a yodo/contraste", "Látex"]),
+
+    ("section", "7) Sustancias y hábitos"),
+    *_fields(["Tabaco", "Alcohol", "Otras sustancias", "Café/energizantes"]),
+
+    ("section", "8) Estado funcional y basal"),
+    *_fields(["Estado habitual previo", "Movilidad", "ABVD (baño/vestido/comer)", "Memoria/orientación habitual"]),
+
+    ("section", "8C) SARC-F (resumen)"),
+    ("field", "SARC-F total (0-10)", "SARC-F total", False),
+    ("field", "Detalle SARC-F", "SARC-F detalle", False),
+
+    ("section", "9) Últimos 15 días (neuro-cognitivo / equilibrio)"),
+    ("field", "Cambios en agudeza visual", "15d - visión", False),
+    ("field", "Cefalea / dolor de cabeza", "15d - cefalea", False),
+    ("field", "Migraña", "15d - migraña", False),
+    ("field", "Mareo / vértigo", "15d - mareo", False),
+    ("field", "Problemas de equilibrio", "15d - equilibrio", False),
+    ("field", "Caídas en 15 días", "15d - caídas", False),
+    ("field", "Desorientación/confusión", "15d - confusión", False),
+    ("field", "Cambios de memoria/atención", "15d - memoria", False),
+    ("field", "Debilidad/adormecimiento (focal)", "15d - focalidad", False),
+    ("field", "Lenguaje/habla (dificultad)", "15d - habla", False),
+    ("field", "Sueño (cambios marcados)", "15d - sueño", False),
+    ("field", "Otros síntomas 15 días", "15d - otros", False),
+
+    ("section", "10) Salud bucal / prótesis dentales"),
+    ("field", "Uso de prótesis dental", "Prótesis - uso", False),
+    ("field", "Tipo (parcial/total)", "Prótesis - tipo", False),
+    ("field", "Ubicación (superior/inferior)", "Prótesis - ubicación", False),
+    ("field", "Molestias/úlceras/ajuste", "Prótesis - molestias", False),
+    ("field", "Dificultad para masticar/deglutir", "Prótesis - masticación", False),
+    ("field", "Última valoración dental", "Prótesis - última revisión", False),
+
+    ("section", "11) Datos útiles en urgencias"),
+    *_fields([
+        "Caídas recientes", "Marcapasos/implantes", "Vacunas/infecciones recientes",
+        "Directiva anticipada", "Tipo de sangre", "Seguro/afiliación"
+    ]),
+
+    # Anexos: listado
+    ("section", "Anexos (análisis previos) - listado"),
+    ("anexos",),
+]
+
+
+# ----------------------------
+# Compilación
+# ----------------------------
+class Label:
+    """Etiqueta de un campo ya medida: estado del partido de "Etiqueta:" listo para continuar."""
+
+    __slots__ = ("state",)
+
+    def __init__(self, label, max_w=MAX_W):
+        self.state = split_state(f"{label}:", FIELD_FONT, FIELD_SIZE, max_w)
+
+
+def _compile(steps):
+    compiled = []
+    for step in steps:
+        kind = step[0]
+        if kind == "field":
+            _, label, key, red = step
+            getter = key if callable(key) else (lambda data, k=key: data.get(k))
+            # También medida a media página, para acomodar campos cortos en dos columnas
+            compiled.append(("field", Label(label), getter, red, Label(label, COL_W)))
+        elif kind == "when":
+            compiled.append(("when", step[1], _compile(step[2])))
+        else:
+            compiled.append(step)
+    return compiled
+
+
+@lru_cache(maxsize=None)
+def compile_template():
+    """Lista de pasos de la ficha con todas las etiquetas ya medidas (una vez por proceso)."""
+    return _compile(FICHA)
+
+
+@lru_cache(maxsize=256)
+def _label(label):
+    # Etiquetas generadas (p. ej. "Medicamento 7"): se miden una vez y se reutilizan
+    return Label(label)
+
+
+_FILE_LABEL = Label("Archivo")
+
+
+def wrap_field(label: Label, value, max_w=MAX_W):
+    """Líneas de "etiqueta: valor" idénticas a `simpleSplit`, midiendo solo el valor."""
+    text = f"{value if value not in (None, '') else '—'}"
+    return wrap_continued(label.state, text, FIELD_FONT, FIELD_SIZE, max_w)
+
+
+# ----------------------------
+# Layout medido
+# ----------------------------
+# La ficha se convierte primero en cajas con su alto real y después se pagina:
+#
+#   ("section", título)              SECTION_H
+#   ("heading", texto, rojo)         HEADING_H
+#   ("field", líneas, rojo)          FIELD_LEADING por línea + FIELD_GAP (se puede partir)
+#   ("row", (líneas, rojo), ...)     dos campos de una línea lado a lado (columns=True)
+#
+# Secciones y encabezados se quedan en la misma página que el inicio de lo que les sigue;
+# un campo largo se parte entre páginas por líneas, dejando al menos MIN_LINES abajo.
+SECTION_H = 32
+HEADING_H = 14
+FIELD_GAP = 2
+MIN_LINES = 2
+
+
+def _boxes(steps, data, columns, out):
+    for step in steps:
+        kind = step[0]
+        if kind == "field":
+            _, label, getter, red, col_label = step
+            value = getter(data)
+            short = wrap_field(col_label, value, COL_W) if columns else None
+            out.append(("field", wrap_field(label, value), red, short if short and len(short) == 1 else None))
+        elif kind == "section":
+            out.append(("section", step[1]))
+        elif kind == "heading":
+            out.append(("heading", step[1], step[2]))
+        elif kind == "when":
+            if step[1](data):
+                _boxes(step[2], data, columns, out)
+        elif kind == "meds":
+            meds = data.get("Medicamentos", [])
+            if not meds:
+                out.append(("field", wrap_field(_label("Medicamentos"), "—"), False, None))
+            for i, m in enumerate(meds, start=1):
+                value = (f"{m.get('nombre','—')} | {m.get('dosis','—')} | "
+                         f"{m.get('frecuencia','—')} | {m.get('para_que','—')}")
+                out.append(("field", wrap_field(_label(f"Medicamento {i}"), value), False, None))
+        elif kind == "anexos":
+            anexos = data.get("Anexos", [])
+            if not anexos:
+                out.append(("field", wrap_field(_label("Anexos"), "—"), False, None))
+            for a in anexos:
+                out.append(("field", wrap_field(_FILE_LABEL, a), False, None))
+
+
+def layout(data: dict, columns=False) -> list:
+    """Cajas de la ficha para estos datos, ya medidas. Con `columns` los pares de campos
+    consecutivos que caben en una línea a media página (Sí/No, números...) van en una fila."""
+    boxes = []
+    _boxes(compile_template(), data, columns, boxes)
+    if not columns:
+        return [box[:3] for box in boxes]
+    packed = []
+    i = 0
+    while i < len(boxes):
+        box = boxes[i]
+        nxt = boxes[i + 1] if i + 1 < len(boxes) else None
+        if box[0] == "field" and box[3] and nxt and nxt[0] == "field" and nxt[3]:
+            packed.append(("row", (box[3], box[2]), (nxt[3], nxt[2])))
+            i += 2
+            continue
+        packed.append(box[:3])
+        i += 1
+    return packed
+
+
+def _height(box) -> float:
+    kind = box[0]
+    if kind == "section":
+        return SECTION_H
+    if kind == "heading":
+        return HEADING_H
+    if kind == "row":
+        return FIELD_LEADING + FIELD_GAP
+    return len(box[1]) * FIELD_LEADING + FIELD_GAP
+
+
+def _min_height(box) -> float:
+    # Lo mínimo de la caja que debe caber para empezarla en esta página (con la misma
+    # geometría que `_height`, o `fits` dejaría pasar una sola línea)
+    if box[0] == "field" and len(box[1]) > MIN_LINES:
+        return MIN_LINES * FIELD_LEADING + FIELD_GAP
+    return _height(box)
+
+
+# ----------------------------
+# Render
+# ----------------------------
+class _Renderer:
+    """Pagina y dibuja las cajas en un canvas evitando cambios de fuente/color redundantes."""
+
+    def __init__(self, c):
+        self.c = c
+        self.y = TOP
+        self.pages = 1
+        self._font = None
+        self._fill = None
+        self._line_width = None
+
+    def font(self, name, size):
+        if self._font != (name, size):
+            self.c.setFont(name, size)
+            self._font = (name, size)
+
+    def fill(self, rgb):
+        if self._fill != rgb:
+            self.c.setFillColorRGB(*rgb)
+            self._fill = rgb
+
+    def show_page(self):
+        self.c.showPage()
+        # showPage reinicia el estado gráfico del canvas
+        self._font = self._fill = self._line_width = None
+        self.y = TOP
+        self.pages += 1
+
+    def fits(self, height) -> bool:
+        # `y` es la siguiente línea base; la última línea de texto de la caja queda a
+        # `height - FIELD_LEADING - FIELD_GAP` de ella y no debe bajar del margen
+        return self.y - height + FIELD_LEADING + FIELD_GAP >= BOTTOM
+
+    def header(self, generated_at):
+        self.font("Helvetica-Bold", 14)
+        self.c.drawString(LEFT, self.y, "Ficha rápida para personal de salud (Adulto mayor)")
+        self.y -= 18
+        self.font("Helvetica", 9)
+        self.c.drawString(LEFT, self.y, f"Generado: {generated_at}")
+        self.y -= 18
+
+    def section(self, title):
+        self.y -= 6
+        self.font("Helvetica-Bold", 12)
+        self.fill(BLACK)
+        self.c.drawString(LEFT, self.y, title)
+        self.y -= 14
+        if self._line_width != 0.7:
+            self.c.setLineWidth(0.7)
+            self._line_width = 0.7
+        self.c.line(LEFT, self.y, LEFT + MAX_W, self.y)
+        self.y -= 12
+
+    def heading(self, text, red):
+        self.font("Helvetica-Bold", 11)
+        self.fill(RED if red else BLACK)
+        self.c.drawString(LEFT, self.y, text)
+        self.y -= 14
+
+    def field(self, lines, red=False):
+        self.font(FIELD_FONT, FIELD_SIZE)
+        self.fill(RED if red else BLACK)
+        for i, line in enumerate(lines):
+            # Campo largo: lo que no cabe sigue en la página siguiente (nunca bajo el margen)
+            if i and self.y < BOTTOM:
+                self.show_page()
+                self.font(FIELD_FONT, FIELD_SIZE)
+                self.fill(RED if red else BLACK)
+            self.c.drawString(LEFT, self.y, line)
+            self.y -= FIELD_LEADING
+        self.y -= FIELD_GAP
+
+    def row(self, cells):
+        self.font(FIELD_FONT, FIELD_SIZE)
+        for x, (lines, red) in zip((LEFT, LEFT + COL_W + GUTTER), cells):
+            self.fill(RED if red else BLACK)
+            self.c.drawString(x, self.y, lines[0])
+        self.y -= FIELD_LEADING + FIELD_GAP
+
+    def flow(self, boxes):
+        i = 0
+        while i < len(boxes):
+            # Secciones y encabezados seguidos más el inicio de la caja que les sigue
+            j = i
+            while j < len(boxes) and boxes[j][0] in ("section", "heading"):
+                j += 1
+            need = sum(_height(b) for b in boxes[i:j])
+            if j < len(boxes):
+                need += _min_height(boxes[j])
+                j += 1
+            if not self.fits(need) and self.y < TOP:
+                self.show_page()
+            for box in boxes[i:j]:
+                kind = box[0]
+                if kind == "section":
+                    self.section(box[1])
+                elif kind == "heading":
+                    self.heading(box[1], box[2])
+                elif kind == "row":
+                    self.row(box[1:])
+                else:
+                    self.field(box[1], box[2])
+            i = j
+
+
+def render_ficha(c, data: dict, generated_at: str, columns=None):
+    """Dibuja la ficha completa en el canvas `c` (termina con showPage, sin save).
+
+    `columns` acomoda en dos columnas los campos cortos (default: FICHA_TWO_COLUMNS=1).
+    Regresa el número de páginas.
+    """
+    r = _Renderer(c)
+    r.header(generated_at)
+    r.flow(layout(data, TWO_COLUMNS if columns is None else columns))
+    c.showPage()
+    return r.pages
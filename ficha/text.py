@@ -0,0 +1,129 @@
+"""Medición y partido de texto con memoización.
+
+`simpleSplit` de ReportLab vuelve a medir cada palabra carácter por carácter en cada
+llamada. Aquí cada fuente tiene una tabla de anchos por carácter (en milésimas de em,
+llenada por demanda con `stringWidth`), las palabras ya medidas se recuerdan y los
+resultados de partir un texto se guardan en un LRU por (texto, fuente, tamaño, ancho).
+Los valores repetidos ("No", "Sí", "—", opciones de los selectbox) se parten una sola vez.
+
+Los anchos se calculan con la misma aritmética que `stringWidth` para fuentes Type1
+(suma entera de anchos * 0.001 * tamaño), así que las líneas son idénticas a las de
+`simpleSplit`.
+"""
+from functools import lru_cache
+
+from reportlab.pdfbase.pdfmetrics import stringWidth
+
+# Tamaño del LRU de textos partidos
+WRAP_CACHE_SIZE = 4096
+_WORD_CACHE_SIZE = 65536
+
+
+class GlyphWidths:
+    """Tabla de anchos por carácter de una fuente, en unidades de 1/1000 em."""
+
+    __slots__ = ("font_name", "_widths")
+
+    def __init__(self, font_name):
+        self.font_name = font_name
+        self._widths = {}
+
+    def units(self, text) -> int:
+        widths = self._widths
+        total = 0
+        for ch in text:
+            w = widths.get(ch)
+            if w is None:
+                w = stringWidth(ch, self.font_name, 1000)
+                if w == int(w):
+                    w = int(w)
+                widths[ch] = w
+            total += w
+        return total
+
+
+_tables = {}
+
+
+def glyph_widths(font_name) -> GlyphWidths:
+    table = _tables.get(font_name)
+    if table is None:
+        table = _tables[font_name] = GlyphWidths(font_name)
+    return table
+
+
+@lru_cache(maxsize=_WORD_CACHE_SIZE)
+def _units(text, font_name):
+    return glyph_widths(font_name).units(text)
+
+
+def string_width(text, font_name, font_size) -> float:
+    """Igual que `pdfmetrics.stringWidth`, pero con anchos memorizados."""
+    return _units(text, font_name) * 0.001 * font_size
+
+
+def split_state(text, font_name, font_size, max_w, state=None):
+    """Partido voraz de `simpleSplit` sobre las palabras de `text` (una sola línea lógica).
+
+    Regresa el estado final (líneas cerradas, texto de la línea abierta, ancho de la línea
+    abierta); pasando ese estado como `state` se continúa el partido con más palabras.
+    """
+    ws = string_width(" ", font_name, font_size)
+    if state is None or not state[1]:
+        lines, current, w = list(state[0]) if state else [], [], -ws
+    else:
+        lines, current, w = list(state[0]), [state[1]], state[2]
+    for t in text.split():
+        lt = string_width(t, font_name, font_size)
+        if w + ws + lt <= max_w or not current:
+            current.append(t)
+            w = w + ws + lt
+        else:
+            lines.append(" ".join(current))
+            current, w = [t], lt
+    return tuple(lines), " ".join(current), w
+
+
+def _close(state):
+    lines, open_text, _ = state
+    return lines + (open_text,) if open_text else lines
+
+
+@lru_cache(maxsize=WRAP_CACHE_SIZE)
+def wrap_text(text, font_name, font_size, max_w) -> tuple:
+    """Mismas líneas que `simpleSplit(text, font_name, font_size, max_w)`, como tupla."""
+    lines = ()
+    for logical in text.split("\n"):
+        lines += _close(split_state(logical, font_name, font_size, max_w))
+    return lines
+
+
+@lru_cache(maxsize=WRAP_CACHE_SIZE)
+def wrap_continued(state, text, font_name, font_size, max_w) -> tuple:
+    """Líneas de `text` continuando un partido ya empezado (p. ej. una etiqueta medida).
+
+    La primera línea lógica de `text` sigue sobre la línea abierta de `state`; las demás
+    se parten por separado, igual que lo haría `simpleSplit` con el texto concatenado.
+    """
+    first, *rest = text.split("\n")
+    lines = _close(split_state(first, font_name, font_size, max_w, state))
+    for logical in rest:
+        lines += _close(split_state(logical, font_name, font_size, max_w))
+    return lines
+
+
+def cache_info() -> dict:
+    """Estadísticas de los cachés (para diagnóstico y benchmarks)."""
+    return {
+        "wrap": wrap_text.cache_info()._asdict(),
+        "wrap_continued": wrap_continued.cache_info()._asdict(),
+        "words": _units.cache_info()._asdict(),
+        "fonts": {name: len(t._widths) for name, t in _tables.items()},
+    }
+
+
+def clear_caches():
+    wrap_text.cache_clear()
+    wrap_continued.cache_clear()
+    _units.cache_clear()
+    _tables.clear()
@@ -0,0 +1,262 @@
+"""Validación temprana de anexos y presupuesto de tiempo/memoria de cada conversión.
+
+`validate_attachment` solo lee encabezados: el tipo sale de los primeros bytes (no de la
+extensión), de una imagen se lee su tamaño en píxeles y de un PDF su tabla xref, el
+/Count del árbol de páginas y si está cifrado. Un PDF dañado o con contraseña, o una
+imagen enorme (bomba de descompresión), se rechaza en milisegundos con un motivo para el
+usuario, antes de que ocupe el pool por minutos o tumbe el proceso a media generación.
+
+`budget` acota el trabajo pesado de cada anexo (ver ficha.pdf.convert_within_budget).
+
+Límites (variables de entorno):
+
+- FICHA_MAX_ATTACHMENT_MB: tamaño máximo de un anexo (default 100)
+- FICHA_MAX_PIXELS: megapíxeles máximos de una imagen (default 80); un JPEG más grande
+  se acepta porque libjpeg lo decodifica reducido, pero siempre se remuestrea
+- FICHA_MAX_PAGES: páginas máximas de un PDF anexo (default 1000)
+- FICHA_ATTACHMENT_SECONDS: tiempo máximo de conversión/unión por anexo (default 60)
+- FICHA_ATTACHMENT_MEMORY_MB: memoria máxima de una conversión (default 1024)
+
+Pillow y PyPDF2 se importan solo al validar.
+"""
+import io
+import multiprocessing
+import os
+import signal
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows: sin límite de memoria
+    resource = None
+
+from ficha.errors import AttachmentError
+from ficha.spool import is_spooled, part_size
+
+_MB = 1024 * 1024
+
+MAX_ATTACHMENT_MB = float(os.environ.get("FICHA_MAX_ATTACHMENT_MB", 100))
+MAX_PIXELS = int(float(os.environ.get("FICHA_MAX_PIXELS", 80)) * 1_000_000)
+MAX_PAGES = int(os.environ.get("FICHA_MAX_PAGES", 1000))
+ATTACHMENT_SECONDS = float(os.environ.get("FICHA_ATTACHMENT_SECONDS", 60))
+ATTACHMENT_MEMORY_MB = int(os.environ.get("FICHA_ATTACHMENT_MEMORY_MB", 1024))
+
+# Límites de un render (0 o None desactiva cada uno)
+Limits = namedtuple("Limits", "max_bytes max_pixels max_pages seconds memory")
+DEFAULT_LIMITS = Limits(
+    max_bytes=int(MAX_ATTACHMENT_MB * _MB),
+    max_pixels=MAX_PIXELS,
+    max_pages=MAX_PAGES,
+    seconds=ATTACHMENT_SECONDS,
+    memory=ATTACHMENT_MEMORY_MB * _MB,
+)
+
+# Espera extra (s) antes de dar por perdida una conversión que no respetó su presupuesto
+BUDGET_GRACE = 5
+
+# Lo que se sabe de un anexo válido sin decodificarlo (pixels: imágenes; pages/encrypted: PDFs)
+AttachmentInfo = namedtuple("AttachmentInfo", "kind format pixels pages encrypted")
+
+# Firmas de los tipos que se anexan; el encabezado %PDF puede venir tras basura inicial
+_SIGNATURES = ((b"\x89PNG\r\n\x1a\n", "image"), (b"\xff\xd8\xff", "image"))
+_PDF_SIGNATURE = b"%PDF-"
+SNIFF_BYTES = 1024
+
+
+def _head(source, n=SNIFF_BYTES) -> bytes:
+    if is_spooled(source):
+        with open(source, "rb") as f:
+            return f.read(n)
+    return bytes(source[:n])
+
+
+class _ViewReader(io.RawIOBase):
+    """Lectura de un memoryview sin copiarlo (io.BytesIO copiaría el upload completo)."""
+
+    def __init__(self, view):
+        self._view = view.cast("B")
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        chunk = self._view[self._pos:self._pos + len(b)]
+        n = len(chunk)
+        b[:n] = chunk
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = (0, self._pos, len(self._view))[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        self._view.release()
+        super().close()
+
+
+def _stream(source):
+    """Stream de lectura sobre un anexo (ruta, bytes o memoryview) sin copiar su contenido."""
+    if is_spooled(source):
+        return open(source, "rb")
+    if isinstance(source, memoryview):
+        return io.BufferedReader(_ViewReader(source))
+    return io.BytesIO(source)
+
+
+def sniff_kind(source):
+    """"pdf", "image" o None según los primeros bytes de `source` (bytes o ruta)."""
+    head = _head(source)
+    for signature, kind in _SIGNATURES:
+        if head.startswith(signature):
+            return kind
+    if _PDF_SIGNATURE in head:
+        return "pdf"
+    return None
+
+
+def validate_attachment(name, source, pages=None, limits=DEFAULT_LIMITS) -> AttachmentInfo:
+    """Revisa un anexo leyendo solo encabezados. Lanza AttachmentError con el motivo.
+
+    `pages` es la selección de páginas de un PDF ("1-3,7"; ver ficha.pages), que también
+    se valida aquí.
+    """
+    size = part_size(source)
+    if limits.max_bytes and size > limits.max_bytes:
+        raise AttachmentError(name, f"archivo de {size / _MB:.0f} MB (máximo {limits.max_bytes / _MB:.0f} MB)")
+    kind = sniff_kind(source)
+    if kind == "image":
+        return _check_image(name, source, limits)
+    if kind == "pdf":
+        return _check_pdf(name, source, pages, limits)
+    raise AttachmentError(name, "tipo de archivo no reconocido (se aceptan PDF, PNG y JPEG)")
+
+
+def _check_image(name, source, limits):
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        # Solo formato y tamaño: `probe_image` lee además la orientación EXIF, que en un
+        # PNG obliga a decodificar la imagen entera
+        with _stream(source) as fh, Image.open(fh) as img:
+            fmt, (width, height) = img.format, img.size
+    except Image.DecompressionBombError:
+        raise AttachmentError(name, "imagen demasiado grande (posible bomba de descompresión)") from None
+    except (UnidentifiedImageError, SyntaxError, ValueError, OSError) as e:
+        if getattr(e, "errno", None) is not None:
+            raise
+        raise AttachmentError(name, f"imagen inválida ({e})") from None
+    pixels = width * height
+    if not pixels:
+        raise AttachmentError(name, "imagen vacía (0 píxeles)")
+    # Un JPEG grande se decodifica directo a 1/2–1/8 del tamaño (Image.draft); el resto no
+    if limits.max_pixels and pixels > limits.max_pixels and fmt != "JPEG":
+        raise AttachmentError(
+            name, f"imagen de {pixels / 1e6:.0f} MP (máximo {limits.max_pixels / 1e6:.0f} MP; "
+                  "posible bomba de descompresión)"
+        )
+    return AttachmentInfo("image", fmt, pixels, None, False)
+
+
+def _check_pdf(name, source, pages, limits):
+    from PyPDF2 import PdfReader
+
+    from ficha.merge import _pdf_error
+    from ficha.pages import parse_pages
+
+    fh = _stream(source)
+    try:
+        reader = PdfReader(fh, strict=False)
+        encrypted = reader.is_encrypted
+        # Los cifrados solo con contraseña de propietario se abren con la contraseña vacía
+        if encrypted and not reader.decrypt(""):
+            raise AttachmentError(name, "PDF protegido con contraseña")
+        n_pages = reader.trailer["/Root"].get_object()["/Pages"].get_object()["/Count"]
+        n_pages = int(n_pages)
+    except (AttachmentError, OSError):
+        raise
+    except Exception as e:
+        raise _pdf_error(name, e) from e
+    finally:
+        fh.close()
+    if n_pages <= 0:
+        raise AttachmentError(name, "el PDF no tiene páginas")
+    if limits.max_pages and n_pages > limits.max_pages:
+        raise AttachmentError(name, f"PDF de {n_pages} páginas (máximo {limits.max_pages})")
+    try:
+        parse_pages(pages, n_pages)
+    except ValueError as e:
+        raise AttachmentError(name, f"selección de páginas: {e}") from e
+    return AttachmentInfo("pdf", "PDF", None, n_pages, encrypted)
+
+
+# ----------------------------
+# Presupuesto por anexo
+# ----------------------------
+class _Expired(Exception):
+    pass
+
+
+def _address_space():
+    """Memoria virtual actual del proceso (bytes), o None si no se puede leer."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _raise_expired(signum, frame):
+    raise _Expired()
+
+
+@contextmanager
+def budget(name, seconds=None, memory=None):
+    """Corre el bloque con un tope de `seconds` y de `memory` bytes adicionales.
+
+    Al pasarse lanza AttachmentError(name, motivo). El tiempo usa SIGALRM (solo en el hilo
+    principal) y la memoria RLIMIT_AS, que es de todo el proceso: se aplica solo en los
+    procesos hijos (workers del pool, lotes), nunca en el servidor de Streamlit, donde
+    limitaría a las demás sesiones. Donde no aplica, el bloque corre sin tope (ficha.pdf deja
+    de esperar por reloj a las conversiones que se pasan).
+    """
+    main_thread = threading.current_thread() is threading.main_thread()
+    alarm = bool(seconds) and main_thread and hasattr(signal, "setitimer")
+    limit = None
+    if memory and resource is not None and multiprocessing.parent_process() is not None:
+        in_use = _address_space()
+        if in_use is not None:
+            soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+            cap = in_use + memory
+            if hard != resource.RLIM_INFINITY:
+                cap = min(cap, hard)
+            if soft == resource.RLIM_INFINITY or cap < soft:
+                limit = (soft, hard)
+                resource.setrlimit(resource.RLIMIT_AS, (cap, hard))
+    if alarm:
+        previous = signal.signal(signal.SIGALRM, _raise_expired)
+        signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    except _Expired:
+        raise AttachmentError(name, f"tardó más de {seconds:g} s") from None
+    except MemoryError:
+        if limit is None:
+            raise
+        raise AttachmentError(name, f"necesitó más de {memory / _MB:.0f} MB de memoria") from None
+    finally:
+        if alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+        if limit is not None:
+            resource.setrlimit(resource.RLIMIT_AS, limit)
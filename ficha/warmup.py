@@ -0,0 +1,40 @@
+"""Precarga en segundo plano de la pila de PDF.
+
+La UI arranca solo con Streamlit; ReportLab, PyPDF2 y Pillow (y la plantilla medida de
+la ficha) se cargan en un hilo después del primer render del formulario, y si hay pool
+de procesos también se levantan sus procesos. Si el usuario pulsa "Generar PDF" antes de
+que termine, el import simplemente espera al hilo (el lock de import de Python lo serializa).
+"""
+import logging
+import threading
+
+from ficha.workers import get_process_pool
+
+logger = logging.getLogger("ficha.warmup")
+
+
+def import_pdf_stack() -> bool:
+    """Importa la pila de PDF y compila la plantilla. También corre dentro del pool."""
+    import ficha.pdf  # noqa: F401
+    from ficha.template import compile_template
+
+    compile_template()
+    return True
+
+
+def _warm(workers):
+    try:
+        import_pdf_stack()
+        if workers and workers > 1:
+            pool = get_process_pool(workers)
+            for fut in [pool.submit(import_pdf_stack) for _ in range(workers)]:
+                fut.result()
+    except Exception:
+        logger.exception("Falló la precarga de la pila de PDF")
+
+
+def warm_up(workers=None) -> threading.Thread:
+    """Lanza la precarga en un hilo daemon y lo regresa."""
+    thread = threading.Thread(target=_warm, args=(workers,), name="ficha-warmup", daemon=True)
+    thread.start()
+    return thread
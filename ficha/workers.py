@@ -0,0 +1,55 @@
+"""Pool de procesos compartido para el trabajo de CPU (decodificar/redimensionar imágenes).
+
+El trabajo de Pillow + ReportLab es mayormente Python puro y queda serializado por el GIL
+si se reparte en hilos, así que se usan procesos. El pool se crea una vez por proceso y
+se reutiliza entre renders; se usa "spawn" porque el servidor de Streamlit es multihilo y
+hacer fork de un proceso con hilos puede dejar locks tomados en el hijo.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+_pools = {}
+_lock = threading.Lock()
+_background = None
+
+
+def default_workers() -> int:
+    """Número de procesos por defecto: FICHA_WORKERS o el número de CPUs."""
+    try:
+        return max(1, int(os.environ.get("FICHA_WORKERS", "")))
+    except ValueError:
+        return os.cpu_count() or 1
+
+
+def get_process_pool(workers: int) -> ProcessPoolExecutor:
+    """Regresa (creándolo la primera vez) el pool compartido con `workers` procesos."""
+    with _lock:
+        pool = _pools.get(workers)
+        # Un proceso que muere (p. ej. por memoria) deja el pool inservible: se reemplaza
+        if pool is None or getattr(pool, "_broken", False):
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _pools[workers] = pool
+        return pool
+
+
+def get_background_executor() -> ThreadPoolExecutor:
+    """Un hilo compartido para trabajo de fondo cuando no hay pool de procesos (1 CPU)."""
+    global _background
+    with _lock:
+        if _background is None:
+            _background = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ficha-bg")
+        return _background
+
+
+def shutdown_pools():
+    global _background
+    with _lock:
+        pools = list(_pools.values())
+        _pools.clear()
+        if _background is not None:
+            pools.append(_background)
+            _background = None
+    for pool in pools:
+        pool.shutdown(wait=True, cancel_futures=True)
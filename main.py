@@ -1,329 +1,329 @@
-import io
-from datetime import datetime, date
+import os
+import uuid
+from datetime import date
 
 import streamlit as st
 
-# PDF (ReportLab)
-from reportlab.lib.pagesizes import LETTER
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import inch
-from reportlab.lib.utils import simpleSplit, ImageReader
-
-# Merge PDFs
-from PyPDF2 import PdfMerger
-
-# Pillow (para imágenes)
-from PIL import Image
+from ficha.blobstore import get_blob_store
+from ficha.cache import page_cache
+from ficha.errors import AttachmentError
+from ficha.incremental import RenderMemo
+from ficha.jobs import CANCELLED, DONE, ProgressTrace, RenderJob
+from ficha.memory import MemoryProbe
+from ficha.metrics import NULL_TRACE, start_metrics_server
+from ficha.metrics import enabled as metrics_enabled
+from ficha.pages import parse_pages
+from ficha.prepare import FAILED, PENDING, Preconverter
+from ficha.profiling import RenderProfiler, input_tags
+from ficha.records import get_record_store
+from ficha.scheduler import SchedulerBusy, get_scheduler
+from ficha.service import RenderClient
+from ficha.validate import validate_attachment
+from ficha.warmup import warm_up
+from ficha.workers import default_workers
 
 
 # ----------------------------
-# Helpers PDF
+# UI Streamlit
 # ----------------------------
-def _draw_wrapped(c, text, x, y, max_width, font_name="Helvetica", font_size=10, leading=12):
-    c.setFont(font_name, font_size)
-    lines = simpleSplit(text or "", font_name, font_size, max_width)
-    for line in lines:
-        c.drawString(x, y, line)
-        y -= leading
-    return y
-
-
-def build_base_pdf(data: dict) -> bytes:
-    """Construye PDF base (ficha + listado de anexos) y regresa bytes."""
-    buffer = io.BytesIO()
-    c = canvas.Canvas(buffer, pagesize=LETTER)
-    width, height = LETTER
-
-    left = 0.75 * inch
-    right = 0.75 * inch
-    top = height - 0.75 * inch
-    bottom = 0.75 * inch
-    max_w = width - left - right
-    y = top
-
-    # Header
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(left, y, "Ficha rápida para personal de salud (Adulto mayor)")
-    y -= 18
-
-    c.setFont("Helvetica", 9)
-    gen_time = datetime.now().strftime("%Y-%m-%d %H:%M")
-    c.drawString(left, y, f"Generado: {gen_time}")
-    y -= 18
-
-    def section(title):
-        nonlocal y
-        y -= 6
-        c.setFont("Helvetica-Bold", 12)
-        c.setFillColorRGB(0, 0, 0)
-        c.drawString(left, y, title)
-        y -= 14
-        c.setLineWidth(0.7)
-        c.line(left, y, left + max_w, y)
-        y -= 12
-
-    def field(label, value, red=False):
-        nonlocal y
-        text = f"{label}: {value if value not in (None, '') else '—'}"
-        if red:
-            c.setFillColorRGB(1, 0, 0)
-        else:
-            c.setFillColorRGB(0, 0, 0)
-        y_new = _draw_wrapped(c, text, left, y, max_w, font_name="Helvetica", font_size=10)
-        y = y_new - 2
-        c.setFillColorRGB(0, 0, 0)  # reset
+st.set_page_config(page_title="Ficha médica (Adulto mayor)", layout="wide")
+st.title("🩺 Ficha médica rápida (Adulto mayor) → PDF")
+st.caption("Llena el formulario y descarga un PDF (incluye anexos al final).")
 
-    def ensure_space(min_space=120):
-        nonlocal y
-        if y < bottom + min_space:
-            c.showPage()
-            y = top
 
-    # 0) Registro
-    section("0) Registro de la información")
-    ensure_space()
-    for k in ["Fecha de elaboración", "Registró (nombre)"]:
-        field(k, data.get(k))
-
-    # 1) Identificación
-    ensure_space()
-    section("1) Identificación")
-    ensure_space()
-
-    # Datos generales
-    for k in ["Nombre completo", "Edad", "Sexo", "CURP", "Domicilio", "Teléfono del paciente"]:
-        field(k, data.get(k))
-
-    # Contacto de emergencia en ROJO
-    ensure_space()
-    c.setFont("Helvetica-Bold", 11)
-    c.setFillColorRGB(1, 0, 0)
-    c.drawString(left, y, "Contacto de emergencia")
-    c.setFillColorRGB(0, 0, 0)
-    y -= 14
-
-    for k in ["Contacto de emergencia", "Parentesco", "Teléfono de contacto"]:
-        field(k, data.get(k), red=True)
-
-    # Médico/Clínica habitual
-    ensure_space()
-    c.setFont("Helvetica-Bold", 11)
-    c.setFillColorRGB(0, 0, 0)
-    c.drawString(left, y, "Médico/Clínica habitual")
-    y -= 14
-
-    for k in ["Médico tratante", "Teléfono médico", "Clínica/Hospital habitual"]:
-        field(k, data.get(k))
-
-    # Obstétrico (solo si aplica)
-    if (data.get("Sexo") or "").lower().startswith("fem"):
-        ensure_space()
-        section("1B) Antecedentes gineco-obstétricos (si aplica)")
-        for k in [
-            "Embarazos (G)", "Partos (P)", "Cesáreas (C)", "Abortos (A)",
-            "Complicaciones en embarazos/partos", "Menopausia (edad aprox.)", "Cirugías ginecológicas relevantes"
-        ]:
-            field(k, data.get(k))
-
-    # 2) Datos básicos
-    ensure_space()
-    section("2) Datos básicos")
-    for k in ["Peso (kg)", "Estatura (m)", "Presión usual", "Diabetes", "Última glucosa conocida"]:
-        field(k, data.get(k))
-
-    # 4) Antecedentes
-    ensure_space()
-    section("4) Antecedentes médicos")
-    field("Enfermedades diagnosticadas", ", ".join(data.get("Enfermedades", [])) or "—")
-    field("Otros relevantes", data.get("Otros relevantes"))
-    field("Cirugías / hospitalizaciones importantes", data.get("Cirugías/hospitalizaciones"))
-
-    # 4B) Historial de infancia
-    ensure_space()
-    section("4B) Historial de infancia (clínicamente útil)")
-    field("Nacimiento (prematuro/complicaciones)", data.get("Infancia - nacimiento"))
-    field("Infecciones graves SNC (meningitis/encefalitis)", data.get("Infancia - SNC"))
-    field("Convulsiones febriles en infancia", data.get("Infancia - convulsiones febriles"))
-    field("Traumatismo craneal importante en infancia", data.get("Infancia - TCE"))
-    field("Enfermedades crónicas/congénitas desde infancia", data.get("Infancia - crónicas"))
-    field("Desarrollo/Aprendizaje (retrasos significativos)", data.get("Infancia - desarrollo"))
-    field("Otros antecedentes de infancia", data.get("Infancia - otros"))
-
-    # 5) Medicamentos
-    ensure_space()
-    section("5) Medicamentos actuales")
-    meds = data.get("Medicamentos", [])
-    if meds:
-        for i, m in enumerate(meds, start=1):
-            ensure_space(90)
-            field(
-                f"Medicamento {i}",
-                f"{m.get('nombre','—')} | {m.get('dosis','—')} | {m.get('frecuencia','—')} | {m.get('para_que','—')}"
-            )
-    else:
-        field("Medicamentos", "—")
-
-    field("Medicamentos de riesgo (marcados)", ", ".join(data.get("Riesgo meds", [])) or "—")
-    field("Última dosis conocida", data.get("Última dosis conocida"))
-
-    # 6) Alergias
-    ensure_space()
-    section("6) Alergias y reacciones")
-    for k in ["Alergia a medicamentos", "Cuáles y reacción", "Alergias alimentos/otras", "Alergia a yodo/contraste", "Látex"]:
-        field(k, data.get(k))
-
-    # 7) Hábitos
-    ensure_space()
-    section("7) Sustancias y hábitos")
-    for k in ["Tabaco", "Alcohol", "Otras sustancias", "Café/energizantes"]:
-        field(k, data.get(k))
-
-    # 8) Estado funcional basal
-    ensure_space()
-    section("8) Estado funcional y basal")
-    for k in ["Estado habitual previo", "Movilidad", "ABVD (baño/vestido/comer)", "Memoria/orientación habitual"]:
-        field(k, data.get(k))
-
-    # 8C) SARC-F
-    ensure_space()
-    section("8C) SARC-F (resumen)")
-    field("SARC-F total (0-10)", data.get("SARC-F total"))
-    field("Detalle SARC-F", data.get("SARC-F detalle"))
-
-    # 9) Síntomas neuro-cognitivos 15 días
-    ensure_space()
-    section("9) Últimos 15 días (neuro-cognitivo / equilibrio)")
-    field("Cambios en agudeza visual", data.get("15d - visión"))
-    field("Cefalea / dolor de cabeza", data.get("15d - cefalea"))
-    field("Migraña", data.get("15d - migraña"))
-    field("Mareo / vértigo", data.get("15d - mareo"))
-    field("Problemas de equilibrio", data.get("15d - equilibrio"))
-    field("Caídas en 15 días", data.get("15d - caídas"))
-    field("Desorientación/confusión", data.get("15d - confusión"))
-    field("Cambios de memoria/atención", data.get("15d - memoria"))
-    field("Debilidad/adormecimiento (focal)", data.get("15d - focalidad"))
-    field("Lenguaje/habla (dificultad)", data.get("15d - habla"))
-    field("Sueño (cambios marcados)", data.get("15d - sueño"))
-    field("Otros síntomas 15 días", data.get("15d - otros"))
-
-    # 10) Salud bucal / prótesis
-    ensure_space()
-    section("10) Salud bucal / prótesis dentales")
-    field("Uso de prótesis dental", data.get("Prótesis - uso"))
-    field("Tipo (parcial/total)", data.get("Prótesis - tipo"))
-    field("Ubicación (superior/inferior)", data.get("Prótesis - ubicación"))
-    field("Molestias/úlceras/ajuste", data.get("Prótesis - molestias"))
-    field("Dificultad para masticar/deglutir", data.get("Prótesis - masticación"))
-    field("Última valoración dental", data.get("Prótesis - última revisión"))
-
-    # 11) Urgencias
-    ensure_space()
-    section("11) Datos útiles en urgencias")
-    for k in [
-        "Caídas recientes", "Marcapasos/implantes", "Vacunas/infecciones recientes",
-        "Directiva anticipada", "Tipo de sangre", "Seguro/afiliación"
-    ]:
-        field(k, data.get(k))
-
-    # Anexos: listado
-    ensure_space()
-    section("Anexos (análisis previos) - listado")
-    anexos = data.get("Anexos", [])
-    if anexos:
-        for a in anexos:
-            ensure_space(70)
-            field("Archivo", a)
-    else:
-        field("Anexos", "—")
+@st.cache_resource
+def _metrics_server(port):
+    # Un solo servidor /metrics por proceso (no por sesión ni por rerun)
+    return start_metrics_server(port, host=os.environ.get("FICHA_METRICS_HOST", "127.0.0.1"))
+
 
-    c.showPage()
-    c.save()
-    buffer.seek(0)
-    return buffer.read()
+if os.environ.get("FICHA_METRICS_PORT"):
+    _metrics_server(int(os.environ["FICHA_METRICS_PORT"]))
 
+# Diagnóstico por etapa: FICHA_DIAGNOSTICS=1 o ?diag=1 en la URL
+diagnostics = os.environ.get("FICHA_DIAGNOSTICS") == "1" or st.query_params.get("diag") == "1"
+trace = NULL_TRACE
 
-def image_to_pdf_page(image_bytes: bytes, title: str) -> bytes:
-    """Convierte una imagen a un PDF (1 página) y regresa bytes."""
-    buf = io.BytesIO()
-    c = canvas.Canvas(buf, pagesize=LETTER)
-    width, height = LETTER
+if "meds" not in st.session_state:
+    st.session_state.meds = []
+
+# Optimización de tamaño del PDF final (sin pérdida); FICHA_OPTIMIZE=0 la desactiva
+optimize = os.environ.get("FICHA_OPTIMIZE", "1") != "0"
+# Límite para mandarlo por correo/mensajería: baja la calidad de las imágenes hasta que quepa
+SIZE_LIMITS = {"Sin límite": None, "25 MB (correo)": 25, "10 MB": 10, "5 MB": 5, "2 MB": 2}
 
-    left = 0.75 * inch
-    right = 0.75 * inch
-    top = height - 0.75 * inch
-    bottom = 0.75 * inch
+# Servicio de render externo: FICHA_RENDER_URL=http://host:puerto[,http://host:puerto...]
+render_url = os.environ.get("FICHA_RENDER_URL")
 
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(left, top, f"Anexo (Imagen): {title}")
-    y = top - 18
 
-    img = Image.open(io.BytesIO(image_bytes))
-    img_w, img_h = img.size
+@st.cache_resource
+def _render_client(urls):
+    # Un cliente por proceso: su pool de conexiones se comparte entre sesiones
+    return RenderClient(urls, timeout=float(os.environ.get("FICHA_RENDER_TIMEOUT", 120)),
+                        render_timeout=float(os.environ.get("FICHA_RENDER_WAIT_TIMEOUT", 900)))
 
-    box_w = width - left - right
-    box_h = (y - bottom)
 
-    scale = min(box_w / img_w, box_h / img_h)
-    draw_w = img_w * scale
-    draw_h = img_h * scale
+if "session_id" not in st.session_state:
+    # Identifica a la sesión ante el planificador de renders (equidad entre sesiones),
+    # también el del servicio de render
+    st.session_state.session_id = uuid.uuid4().hex
+
+if "render_memo" not in st.session_state:
+    # FICHA_DETERMINISTIC=1: "Generado:" = fecha de elaboración y PDF reproducible byte a byte
+    st.session_state.render_memo = RenderMemo(
+        deterministic=os.environ.get("FICHA_DETERMINISTIC") == "1",
+        remote=_render_client(render_url) if render_url else None,
+        session=st.session_state.session_id,
+    )
+
+# Almacén en disco por contenido (FICHA_BLOB_DIR): uploads y páginas convertidas sobreviven
+# entre sesiones y reinicios; sin él, caché de páginas en memoria
+blob_store = get_blob_store()
+pages_cache = blob_store or page_cache
 
-    x = left + (box_w - draw_w) / 2
-    y_img = bottom + (box_h - draw_h) / 2
+if "preconverter" not in st.session_state:
+    # Las imágenes se convierten en cuanto se suben, mientras se llena el formulario
+    st.session_state.preconverter = Preconverter(cache=pages_cache, workers=default_workers())
 
-    c.drawImage(ImageReader(img), x, y_img, width=draw_w, height=draw_h, preserveAspectRatio=True, mask="auto")
-    c.showPage()
-    c.save()
-    buf.seek(0)
-    return buf.read()
 
+def _check_upload(uf):
+    """Validación de un upload leyendo solo encabezados (una vez por archivo).
 
-def merge_pdfs(pdf_bytes_list: list[bytes]) -> bytes:
-    merger = PdfMerger()
-    streams = []
+    Regresa su `AttachmentInfo` (tipo real y páginas de un PDF) o el AttachmentError con
+    el motivo por el que se omitirá.
+    """
+    checks = st.session_state.setdefault("upload_checks", {})
+    if uf.file_id not in checks:
+        try:
+            with uf.getbuffer() as buf:
+                checks[uf.file_id] = validate_attachment(uf.name, buf)
+        except AttachmentError as e:
+            # Sin traceback: sus frames retendrían el buffer del upload en la sesión
+            checks[uf.file_id] = AttachmentError(e.name, e.reason)
+    return checks[uf.file_id]
+
+
+# ----------------------------
+# Paciente que regresa
+# ----------------------------
+# Fichas guardadas (FICHA_RECORDS_DB): se busca por CURP, teléfono o nombre y se recarga el
+# formulario. Solo los datos estables; registro, síntomas de 15 días, SARC-F y anexos son
+# de cada visita y se llenan de nuevo.
+PREFILL = {
+    "Nombre completo": "f_nombre", "Edad": "f_edad", "Sexo": "f_sexo", "CURP": "f_curp",
+    "Domicilio": "f_domicilio", "Teléfono del paciente": "f_tel_paciente",
+    "Contacto de emergencia": "f_contacto", "Parentesco": "f_parentesco", "Teléfono de contacto": "f_tel_contacto",
+    "Médico tratante": "f_medico", "Teléfono médico": "f_tel_medico", "Clínica/Hospital habitual": "f_clinica",
+    "Embarazos (G)": "f_emb_g", "Partos (P)": "f_part_p", "Cesáreas (C)": "f_ces_c", "Abortos (A)": "f_abo_a",
+    "Complicaciones en embarazos/partos": "f_comp_ob", "Menopausia (edad aprox.)": "f_meno_edad",
+    "Cirugías ginecológicas relevantes": "f_cir_gine",
+    "Peso (kg)": "f_peso", "Estatura (m)": "f_estatura", "Presión usual": "f_presion", "Diabetes": "f_diabetes",
+    "Última glucosa conocida": "f_glucosa",
+    "Enfermedades": "f_enfermedades", "Otros relevantes": "f_otros", "Cirugías/hospitalizaciones": "f_cirugias",
+    "Infancia - nacimiento": "f_inf_nac", "Infancia - SNC": "f_inf_snc", "Infancia - convulsiones febriles": "f_inf_febr",
+    "Infancia - TCE": "f_inf_tce", "Infancia - crónicas": "f_inf_cron", "Infancia - desarrollo": "f_inf_des",
+    "Infancia - otros": "f_inf_otros",
+    "Riesgo meds": "f_riesgo", "Última dosis conocida": "f_ultima_dosis",
+    "Alergia a medicamentos": "f_alergia_meds", "Cuáles y reacción": "f_cuales_reaccion",
+    "Alergias alimentos/otras": "f_alergias_otras", "Alergia a yodo/contraste": "f_yodo", "Látex": "f_latex",
+    "Tabaco": "f_tabaco", "Alcohol": "f_alcohol", "Otras sustancias": "f_otras_subs", "Café/energizantes": "f_cafe",
+    "Estado habitual previo": "f_estado_previo", "Movilidad": "f_movilidad",
+    "ABVD (baño/vestido/comer)": "f_abvd", "Memoria/orientación habitual": "f_memoria",
+    "Prótesis - uso": "f_pro_uso", "Prótesis - tipo": "f_pro_tipo", "Prótesis - ubicación": "f_pro_ubi",
+    "Prótesis - molestias": "f_pro_mol", "Prótesis - masticación": "f_pro_mast",
+    "Prótesis - última revisión": "f_pro_rev",
+    "Caídas recientes": "f_caidas", "Marcapasos/implantes": "f_implantes",
+    "Vacunas/infecciones recientes": "f_vacunas_inf", "Directiva anticipada": "f_directiva",
+    "Tipo de sangre": "f_sangre", "Seguro/afiliación": "f_seguro",
+}
+# En `data` todo es texto; los number_input necesitan su número
+PREFILL_NUMBERS = {"f_edad": int, "f_emb_g": int, "f_part_p": int, "f_ces_c": int, "f_abo_a": int,
+                   "f_peso": float, "f_estatura": float}
+PREFILL_LISTS = ("f_enfermedades", "f_riesgo")
+
+record_store = get_record_store()
+
+
+def _prefill_value(key, value):
+    if key in PREFILL_NUMBERS:
+        try:
+            return PREFILL_NUMBERS[key](float(value or 0))
+        except ValueError:
+            return PREFILL_NUMBERS[key](0)
+    if key in PREFILL_LISTS:
+        return list(value or [])
+    return value or ""
+
+
+def _load_record(record_id):
+    # Callback: corre antes del rerun, así los widgets del formulario ya salen con los valores
+    data = record_store.load(record_id)
+    if data is None:
+        return
+    for field, key in PREFILL.items():
+        st.session_state[key] = _prefill_value(key, data.get(field))
+    st.session_state.meds = [{"id": uuid.uuid4().hex, **{field: m.get(field, "") for field, _, _ in MED_FIELDS}}
+                             for m in data.get("Medicamentos") or []]
+    st.session_state.loaded_record = (
+        f"{data.get('Nombre completo') or 'paciente'} ({data.get('Fecha de elaboración') or 'sin fecha'})"
+    )
+
+
+@st.fragment
+def patient_lookup():
+    st.subheader("🔎 Paciente que regresa")
+    query = st.text_input("Buscar ficha guardada por CURP, teléfono o nombre", key="buscar_paciente",
+                          placeholder="p. ej. PEGJ450101HDFRRN09 · 55 1234 5678 · maria hernandez")
+    if "loaded_record" in st.session_state:
+        st.caption(f"Formulario cargado de la ficha de {st.session_state.loaded_record}.")
+    if not query.strip():
+        return
+    results = record_store.search(query, limit=10)
+    if not results:
+        st.caption("Sin fichas que coincidan.")
+    for r in results:
+        cols = st.columns([5, 1], vertical_alignment="center")
+        cols[0].write(f"**{r['nombre'] or 'Sin nombre'}** · CURP {r['curp'] or '—'} · "
+                      f"tel. {r['telefono'] or '—'} · ficha del {r['fecha'] or '—'}")
+        if cols[1].button("Cargar", key=f"cargar_{r['id']}", on_click=_load_record, args=(r["id"],)):
+            # Rerun completo: el formulario está fuera del fragmento
+            st.rerun()
+
+
+if record_store is not None:
+    patient_lookup()
+    st.divider()
+
+
+# Adjuntos (fuera del formulario: la selección de páginas se valida mientras se escribe)
+st.subheader("📎 Análisis previos (se anexan al MISMO PDF)")
+uploads = st.file_uploader(
+    "Sube análisis previos en PDF o imágenes (JPG/PNG).",
+    type=["pdf", "png", "jpg", "jpeg"],
+    accept_multiple_files=True
+)
+st.caption(
+    "Los PDFs se agregan al final (todas sus páginas o solo las que indiques). "
+    "Las imágenes se convierten a páginas y se anexan."
+)
+
+preconverter = st.session_state.preconverter
+# Con servicio de render las imágenes se convierten allá, no en el proceso de la UI
+image_keys = {} if render_url else {uf.name: key for uf in uploads or [] if (key := preconverter.submit(uf))}
+preconverter.retain(image_keys.values())
+
+
+def _conversion_status():
+    icons = {PENDING: "⏳", FAILED: "⚠️"}
+    for name, key in image_keys.items():
+        state, detail = preconverter.status(key)
+        st.caption(f"{icons.get(state, '✅')} {name}: {state} ({detail})")
+
+
+if image_keys:
+    # Se refresca solo mientras haya conversiones en curso
+    st.fragment(_conversion_status, run_every=1.0 if preconverter.pending() else None)()
+
+page_specs = []
+upload_checks = [_check_upload(uf) for uf in uploads or []]
+for uf, check in zip(uploads or [], upload_checks):
+    if isinstance(check, AttachmentError):
+        st.warning(f"{uf.name}: {check.reason}. No se anexará.")
+        page_specs.append(None)
+        continue
+    if check.kind != "pdf":
+        page_specs.append(None)
+        continue
+    n_pages = check.pages
+    spec = st.text_input(
+        f"Páginas de {uf.name} ({n_pages} en total)",
+        key=f"paginas_{uf.file_id}",
+        placeholder="todas · p. ej. 1-3,7 · última · 5-última",
+    )
     try:
-        for b in pdf_bytes_list:
-            s = io.BytesIO(b)
-            streams.append(s)
-            merger.append(s)
-        out = io.BytesIO()
-        merger.write(out)
-        merger.close()
-        out.seek(0)
-        return out.read()
-    finally:
-        for s in streams:
-            try:
-                s.close()
-            except Exception:
-                pass
-
-
-def build_pdf_with_attachments(data: dict, uploads) -> bytes:
-    """PDF final = ficha + anexos como páginas."""
-    base = build_base_pdf(data)
-    parts = [base]
-
-    if uploads:
-        for uf in uploads:
-            name = uf.name
-            b = uf.getvalue()
-            if name.lower().endswith(".pdf"):
-                parts.append(b)
-            elif name.lower().endswith((".png", ".jpg", ".jpeg")):
-                parts.append(image_to_pdf_page(b, name))
-
-    return merge_pdfs(parts)
+        parse_pages(spec, n_pages)
+    except ValueError as e:
+        # Se deja tal cual: al generar, el anexo falla con este mismo mensaje
+        st.error(f"{uf.name}: {e}")
+    page_specs.append((spec or "").strip() or None)
 
+st.divider()
 
 # ----------------------------
-# UI Streamlit
+# Fragmentos: medicamentos y SARC-F
 # ----------------------------
-st.set_page_config(page_title="Ficha médica (Adulto mayor)", layout="wide")
-st.title("🩺 Ficha médica rápida (Adulto mayor) → PDF")
-st.caption("Llena el formulario y descarga un PDF (incluye anexos al final).")
+# Fuera del formulario y como fragmentos: agregar, editar o quitar un medicamento y
+# cambiar una respuesta del SARC-F re-ejecutan solo su fragmento, no toda la página.
+MED_FIELDS = (("nombre", "Nombre del medicamento", 2), ("dosis", "Dosis", 1),
+              ("frecuencia", "Frecuencia", 1), ("para_que", "¿Para qué?", 2))
 
-if "meds" not in st.session_state:
-    st.session_state.meds = []
+
+def _remove_med(med_id):
+    # Callback: corre antes del rerun del fragmento, que ya se pinta sin el medicamento
+    st.session_state.meds = [m for m in st.session_state.meds if m["id"] != med_id]
+
+
+@st.fragment
+def medication_editor():
+    st.subheader("5) Medicamentos actuales")
+    with st.form("form_med", clear_on_submit=True, border=False):
+        cols = st.columns([w for _, _, w in MED_FIELDS] + [1], vertical_alignment="bottom")
+        new = {field: col.text_input(label) for (field, label, _), col in zip(MED_FIELDS, cols)}
+        add = cols[-1].form_submit_button("➕ Agregar")
+    if add:
+        if new["nombre"].strip():
+            st.session_state.meds.append({"id": uuid.uuid4().hex, **{k: v.strip() for k, v in new.items()}})
+        else:
+            st.warning("Escribe al menos el nombre del medicamento antes de agregar.")
+
+    if st.session_state.meds:
+        st.write("**Medicamentos agregados:**")
+    for m in list(st.session_state.meds):
+        cols = st.columns([w for _, _, w in MED_FIELDS] + [1], vertical_alignment="bottom")
+        for (field, label, _), col in zip(MED_FIELDS, cols):
+            # Editar en su lugar: la llave del widget sigue al medicamento, no a su posición
+            m[field] = col.text_input(label, value=m[field], key=f"med_{m['id']}_{field}",
+                                      label_visibility="collapsed").strip()
+        cols[-1].button("🗑️", key=f"med_{m['id']}_quitar", help="Quitar", on_click=_remove_med, args=(m["id"],))
+
+
+SARC_OPTS = ["", "0 - Sin dificultad", "1 - Algo de dificultad", "2 - Mucha dificultad / no puede"]
+SARC_FALLS = ["", "0 - 0 caídas", "1 - 1 a 3 caídas", "2 - 4 o más caídas"]
+SARC_ITEMS = (("Fuerza", "sarc_fuerza", "Fuerza (levantar/cargar 4.5 kg)", SARC_OPTS),
+              ("Caminar", "sarc_caminar", "Caminar (asistencia)", SARC_OPTS),
+              ("Silla", "sarc_silla", "Levantarse de silla", SARC_OPTS),
+              ("Escaleras", "sarc_escal", "Subir escaleras", SARC_OPTS),
+              ("Caídas", "sarc_caidas", "Caídas (último año)", SARC_FALLS))
+
+
+def sarc_pts(sel):
+    if not sel:
+        return 0
+    try:
+        return int(sel.split("-")[0].strip())
+    except Exception:
+        return 0
+
+
+def sarc_scores() -> dict:
+    """Puntos de cada reactivo del SARC-F según lo que hay en la sesión."""
+    return {name: sarc_pts(st.session_state.get(key, "")) for name, key, _, _ in SARC_ITEMS}
+
+
+@st.fragment
+def sarc_f_calculator():
+    st.subheader("8C) SARC-F (0-10)")
+    s_cols = st.columns(2)
+    for i, (_, key, label, opts) in enumerate(SARC_ITEMS):
+        with s_cols[0 if i < 3 else 1]:
+            st.selectbox(label, opts, key=key)
+    st.write(f"**SARC-F total:** {sum(sarc_scores().values())} / 10")
+
+
+medication_editor()
+sarc_f_calculator()
+
+st.divider()
 
 with st.form("form_ficha", clear_on_submit=False):
 
@@ -331,20 +331,9 @@ with st.form("form_ficha", clear_on_submit=False):
     st.subheader("0) Registro de la información")
     reg_col1, reg_col2 = st.columns(2)
     with reg_col1:
-        fecha_elab = st.date_input("Fecha de elaboración", value=date.today())
+        fecha_elab = st.date_input("Fecha de elaboración", value=date.today(), key="f_fecha_elab")
     with reg_col2:
-        registro_por = st.text_input("¿Quién realizó el registro? (nombre)")
-
-    st.divider()
-
-    # Adjuntos
-    st.subheader("📎 Análisis previos (se anexan al MISMO PDF)")
-    uploads = st.file_uploader(
-        "Sube análisis previos en PDF o imágenes (JPG/PNG).",
-        type=["pdf", "png", "jpg", "jpeg"],
-        accept_multiple_files=True
-    )
-    st.caption("Los PDFs se agregan al final tal cual. Las imágenes se convierten a páginas y se anexan.")
+        registro_por = st.text_input("¿Quién realizó el registro? (nombre)", key="f_registro_por")
 
     st.divider()
 
@@ -352,31 +341,31 @@ with st.form("form_ficha", clear_on_submit=False):
 
     with col1:
         st.subheader("1) Identificación")
-        nombre = st.text_input("Nombre completo")
-        edad = st.number_input("Edad", min_value=0, max_value=120, step=1)
-        sexo = st.selectbox("Sexo", ["", "Masculino", "Femenino", "Otro/Prefiero no decir"])
-        curp = st.text_input("CURP (opcional)")
-        domicilio = st.text_area("Domicilio (opcional)", height=68)
-        tel_paciente = st.text_input("Teléfono del paciente (opcional)")
+        nombre = st.text_input("Nombre completo", key="f_nombre")
+        edad = st.number_input("Edad", min_value=0, max_value=120, step=1, key="f_edad")
+        sexo = st.selectbox("Sexo", ["", "Masculino", "Femenino", "Otro/Prefiero no decir"], key="f_sexo")
+        curp = st.text_input("CURP (opcional)", key="f_curp")
+        domicilio = st.text_area("Domicilio (opcional)", height=68, key="f_domicilio")
+        tel_paciente = st.text_input("Teléfono del paciente (opcional)", key="f_tel_paciente")
 
         # Contacto (título en rojo en UI)
         st.markdown("<h4 style='color:#d00000;margin:0'>Contacto de emergencia</h4>", unsafe_allow_html=True)
-        contacto = st.text_input("Nombre contacto de emergencia")
-        parentesco = st.text_input("Parentesco (hijo/a, esposa, etc.)")
-        tel_contacto = st.text_input("Teléfono de contacto")
+        contacto = st.text_input("Nombre contacto de emergencia", key="f_contacto")
+        parentesco = st.text_input("Parentesco (hijo/a, esposa, etc.)", key="f_parentesco")
+        tel_contacto = st.text_input("Teléfono de contacto", key="f_tel_contacto")
 
         st.subheader("Médico/Clínica habitual")
-        medico = st.text_input("Médico tratante (opcional)")
-        tel_medico = st.text_input("Teléfono médico (opcional)")
-        clinica = st.text_input("Clínica/Hospital habitual (opcional)")
+        medico = st.text_input("Médico tratante (opcional)", key="f_medico")
+        tel_medico = st.text_input("Teléfono médico (opcional)", key="f_tel_medico")
+        clinica = st.text_input("Clínica/Hospital habitual (opcional)", key="f_clinica")
 
     with col2:
         st.subheader("2) Datos básicos")
-        peso = st.number_input("Peso (kg)", min_value=0.0, max_value=300.0, step=0.5)
-        estatura = st.number_input("Estatura (m)", min_value=0.0, max_value=2.50, step=0.01)
-        presion = st.text_input("Presión arterial usual (si se sabe)")
-        diabetes = st.selectbox("¿Diabetes?", ["", "No", "Sí", "No sabe"])
-        glucosa = st.text_input("Última glucosa conocida (si se sabe)")
+        peso = st.number_input("Peso (kg)", min_value=0.0, max_value=300.0, step=0.5, key="f_peso")
+        estatura = st.number_input("Estatura (m)", min_value=0.0, max_value=2.50, step=0.01, key="f_estatura")
+        presion = st.text_input("Presión arterial usual (si se sabe)", key="f_presion")
+        diabetes = st.selectbox("¿Diabetes?", ["", "No", "Sí", "No sabe"], key="f_diabetes")
+        glucosa = st.text_input("Última glucosa conocida (si se sabe)", key="f_glucosa")
 
     # Gineco-obstétrico si Femenino
     if sexo == "Femenino":
@@ -384,17 +373,17 @@ with st.form("form_ficha", clear_on_submit=False):
         st.subheader("1B) Antecedentes gineco-obstétricos (si aplica)")
         g1, g2, g3, g4 = st.columns(4)
         with g1:
-            emb_g = st.number_input("Embarazos (G)", min_value=0, max_value=30, step=1)
+            emb_g = st.number_input("Embarazos (G)", min_value=0, max_value=30, step=1, key="f_emb_g")
         with g2:
-            part_p = st.number_input("Partos (P)", min_value=0, max_value=30, step=1)
+            part_p = st.number_input("Partos (P)", min_value=0, max_value=30, step=1, key="f_part_p")
         with g3:
-            ces_c = st.number_input("Cesáreas (C)", min_value=0, max_value=30, step=1)
+            ces_c = st.number_input("Cesáreas (C)", min_value=0, max_value=30, step=1, key="f_ces_c")
         with g4:
-            abo_a = st.number_input("Abortos (A)", min_value=0, max_value=30, step=1)
+            abo_a = st.number_input("Abortos (A)", min_value=0, max_value=30, step=1, key="f_abo_a")
 
-        comp_ob = st.text_area("Complicaciones (preeclampsia, hemorragia, parto prolongado, etc.)", height=60)
-        meno_edad = st.text_input("Menopausia (edad aprox., si aplica)")
-        cir_gine = st.text_input("Cirugías ginecológicas relevantes (si aplica)")
+        comp_ob = st.text_area("Complicaciones (preeclampsia, hemorragia, parto prolongado, etc.)", height=60, key="f_comp_ob")
+        meno_edad = st.text_input("Menopausia (edad aprox., si aplica)", key="f_meno_edad")
+        cir_gine = st.text_input("Cirugías ginecológicas relevantes (si aplica)", key="f_cir_gine")
     else:
         emb_g = part_p = ces_c = abo_a = 0
         comp_ob = meno_edad = cir_gine = ""
@@ -413,163 +402,117 @@ with st.form("form_ficha", clear_on_submit=False):
             "EPOC/asma", "Apnea del sueño",
             "Demencia/deterioro cognitivo", "Depresión/ansiedad",
             "Tiroides", "Cáncer", "Otra"
-        ]
+        ],
+        key="f_enfermedades",
     )
-    otros = st.text_input("Otros relevantes (si marcaste 'Otra' o para ampliar)")
-    cirugias = st.text_area("Cirugías / hospitalizaciones importantes (año y motivo)", height=70)
+    otros = st.text_input("Otros relevantes (si marcaste 'Otra' o para ampliar)", key="f_otros")
+    cirugias = st.text_area("Cirugías / hospitalizaciones importantes (año y motivo)", height=70, key="f_cirugias")
 
     st.divider()
 
     st.subheader("4B) Historial de infancia (clínicamente útil)")
     inf_col1, inf_col2 = st.columns(2)
     with inf_col1:
-        inf_nac = st.selectbox("Nacimiento", ["", "A término sin complicaciones", "Prematuro", "Complicaciones al nacer", "No sabe"])
-        inf_snc = st.selectbox("Infecciones graves SNC (meningitis/encefalitis)", ["", "No", "Sí", "No sabe"])
-        inf_febr = st.selectbox("Convulsiones febriles en infancia", ["", "No", "Sí", "No sabe"])
+        inf_nac = st.selectbox("Nacimiento", ["", "A término sin complicaciones", "Prematuro", "Complicaciones al nacer", "No sabe"], key="f_inf_nac")
+        inf_snc = st.selectbox("Infecciones graves SNC (meningitis/encefalitis)", ["", "No", "Sí", "No sabe"], key="f_inf_snc")
+        inf_febr = st.selectbox("Convulsiones febriles en infancia", ["", "No", "Sí", "No sabe"], key="f_inf_febr")
     with inf_col2:
-        inf_tce = st.selectbox("Traumatismo craneal importante en infancia", ["", "No", "Sí", "No sabe"])
-        inf_cron = st.text_input("Enfermedades crónicas/congénitas desde infancia (si aplica)")
-        inf_des = st.selectbox("Desarrollo/Aprendizaje (retrasos importantes)", ["", "No", "Sí", "No sabe"])
-    inf_otros = st.text_area("Otros antecedentes de infancia relevantes", height=60)
+        inf_tce = st.selectbox("Traumatismo craneal importante en infancia", ["", "No", "Sí", "No sabe"], key="f_inf_tce")
+        inf_cron = st.text_input("Enfermedades crónicas/congénitas desde infancia (si aplica)", key="f_inf_cron")
+        inf_des = st.selectbox("Desarrollo/Aprendizaje (retrasos importantes)", ["", "No", "Sí", "No sabe"], key="f_inf_des")
+    inf_otros = st.text_area("Otros antecedentes de infancia relevantes", height=60, key="f_inf_otros")
 
     st.divider()
 
-    st.subheader("5) Medicamentos actuales")
-    med_col1, med_col2, med_col3, med_col4, med_col5 = st.columns([2, 1, 1, 2, 1])
-
-    with med_col1:
-        m_nombre = st.text_input("Nombre del medicamento", key="m_nombre")
-    with med_col2:
-        m_dosis = st.text_input("Dosis", key="m_dosis")
-    with med_col3:
-        m_frec = st.text_input("Frecuencia", key="m_frec")
-    with med_col4:
-        m_para = st.text_input("¿Para qué?", key="m_para")
-    with med_col5:
-        add = st.form_submit_button("➕ Agregar")
-
-    if add:
-        if m_nombre.strip():
-            st.session_state.meds.append(
-                {"nombre": m_nombre.strip(), "dosis": m_dosis.strip(), "frecuencia": m_frec.strip(), "para_que": m_para.strip()}
-            )
-        else:
-            st.warning("Escribe al menos el nombre del medicamento antes de agregar.")
-
-    if st.session_state.meds:
-        st.write("**Medicamentos agregados:**")
-        for idx, m in enumerate(st.session_state.meds, start=1):
-            st.write(f"{idx}. {m['nombre']} | {m['dosis']} | {m['frecuencia']} | {m['para_que']}")
-
+    st.subheader("5B) Medicamentos de riesgo")
+    st.caption("La lista de medicamentos actuales se edita arriba, fuera del formulario.")
     riesgo = st.multiselect(
         "Medicamentos de riesgo (marca si aplica)",
         ["Anticoagulantes", "Antiagregantes (aspirina/clopidogrel)", "Insulina/hipoglucemiantes",
-         "Benzodiacepinas/sedantes", "Antidepresivos/antipsicóticos", "Anticonvulsivos"]
+         "Benzodiacepinas/sedantes", "Antidepresivos/antipsicóticos", "Anticonvulsivos"],
+        key="f_riesgo",
     )
-    ultima_dosis = st.text_input("Última dosis conocida (si se sabe)")
+    ultima_dosis = st.text_input("Última dosis conocida (si se sabe)", key="f_ultima_dosis")
 
     st.divider()
 
     st.subheader("6) Alergias")
-    alergia_meds = st.selectbox("¿Alergia a medicamentos?", ["", "No", "Sí", "No sabe"])
-    cuales_reaccion = st.text_area("¿Cuáles y qué reacción?", height=60)
-    alergias_otras = st.text_input("Alergias a alimentos/otras (si aplica)")
-    yodo = st.selectbox("Alergia a yodo/contraste", ["", "No", "Sí", "No sabe"])
-    latex = st.selectbox("Látex", ["", "No", "Sí", "No sabe"])
+    alergia_meds = st.selectbox("¿Alergia a medicamentos?", ["", "No", "Sí", "No sabe"], key="f_alergia_meds")
+    cuales_reaccion = st.text_area("¿Cuáles y qué reacción?", height=60, key="f_cuales_reaccion")
+    alergias_otras = st.text_input("Alergias a alimentos/otras (si aplica)", key="f_alergias_otras")
+    yodo = st.selectbox("Alergia a yodo/contraste", ["", "No", "Sí", "No sabe"], key="f_yodo")
+    latex = st.selectbox("Látex", ["", "No", "Sí", "No sabe"], key="f_latex")
 
     st.divider()
 
     st.subheader("7) Sustancias y hábitos")
-    tabaco = st.text_input("Tabaco")
-    alcohol = st.text_input("Alcohol")
-    otras_subs = st.text_input("Otras sustancias (si aplica)")
-    cafe = st.text_input("Café/energizantes (si aplica)")
+    tabaco = st.text_input("Tabaco", key="f_tabaco")
+    alcohol = st.text_input("Alcohol", key="f_alcohol")
+    otras_subs = st.text_input("Otras sustancias (si aplica)", key="f_otras_subs")
+    cafe = st.text_input("Café/energizantes (si aplica)", key="f_cafe")
 
     st.divider()
 
     st.subheader("8) Estado funcional (basal)")
-    estado_previo = st.selectbox("Antes del evento, su estado era", ["", "Normal", "Algo limitado", "Muy limitado"])
-    movilidad = st.selectbox("Movilidad", ["", "Camina solo", "Con bastón", "Con andadera", "Silla de ruedas", "No deambula"])
-    abvd = st.selectbox("Actividades básicas (baño/vestido/comer)", ["", "Independiente", "Requiere ayuda", "No sabe"])
-    memoria = st.selectbox("Memoria/orientación habitual", ["", "Conservada", "Olvidos leves", "Deterioro importante", "No sabe"])
+    estado_previo = st.selectbox("Antes del evento, su estado era", ["", "Normal", "Algo limitado", "Muy limitado"], key="f_estado_previo")
+    movilidad = st.selectbox("Movilidad", ["", "Camina solo", "Con bastón", "Con andadera", "Silla de ruedas", "No deambula"], key="f_movilidad")
+    abvd = st.selectbox("Actividades básicas (baño/vestido/comer)", ["", "Independiente", "Requiere ayuda", "No sabe"], key="f_abvd")
+    memoria = st.selectbox("Memoria/orientación habitual", ["", "Conservada", "Olvidos leves", "Deterioro importante", "No sabe"], key="f_memoria")
 
-    # SARC-F
-    st.subheader("8C) SARC-F (0-10)")
-    sarc_opts = ["", "0 - Sin dificultad", "1 - Algo de dificultad", "2 - Mucha dificultad / no puede"]
-    sarc_falls = ["", "0 - 0 caídas", "1 - 1 a 3 caídas", "2 - 4 o más caídas"]
-
-    s_cols = st.columns(2)
-    with s_cols[0]:
-        sarc_fuerza = st.selectbox("Fuerza (levantar/cargar 4.5 kg)", sarc_opts)
-        sarc_caminar = st.selectbox("Caminar (asistencia)", sarc_opts)
-        sarc_silla = st.selectbox("Levantarse de silla", sarc_opts)
-    with s_cols[1]:
-        sarc_escal = st.selectbox("Subir escaleras", sarc_opts)
-        sarc_caidas = st.selectbox("Caídas (último año)", sarc_falls)
-
-    def sarc_pts(sel):
-        if not sel:
-            return 0
-        try:
-            return int(sel.split("-")[0].strip())
-        except Exception:
-            return 0
-
-    sarc_items = {
-        "Fuerza": sarc_pts(sarc_fuerza),
-        "Caminar": sarc_pts(sarc_caminar),
-        "Silla": sarc_pts(sarc_silla),
-        "Escaleras": sarc_pts(sarc_escal),
-        "Caídas": sarc_pts(sarc_caidas),
-    }
-    sarc_total = sum(sarc_items.values())
-    sarc_detalle = ", ".join([f"{k}={v}" for k, v in sarc_items.items()])
-    st.write(f"**SARC-F total:** {sarc_total} / 10")
+    st.caption("El SARC-F (8C) se llena arriba, fuera del formulario.")
 
     st.divider()
 
     st.subheader("9) Últimos 15 días (neuro-cognitivo / equilibrio)")
     n1, n2 = st.columns(2)
     with n1:
-        d_vision = st.selectbox("Cambios en agudeza visual", ["", "No", "Sí", "No sabe"])
-        d_cef = st.selectbox("Dolor de cabeza (cefalea)", ["", "No", "Sí", "No sabe"])
-        d_mig = st.selectbox("Migraña", ["", "No", "Sí", "No sabe"])
-        d_mareo = st.selectbox("Mareo / vértigo", ["", "No", "Sí", "No sabe"])
-        d_equ = st.selectbox("Problemas de equilibrio", ["", "No", "Sí", "No sabe"])
+        d_vision = st.selectbox("Cambios en agudeza visual", ["", "No", "Sí", "No sabe"], key="f_d_vision")
+        d_cef = st.selectbox("Dolor de cabeza (cefalea)", ["", "No", "Sí", "No sabe"], key="f_d_cef")
+        d_mig = st.selectbox("Migraña", ["", "No", "Sí", "No sabe"], key="f_d_mig")
+        d_mareo = st.selectbox("Mareo / vértigo", ["", "No", "Sí", "No sabe"], key="f_d_mareo")
+        d_equ = st.selectbox("Problemas de equilibrio", ["", "No", "Sí", "No sabe"], key="f_d_equ")
     with n2:
-        d_caidas = st.selectbox("Caídas en los últimos 15 días", ["", "No", "Sí", "No sabe"])
-        d_conf = st.selectbox("Confusión / desorientación", ["", "No", "Sí", "No sabe"])
-        d_mem = st.selectbox("Cambios en memoria/atención", ["", "No", "Sí", "No sabe"])
-        d_foc = st.selectbox("Debilidad/adormecimiento focal (cara/brazo/pierna)", ["", "No", "Sí", "No sabe"])
-        d_hab = st.selectbox("Dificultad para hablar/entender", ["", "No", "Sí", "No sabe"])
-    d_sueno = st.selectbox("Cambios marcados en sueño", ["", "No", "Sí", "No sabe"])
-    d_otros = st.text_area("Otros síntomas relevantes (últimos 15 días)", height=60)
+        d_caidas = st.selectbox("Caídas en los últimos 15 días", ["", "No", "Sí", "No sabe"], key="f_d_caidas")
+        d_conf = st.selectbox("Confusión / desorientación", ["", "No", "Sí", "No sabe"], key="f_d_conf")
+        d_mem = st.selectbox("Cambios en memoria/atención", ["", "No", "Sí", "No sabe"], key="f_d_mem")
+        d_foc = st.selectbox("Debilidad/adormecimiento focal (cara/brazo/pierna)", ["", "No", "Sí", "No sabe"], key="f_d_foc")
+        d_hab = st.selectbox("Dificultad para hablar/entender", ["", "No", "Sí", "No sabe"], key="f_d_hab")
+    d_sueno = st.selectbox("Cambios marcados en sueño", ["", "No", "Sí", "No sabe"], key="f_d_sueno")
+    d_otros = st.text_area("Otros síntomas relevantes (últimos 15 días)", height=60, key="f_d_otros")
 
     st.divider()
 
     st.subheader("10) Salud bucal / prótesis dentales")
-    pro_uso = st.selectbox("¿Usa prótesis dental?", ["", "No", "Sí", "No sabe"])
-    pro_tipo = st.selectbox("Tipo", ["", "Parcial", "Total", "Mixta (parcial y total)", "No aplica"])
-    pro_ubi = st.selectbox("Ubicación", ["", "Superior", "Inferior", "Ambas", "No aplica"])
-    pro_mol = st.selectbox("Molestias/úlceras/ajuste inadecuado", ["", "No", "Sí", "No sabe"])
-    pro_mast = st.selectbox("Dificultad para masticar/deglutir", ["", "No", "Sí", "No sabe"])
-    pro_rev = st.text_input("Última valoración dental (aprox.)")
+    pro_uso = st.selectbox("¿Usa prótesis dental?", ["", "No", "Sí", "No sabe"], key="f_pro_uso")
+    pro_tipo = st.selectbox("Tipo", ["", "Parcial", "Total", "Mixta (parcial y total)", "No aplica"], key="f_pro_tipo")
+    pro_ubi = st.selectbox("Ubicación", ["", "Superior", "Inferior", "Ambas", "No aplica"], key="f_pro_ubi")
+    pro_mol = st.selectbox("Molestias/úlceras/ajuste inadecuado", ["", "No", "Sí", "No sabe"], key="f_pro_mol")
+    pro_mast = st.selectbox("Dificultad para masticar/deglutir", ["", "No", "Sí", "No sabe"], key="f_pro_mast")
+    pro_rev = st.text_input("Última valoración dental (aprox.)", key="f_pro_rev")
 
     st.divider()
 
     st.subheader("11) Datos útiles en urgencias")
-    caidas = st.selectbox("Caídas recientes (últimos 30 días)", ["", "No", "Sí", "No sabe"])
-    implantes = st.text_input("Marcapasos/implantes/metal (si aplica)")
-    vacunas_inf = st.text_input("Vacunas/infecciones recientes (si aplica)")
-    directiva = st.text_input("Directiva anticipada / voluntad (si existe)")
-    sangre = st.text_input("Tipo de sangre (si se sabe)")
-    seguro = st.text_input("Seguro/afiliación (IMSS/ISSSTE/privado/etc.)")
+    caidas = st.selectbox("Caídas recientes (últimos 30 días)", ["", "No", "Sí", "No sabe"], key="f_caidas")
+    implantes = st.text_input("Marcapasos/implantes/metal (si aplica)", key="f_implantes")
+    vacunas_inf = st.text_input("Vacunas/infecciones recientes (si aplica)", key="f_vacunas_inf")
+    directiva = st.text_input("Directiva anticipada / voluntad (si existe)", key="f_directiva")
+    sangre = st.text_input("Tipo de sangre (si se sabe)", key="f_sangre")
+    seguro = st.text_input("Seguro/afiliación (IMSS/ISSSTE/privado/etc.)", key="f_seguro")
+
+    size_limit = st.selectbox("Tamaño máximo del PDF (para enviarlo por correo o mensajería)", list(SIZE_LIMITS),
+                              key="f_size_limit")
 
     submitted = st.form_submit_button("📄 Generar PDF (con anexos)")
 
 
 if submitted:
-    anexos_listado = [uf.name for uf in uploads] if uploads else []
+    sarc_items = sarc_scores()
+    anexos_listado = [
+        f"{uf.name} (omitido: {check.reason})" if isinstance(check, AttachmentError)
+        else f"{uf.name} (páginas {spec})" if spec else uf.name
+        for uf, spec, check in zip(uploads or [], page_specs, upload_checks)
+    ]
 
     data = {
         # Registro
@@ -625,7 +568,8 @@ if submitted:
         "Infancia - otros": inf_otros,
 
         # Medicamentos
-        "Medicamentos": st.session_state.meds,
+        # Copia sin el id interno: el fragmento puede editar la lista mientras se genera el PDF
+        "Medicamentos": [{field: m[field] for field, _, _ in MED_FIELDS} for m in st.session_state.meds],
         "Riesgo meds": riesgo,
         "Última dosis conocida": ultima_dosis,
 
@@ -649,8 +593,8 @@ if submitted:
         "Memoria/orientación habitual": memoria,
 
         # SARC-F
-        "SARC-F total": str(sarc_total),
-        "SARC-F detalle": sarc_detalle,
+        "SARC-F total": str(sum(sarc_items.values())),
+        "SARC-F detalle": ", ".join([f"{k}={v}" for k, v in sarc_items.items()]),
 
         # 15 días
         "15d - visión": d_vision,
@@ -686,13 +630,129 @@ if submitted:
         "Anexos": anexos_listado,
     }
 
-    final_pdf_bytes = build_pdf_with_attachments(data, uploads)
     filename = f"Ficha_medica_{(nombre or 'paciente').replace(' ', '_')}_con_anexos.pdf"
 
-    st.success("PDF generado (incluye anexos al final).")
-    st.download_button(
-        label="⬇️ Descargar PDF",
-        data=final_pdf_bytes,
-        file_name=filename,
-        mime="application/pdf",
+    # Si los datos y anexos no cambiaron desde la última vez se reutiliza el PDF ya generado
+    memo = st.session_state.render_memo
+    target_bytes = SIZE_LIMITS[size_limit] * 1024 * 1024 if SIZE_LIMITS[size_limit] else None
+    key = memo.key_for(data, uploads, pages=page_specs, optimize=optimize, target_bytes=target_bytes)
+    job = st.session_state.get("render_job")
+    ticket = None
+    if job is not None and job.running and job.key == key:
+        # Doble clic o reenvío sin cambios: se sigue esperando el mismo trabajo
+        st.info("Ese PDF ya se está generando.")
+    else:
+        try:
+            # Turno en el planificador del servidor (compartido por todas las sesiones)
+            ticket = get_scheduler().submit(st.session_state.session_id, sum(uf.size for uf in uploads or []))
+        except SchedulerBusy as e:
+            st.warning(f"El servidor está ocupado ({e.reason}). Intenta de nuevo en unos segundos.")
+    if ticket is not None:
+        if job is not None and job.running:
+            job.cancel()
+        trace = ProgressTrace(len(uploads or []), names=[uf.name for uf in uploads or []], memory=diagnostics)
+        # Perfilado: FICHA_PROFILE=1 (una muestra; se guarda si pasa el umbral) o ?profile=1
+        # (se guarda siempre y convierte en serie para que la conversión salga en el perfil)
+        profiler = RenderProfiler(tags=input_tags(data, uploads), force=st.query_params.get("profile") == "1")
+        workers = None if profiler.force else default_workers()
+
+        # Corre en otro hilo: nada de st.* aquí dentro
+        def _render(uploads=list(uploads or []), pages=page_specs, trace=trace, profiler=profiler):
+            with MemoryProbe() as mem, profiler:
+                _, reused = memo.render(
+                    data, uploads, pages=pages, workers=workers, cache=preconverter, store=blob_store, trace=trace,
+                    optimize=optimize, target_bytes=target_bytes, skip_invalid=True,
+                )
+            if record_store is not None and not reused:
+                # Se guarda la ficha para recargarla la próxima visita (no cada reutilización)
+                record_store.save(data)
+            return {"filename": filename, "peak_rss": mem.peak_rss, "reused": reused, "profile": profiler.saved,
+                    "target_bytes": target_bytes, "skipped": [(e.name, e.reason) for e in memo.skipped]}
+
+        st.session_state.pop("pdf_info", None)
+        st.session_state.render_job = RenderJob(key, _render, trace, after=job, ticket=ticket)
+
+
+def _job_progress():
+    job = st.session_state.render_job
+    if not job.running:
+        # Terminó: un rerun completo muestra el resultado y el botón de descarga
+        st.rerun()
+    st.progress(job.trace.progress, text=job.trace.stage)
+    for name, status in list(job.trace.items.items()):
+        st.caption(f"{'⚠️' if status.startswith('omitido') else '✅'} {name}: {status}")
+    if job.trace.cancelled:
+        st.caption("Cancelando…")
+    elif st.button("✖️ Cancelar"):
+        job.cancel()
+
+
+# El PDF final queda en la sesión: sobrevive al rerun que dispara el botón de descarga
+memo = st.session_state.render_memo
+job = st.session_state.get("render_job")
+if job is not None and job.running:
+    st.fragment(_job_progress, run_every=0.5)()
+elif job is not None:
+    # Terminó: se reporta una sola vez y se suelta el trabajo
+    del st.session_state.render_job
+    if job.state == DONE:
+        st.session_state.pdf_info = job.result
+        trace = job.trace
+    elif job.state == CANCELLED:
+        st.warning("Generación cancelada.")
+    elif isinstance(job.error, SchedulerBusy):
+        st.warning(f"El servicio de render está ocupado ({job.error.reason}). Intenta de nuevo en unos segundos.")
+    elif isinstance(job.error, AttachmentError):
+        st.error(f"No se pudo anexar {job.error.name}: {job.error.reason}")
+    else:
+        st.error(f"No se pudo generar el PDF: {job.error}")
+
+if memo.final_path and "pdf_info" in st.session_state:
+    info = st.session_state.pdf_info
+    if info["reused"]:
+        st.success("PDF sin cambios desde la última generación (se reutilizó).")
+    else:
+        st.success("PDF generado (incluye anexos al final).")
+    st.caption(
+        f"Tamaño: {os.path.getsize(memo.final_path) / 1024 / 1024:.1f} MB · "
+        f"memoria pico del render: {info['peak_rss'] / 1024 / 1024:.1f} MB · "
+        f"caché de anexos: {pages_cache.hits} aciertos / {pages_cache.misses} fallos"
     )
+    if info.get("skipped"):
+        st.warning("Anexos omitidos del PDF:\n" + "\n".join(f"- {name}: {reason}" for name, reason in info["skipped"]))
+    if info.get("target_bytes") and os.path.getsize(memo.final_path) > info["target_bytes"]:
+        st.warning(
+            f"Ni con la calidad de imagen más baja el PDF bajó de {info['target_bytes'] / 1024 / 1024:.0f} MB; "
+            "quita anexos o elige solo algunas páginas de los PDFs."
+        )
+    with trace.span("transfer") as sp, open(memo.final_path, "rb") as f:
+        sp.bytes_out = os.path.getsize(memo.final_path)
+        st.download_button(
+            label="⬇️ Descargar PDF",
+            data=f,
+            file_name=info["filename"],
+            mime="application/pdf",
+        )
+    if trace and (diagnostics or metrics_enabled()):
+        trace.finish()
+        st.session_state.pdf_info["trace"] = trace.rows()
+    if info.get("profile"):
+        st.caption(f"Perfil guardado: {info['profile'][0]}")
+    if diagnostics and info.get("trace"):
+        with st.expander("Diagnóstico por etapa"):
+            st.dataframe(info["trace"])
+
+
+# ----------------------------
+# Precarga
+# ----------------------------
+# Al final del script: el formulario ya se pintó sin la pila de PDF (ReportLab, PyPDF2,
+# Pillow); se carga en segundo plano una vez por proceso del servidor (con servicio de
+# render no hace falta: el PDF se genera allá).
+@st.cache_resource
+def _warm_up():
+    return warm_up(default_workers())
+
+
+if not render_url:
+    _warm_up()
@@ -0,0 +1,28 @@
+"""Fixtures comunes de las pruebas (las entradas sintéticas son las de los benchmarks)."""
+import io
+
+import pytest
+from PyPDF2 import PdfReader
+
+from ficha.workers import shutdown_pools
+
+
+def _pages(pdf):
+    """Páginas de un PDF dado como bytes o ruta, re-leído con PyPDF2 en modo estricto."""
+    return PdfReader(pdf if isinstance(pdf, str) else io.BytesIO(pdf), strict=True).pages
+
+
+@pytest.fixture
+def read_pages():
+    return _pages
+
+
+@pytest.fixture
+def page_texts():
+    return lambda pdf: [page.extract_text() for page in _pages(pdf)]
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _shared_pools():
+    yield
+    shutdown_pools()
@@ -0,0 +1,50 @@
+import pytest
+from streamlit.testing.v1 import AppTest
+
+
+@pytest.fixture
+def app():
+    at = AppTest.from_file("../main.py", default_timeout=60)
+    at.run()
+    assert not at.exception
+    return at
+
+
+def _by_label(elements, label):
+    return next(e for e in elements if e.label == label)
+
+
+def _add_med(at, name, dose=""):
+    _by_label(at.text_input, "Nombre del medicamento").input(name)
+    _by_label(at.text_input, "Dosis").input(dose)
+    _by_label(at.button, "➕ Agregar").click()
+    at.run()
+
+
+def test_add_edit_and_remove_medications(app):
+    _add_med(app, " Losartán ", "50 mg")
+    _add_med(app, "Metformina")
+    meds = app.session_state.meds
+    assert [(m["nombre"], m["dosis"]) for m in meds] == [("Losartán", "50 mg"), ("Metformina", "")]
+
+    # Cada campo sigue al medicamento por su id, no por su posición
+    first, second = (m["id"] for m in meds)
+    app.text_input(key=f"med_{second}_dosis").input("850 mg")
+    app.run()
+    app.button(key=f"med_{first}_quitar").click()
+    app.run()
+    assert [(m["nombre"], m["dosis"]) for m in app.session_state.meds] == [("Metformina", "850 mg")]
+    assert not app.exception
+
+
+def test_medication_needs_a_name(app):
+    _add_med(app, "   ")
+    assert app.session_state.meds == []
+    assert [w.value for w in app.warning] == ["Escribe al menos el nombre del medicamento antes de agregar."]
+
+
+def test_sarc_f_total(app):
+    _by_label(app.selectbox, "Fuerza (levantar/cargar 4.5 kg)").select("2 - Mucha dificultad / no puede")
+    _by_label(app.selectbox, "Caídas (último año)").select("1 - 1 a 3 caídas")
+    app.run()
+    assert "**SARC-F total:** 3 / 10" in [m.value for m in app.markdown]
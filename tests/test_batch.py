@@ -0,0 +1,78 @@
+import io
+import json
+import os
+
+import pytest
+
+from benchmarks.fixtures import image_bytes, maximal_data, pdf_bytes
+from ficha.batch import iter_records, render_record, run
+from ficha.errors import AttachmentError
+
+# Encabezado de PDF seguido de basura (sin xref ni trailer)
+CORRUPT_PDF = b"%PDF-1.4\n" + bytes(range(256)) * 20
+
+
+@pytest.fixture
+def export(tmp_path):
+    """JSONL con dos registros válidos y dos líneas malas, junto a sus anexos."""
+    (tmp_path / "labs").mkdir()
+    (tmp_path / "labs" / "bh.pdf").write_bytes(pdf_bytes(3))
+    (tmp_path / "labs" / "rx.jpg").write_bytes(image_bytes(1))
+    data = maximal_data(meds=3)
+    del data["Anexos"]  # lo llena render_record con los nombres de los anexos
+    lines = [
+        {"id": "p/001", "data": data, "anexos": ["labs/bh.pdf", "labs/rx.jpg"]},
+        {"data": data, "anexos": [{"ruta": "labs/bh.pdf", "paginas": "2-3"}]},
+        "no es json",
+        {"id": "sin-data"},
+    ]
+    path = tmp_path / "registros.jsonl"
+    path.write_text("\n".join(x if isinstance(x, str) else json.dumps(x) for x in lines) + "\n\n",
+                    encoding="utf-8")
+    return path
+
+
+def test_iter_records_reports_bad_lines(export):
+    rows = list(iter_records(export))
+    assert [line_no for line_no, _, _ in rows] == [1, 2, 3, 4]
+    assert [rec is not None for _, rec, _ in rows] == [True, True, False, False]
+    assert rows[2][2].startswith("JSON inválido")
+    assert rows[3][2] == "falta el dict 'data'"
+
+
+def test_render_record_is_reproducible(export, tmp_path, read_pages):
+    rec = next(rec for _, rec, _ in iter_records(export))
+    out_a, out_b = tmp_path / "a", tmp_path / "b"
+    out_a.mkdir(), out_b.mkdir()
+    res = render_record(rec, str(tmp_path), str(out_a), deterministic=True)
+    render_record(rec, str(tmp_path), str(out_b), deterministic=True)
+    assert os.path.basename(res["path"]) == "p_001.pdf"
+    assert res["anexos"] == 2 and res["omitidos"] == []
+    assert (out_a / "p_001.pdf").read_bytes() == (out_b / "p_001.pdf").read_bytes()
+    assert res["data"]["Anexos"] == ["bh.pdf", "rx.jpg"]
+    assert len(read_pages(res["path"])) >= 3 + 1
+
+
+def test_failed_record_leaves_no_partial_file(tmp_path):
+    (tmp_path / "dañado.pdf").write_bytes(CORRUPT_PDF)
+    rec = {"id": "x", "data": {}, "anexos": ["dañado.pdf"]}
+    with pytest.raises(AttachmentError):
+        render_record(rec, str(tmp_path), str(tmp_path))
+    assert sorted(os.listdir(tmp_path)) == ["dañado.pdf"]
+
+
+def test_skip_invalid_renders_without_the_attachment(tmp_path):
+    (tmp_path / "dañado.pdf").write_bytes(CORRUPT_PDF)
+    rec = {"id": "x", "data": {}, "anexos": ["dañado.pdf"]}
+    res = render_record(rec, str(tmp_path), str(tmp_path), skip_invalid=True)
+    assert res["anexos"] == 0
+    assert [name for name, _ in res["omitidos"]] == ["dañado.pdf"]
+
+
+def test_run_counts_failures(export, tmp_path):
+    out, err = io.StringIO(), io.StringIO()
+    failed = run(str(export), str(tmp_path / "salida"), jobs=1, out=out, err=err)
+    assert failed == 2
+    assert sorted(os.listdir(tmp_path / "salida")) == ["linea_2.pdf", "p_001.pdf"]
+    assert "Total: 4 registros, 2 OK, 2 fallas" in out.getvalue()
+    assert "FALLA linea_3" in err.getvalue() and "FALLA linea_4" in err.getvalue()
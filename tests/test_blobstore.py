@@ -0,0 +1,142 @@
+import hashlib
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+import ficha.blobstore
+from benchmarks.fixtures import Upload, image_bytes, pdf_bytes
+from ficha.blobstore import BlobStore, get_blob_store
+from ficha.cache import page_key
+from ficha.pdf import PathUpload, build_pdf_with_attachments
+
+
+class _Clock:
+    """Reemplazo de `time` con un reloj que solo avanza a mano."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(ficha.blobstore, "time", clock)
+    return clock
+
+
+def _files(store):
+    return sorted(name for _, _, names in os.walk(os.path.join(store.root, "objects")) for name in names)
+
+
+def test_content_is_stored_once(tmp_path):
+    store = BlobStore(str(tmp_path))
+    digest = store.put_part(b"contenido")
+    assert digest == hashlib.sha256(b"contenido").hexdigest()
+    assert store.put_part(b"contenido") == digest
+    path = tmp_path / "f.bin"
+    path.write_bytes(b"contenido")
+    assert store.put_part(str(path)) == digest
+    assert _files(store) == [digest] and store.stats()["entries"] == 1
+    with open(store.path_for(digest), "rb") as f:
+        assert f.read() == b"contenido"
+    assert os.listdir(tmp_path / "tmp") == []
+
+
+@pytest.mark.parametrize("make", [
+    lambda tmp_path: Upload("labs.pdf", pdf_bytes(1)),
+    lambda tmp_path: PathUpload(str(tmp_path / "labs.pdf")),
+])
+def test_uploads_are_stored_and_hashed_before_writing(tmp_path, monkeypatch, make):
+    (tmp_path / "labs.pdf").write_bytes(pdf_bytes(1))
+    store = BlobStore(str(tmp_path / "almacen"))
+    path = store.add_upload(make(tmp_path))
+    assert open(path, "rb").read() == pdf_bytes(1)
+    # Ya guardado: no se vuelve a escribir
+    monkeypatch.setattr(store, "put_part", lambda part: pytest.fail("se volvió a escribir"))
+    assert store.add_upload(make(tmp_path)) == path
+
+
+def test_cache_interface(tmp_path):
+    store = BlobStore(str(tmp_path))
+    key = page_key("foto.jpg", "abc", 150, 85)
+    assert store.get(key) is None and key not in store
+    store.put(key, b"%PDF-pagina")
+    assert key in store
+    assert open(store.get(key), "rb").read() == b"%PDF-pagina"
+    assert (store.hits, store.misses) == (1, 1)
+
+
+def test_evicts_least_recently_used_outside_the_grace_period(tmp_path, clock):
+    store = BlobStore(str(tmp_path), max_bytes=25, grace=60)
+    a = store.put_part(b"a" * 10)
+    clock.now += 1
+    b = store.put_part(b"b" * 10)
+    clock.now += 100
+    store.open_blob(a)  # "a" se usó después que "b"
+    clock.now += 100
+    store.put(("k", 1), b"c" * 10)
+    assert store.open_blob(b) is None and store.open_blob(a) is not None
+    assert store.evictions == 1 and store.stats()["bytes"] == 20
+    # Todo lo demás se usó hace menos de `grace`: se pasa del máximo antes que borrarlo
+    store.put_part(b"d" * 10)
+    assert store.stats()["entries"] == 3 and ("k", 1) in store
+
+
+def test_blob_removed_by_hand_is_forgotten(tmp_path):
+    store = BlobStore(str(tmp_path))
+    store.put("llave", b"x")
+    os.remove(store.get("llave"))
+    assert store.get("llave") is None and "llave" not in store
+    assert store.stats()["entries"] == 0
+
+
+def test_render_with_a_store(tmp_path, read_pages):
+    store = BlobStore(str(tmp_path))
+    uploads = [Upload("foto.jpg", image_bytes(1)), Upload("labs.pdf", pdf_bytes(2))]
+    first = build_pdf_with_attachments({}, uploads, store=store)
+    # Los dos uploads y la página convertida de la foto
+    assert store.stats()["entries"] == 3
+    second = build_pdf_with_attachments({}, uploads, store=store)
+    assert store.hits == 1 and len(read_pages(first)) == len(read_pages(second))
+
+
+def test_get_blob_store_from_the_environment(tmp_path, monkeypatch):
+    monkeypatch.delenv("FICHA_BLOB_DIR", raising=False)
+    assert get_blob_store() is None
+    monkeypatch.setenv("FICHA_BLOB_DIR", str(tmp_path))
+    monkeypatch.setenv("FICHA_BLOB_MAX_MB", "2")
+    store = get_blob_store()
+    assert store is get_blob_store() and store.max_bytes == 2 * 1024 * 1024
+
+
+def _hammer(root, seed):
+    store = BlobStore(root, max_bytes=40 * 1024, grace=0)
+    for i in range(30):
+        data = bytes([(seed + i) % 7]) * 8 * 1024
+        store.put(f"llave-{(seed + i) % 7}", data)
+        path = store.get(f"llave-{(seed + i) % 7}")
+        if path is None:
+            continue
+        try:
+            with open(path, "rb") as f:
+                # Nunca un archivo a medias ni de otro contenido
+                assert hashlib.sha256(f.read()).hexdigest() == os.path.basename(path)
+        except FileNotFoundError:
+            pass  # con grace=0 otro proceso puede desalojarlo en cuanto se regresa
+    return True
+
+
+def test_processes_share_a_root(tmp_path):
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(4, mp_context=ctx) as pool:
+        assert all(pool.map(_hammer, [str(tmp_path)] * 4, range(4)))
+    store = BlobStore(str(tmp_path))
+    rows = store._db().execute("SELECT digest FROM blobs").fetchall()
+    assert sorted(d for (d,) in rows) == _files(store)
+    assert store.stats()["bytes"] <= 40 * 1024 + 8 * 1024
+    assert os.listdir(tmp_path / "tmp") == []
@@ -0,0 +1,66 @@
+from benchmarks.fixtures import Upload, image_bytes, minimal_data
+from ficha.cache import ByteLRUCache, content_hash, data_hash, page_key, upload_hash
+from ficha.pdf import PathUpload, build_pdf_with_attachments
+
+
+def test_evicts_least_recently_used_by_bytes():
+    cache = ByteLRUCache(10, max_item_bytes=10)
+    cache.put("a", b"aaaa")
+    cache.put("b", b"bbbb")
+    assert cache.get("a") == b"aaaa"  # "b" queda como el menos reciente
+    cache.put("c", b"cccc")
+    assert "b" not in cache and "a" in cache and "c" in cache
+    assert cache.stats()["bytes"] == 8 and cache.evictions == 1
+
+
+def test_replacing_a_key_updates_the_size():
+    cache = ByteLRUCache(10)
+    cache.put("a", b"x")
+    cache.put("a", b"yy")
+    assert cache.stats()["bytes"] == 2 and cache.stats()["entries"] == 1
+
+
+def test_oversized_values_are_not_stored():
+    cache = ByteLRUCache(100)
+    cache.put("grande", b"x" * 26)
+    assert cache.get("grande") is None
+    assert (cache.hits, cache.misses) == (0, 1)
+
+
+def test_spooled_values_are_read_into_memory(tmp_path):
+    path = tmp_path / "parte.pdf"
+    path.write_bytes(b"%PDF")
+    cache = ByteLRUCache(100)
+    cache.put("p", str(path))
+    assert cache.get("p") == b"%PDF"
+
+
+def test_hashes_agree_across_sources(tmp_path):
+    data = image_bytes(1)
+    path = tmp_path / "foto.jpg"
+    path.write_bytes(data)
+    assert content_hash(data) == content_hash(str(path)) == upload_hash(Upload("foto.jpg", data))
+    assert upload_hash(PathUpload(str(path))) == content_hash(data)
+
+
+def test_data_hash_ignores_key_order():
+    assert data_hash({"a": 1, "b": [1, 2]}) == data_hash({"b": [1, 2], "a": 1})
+    assert data_hash({"a": 1}) != data_hash({"a": 2})
+
+
+def test_page_key_includes_the_title():
+    digest = content_hash(b"x")
+    assert page_key("a.jpg", digest, 150, 85) != page_key("b.jpg", digest, 150, 85)
+
+
+def test_converted_pages_are_reused(page_texts):
+    cache = ByteLRUCache(8 * 1024 * 1024)
+    uploads = [Upload("foto.jpg", image_bytes(2)), Upload("captura.png", image_bytes(0.3, "PNG"))]
+    first = build_pdf_with_attachments(minimal_data(), uploads, cache=cache)
+    assert (cache.hits, cache.stats()["entries"]) == (0, 2)
+    second = build_pdf_with_attachments(minimal_data(), uploads, cache=cache)
+    assert cache.hits == 2
+    assert page_texts(first) == page_texts(second)
+    # Otro DPI es otra llave
+    build_pdf_with_attachments(minimal_data(), uploads, cache=cache, dpi=100)
+    assert cache.stats()["entries"] == 4
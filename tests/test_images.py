@@ -0,0 +1,184 @@
+import io
+from functools import lru_cache
+
+import pytest
+from PIL import Image, ImageDraw
+
+from benchmarks.fixtures import image_bytes
+from ficha.images import can_passthrough, downsample_image, probe_image, target_pixels
+from ficha.pdf import image_to_pdf_page
+
+# Recuadro de la imagen en la página de un anexo (carta, márgenes de 3/4")
+BOX_W, BOX_H = 504, 666
+
+
+def _image(size, mode="RGB", fmt="JPEG", orientation=None) -> bytes:
+    img = Image.new(mode, size, "white" if mode != "1" else 1)
+    out = io.BytesIO()
+    kwargs = {}
+    if orientation:
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        kwargs["exif"] = exif
+    img.save(out, format=fmt, **kwargs)
+    return out.getvalue()
+
+
+def _xobject(pdf):
+    from PyPDF2 import PdfReader
+
+    page = PdfReader(io.BytesIO(pdf)).pages[0]
+    (xobj,) = page["/Resources"]["/XObject"].values()
+    return xobj.get_object()
+
+
+def test_target_pixels_never_upscales():
+    assert target_pixels(400, 300, BOX_W, BOX_H, 150) == (400, 300)
+    tw, th = target_pixels(4000, 3000, BOX_W, BOX_H, 150)
+    assert (tw, th) == (1050, 788)
+    assert target_pixels(4000, 3000, BOX_W, BOX_H, 300) == (2100, 1575)
+
+
+def test_downsample_fits_the_box():
+    data, fmt, size = downsample_image(image_bytes(12), BOX_W, BOX_H, dpi=150)
+    assert fmt == "JPEG" and size == target_pixels(4000, 3000, BOX_W, BOX_H, 150)
+    assert Image.open(io.BytesIO(data)).size == size
+
+
+def test_downsample_accepts_a_path(tmp_path):
+    path = tmp_path / "foto.jpg"
+    path.write_bytes(image_bytes(12))
+    assert downsample_image(str(path), BOX_W, BOX_H)[2] == downsample_image(image_bytes(12), BOX_W, BOX_H)[2]
+
+
+def test_downsample_applies_exif_rotation():
+    data, _, size = downsample_image(_image((3000, 2000), orientation=6), BOX_W, BOX_H)
+    assert size[0] < size[1]
+    assert Image.open(io.BytesIO(data)).getexif().get(0x0112, 1) == 1
+
+
+@pytest.mark.parametrize("mode, size, fmt", [
+    ("RGBA", (3000, 2000), "PNG"),
+    ("1", (3000, 2000), "PNG"),
+    ("L", (3000, 2000), "JPEG"),
+    ("CMYK", (3000, 2000), "JPEG"),
+    ("CMYK", (400, 300), "JPEG"),  # un JPEG que no va tal cual se recodifica aunque quepa
+])
+def test_downsample_output_format(mode, size, fmt):
+    src_fmt = "PNG" if mode in ("RGBA", "1") else "JPEG"
+    data, out_fmt, _ = downsample_image(_image(size, mode, src_fmt), BOX_W, BOX_H)
+    assert out_fmt == fmt
+    assert Image.open(io.BytesIO(data)).format == fmt
+
+
+@lru_cache(maxsize=None)
+def _scan(size) -> bytes:
+    """Escaneo en blanco y negro: renglones de "texto" en negro."""
+    img = Image.new("1", size, 1)
+    draw = ImageDraw.Draw(img)
+    for y in range(30, size[1] - 30, 14):
+        for x in range(40, size[0] - 80, 37):
+            draw.rectangle([x, y, x + 5 + (x * y) % 29, y + 8], fill=0)
+    out = io.BytesIO()
+    img.save(out, format="PNG")
+    return out.getvalue()
+
+
+@lru_cache(maxsize=None)
+def _chart(size) -> bytes:
+    """Gráfica con paleta de pocos colores y fondo transparente."""
+    img = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(img)
+    for i, x in enumerate(range(20, size[0] - 40, 28)):
+        draw.rectangle([x, size[1] - 30 - (i * 37) % (size[1] // 2), x + 20, size[1] - 30],
+                       fill=[(200, 30, 30), (30, 30, 200), (30, 160, 30)][i % 3])
+    out = io.BytesIO()
+    img.quantize(16).save(out, format="PNG", transparency=0)
+    return out.getvalue()
+
+
+@lru_cache(maxsize=None)
+def _screenshot(size) -> bytes:
+    """Captura de pantalla en PNG: texto oscuro sobre fondo claro."""
+    img = Image.new("RGB", size, (240, 240, 240))
+    draw = ImageDraw.Draw(img)
+    draw.rectangle([0, 0, size[0], 18], fill=(30, 90, 180))
+    for y in range(24, size[1], 22):
+        draw.text((30, y), "Glucosa en ayuno 110 mg/dL   Hemoglobina 13.2 g/dL   " * (size[0] // 400),
+                  fill=(20, 20, 20))
+    out = io.BytesIO()
+    img.save(out, format="PNG")
+    return out.getvalue()
+
+
+def test_bitonal_stays_bitonal_and_smaller():
+    source = _scan((3462, 2595))
+    data, fmt, size = downsample_image(source, BOX_W, BOX_H)
+    img = Image.open(io.BytesIO(data))
+    assert (fmt, img.mode, size) == ("PNG", "1", target_pixels(3462, 2595, BOX_W, BOX_H, 150))
+    assert len(data) < len(source)
+    assert len(image_to_pdf_page(source, "scan", dpi=150)) < len(image_to_pdf_page(source, "scan", dpi=None))
+
+
+def test_palette_stays_palette_and_smaller():
+    source = _chart((3462, 2595))
+    data, fmt, _ = downsample_image(source, BOX_W, BOX_H)
+    img = Image.open(io.BytesIO(data))
+    assert (fmt, img.mode) == ("PNG", "P") and "transparency" in img.info
+    assert len(img.getcolors()) <= 16
+    assert len(data) < len(source)
+
+
+@pytest.mark.parametrize("source", [
+    _scan((1154, 865)),  # reducir 10 % no achica un PNG bitonal ni una captura
+    _screenshot((1154, 865)),
+    _image((300, 200), "I;16", "PNG"),  # cabe: no se recodifica
+], ids=["bitonal", "captura", "16-bits"])
+def test_original_is_kept_when_reencoding_does_not_help(source):
+    data, fmt, size = downsample_image(source, BOX_W, BOX_H)
+    assert data is source
+    assert (fmt, size) == ("PNG", Image.open(io.BytesIO(source)).size)
+
+
+@pytest.mark.parametrize("make", [_scan, _chart, _screenshot], ids=["bitonal", "paleta", "captura"])
+@pytest.mark.parametrize("size", [(1154, 865), (3462, 2595)], ids=["poco", "mucho"])
+def test_downsampling_never_grows_the_attachment(make, size):
+    source = make(size)
+    data, _, _ = downsample_image(source, BOX_W, BOX_H)
+    assert len(data) <= len(source)
+
+
+@pytest.mark.parametrize("make", [_scan, _chart, _screenshot], ids=["bitonal", "paleta", "captura"])
+def test_downsampled_page_is_smaller_than_full_resolution(make):
+    source = make((3462, 2595))
+    assert len(image_to_pdf_page(source, "anexo", dpi=150)) < len(image_to_pdf_page(source, "anexo", dpi=None))
+
+
+def test_original_path_is_kept(tmp_path):
+    path = tmp_path / "scan.png"
+    path.write_bytes(_scan((1154, 865)))
+    assert downsample_image(str(path), BOX_W, BOX_H)[0] == str(path)
+    assert _xobject(image_to_pdf_page(str(path), "scan"))._data == _xobject(image_to_pdf_page(
+        path.read_bytes(), "scan", dpi=None))._data
+
+
+def test_passthrough_only_for_plain_jpegs_that_fit():
+    small = probe_image(_image((800, 600)))
+    assert can_passthrough(small, BOX_W, BOX_H, 150)
+    assert not can_passthrough(probe_image(image_bytes(12)), BOX_W, BOX_H, 150)
+    assert can_passthrough(probe_image(image_bytes(12)), BOX_W, BOX_H, None)
+    assert not can_passthrough(probe_image(_image((800, 600), orientation=6)), BOX_W, BOX_H, 150)
+    assert not can_passthrough(probe_image(_image((800, 600), "CMYK")), BOX_W, BOX_H, 150)
+    assert not can_passthrough(probe_image(_image((800, 600), fmt="PNG")), BOX_W, BOX_H, 150)
+
+
+def test_fitting_jpeg_is_embedded_unchanged():
+    jpeg = _image((800, 600))
+    xobj = _xobject(image_to_pdf_page(jpeg, "foto.jpg"))
+    assert "/DCTDecode" in xobj["/Filter"]
+    assert xobj._data == jpeg
+
+
+def test_large_image_is_embedded_at_target_resolution():
+    xobj = _xobject(image_to_pdf_page(image_bytes(12), "foto.jpg", dpi=150))
+    assert (xobj["/Width"], xobj["/Height"]) == target_pixels(4000, 3000, BOX_W, BOX_H, 150)
@@ -0,0 +1,79 @@
+import gc
+import os
+
+import pytest
+
+from benchmarks.fixtures import Upload, image_bytes, maximal_data, pdf_bytes
+from ficha.errors import AttachmentError
+from ficha.incremental import RenderMemo
+
+CORRUPT_PDF = b"%PDF-1.4\n" + bytes(range(256)) * 20
+
+
+def _uploads():
+    return [Upload("foto.jpg", image_bytes(1)), Upload("labs.pdf", pdf_bytes(2))]
+
+
+def test_unchanged_inputs_reuse_the_pdf():
+    memo = RenderMemo(deterministic=True)
+    data = maximal_data(meds=3)
+    path, reused = memo.render(data, _uploads())
+    assert not reused
+    assert memo.render(dict(data), _uploads()) == (path, True)
+    assert (memo.hits, memo.misses) == (1, 1)
+
+
+def test_changes_invalidate_the_pdf_and_remove_the_old_file():
+    memo = RenderMemo(deterministic=True)
+    data = maximal_data(meds=3)
+    first, _ = memo.render(data, _uploads())
+    base = memo.base
+    second, reused = memo.render(data, _uploads(), dpi=100)
+    assert not reused and memo.base is base  # la base no cambió
+    assert not os.path.exists(first)
+    third, reused = memo.render({**data, "Nombre": "otra"}, _uploads(), dpi=100)
+    assert not reused and memo.base is not base and not os.path.exists(second)
+    memo.clear()
+    assert not os.path.exists(third)
+
+
+def test_key_for_matches_render():
+    memo = RenderMemo(deterministic=True)
+    data, uploads = maximal_data(meds=3), _uploads()
+    memo.render(data, uploads, pages=[None, "1"])
+    assert memo.key_for(data, uploads, pages=[None, "1"]) == memo.final_key
+    assert memo.key_for(data, uploads) != memo.final_key
+
+
+def test_deterministic_renders_are_byte_identical():
+    data = maximal_data(meds=3)
+    memos = [RenderMemo(deterministic=True) for _ in range(2)]
+    a, b = (open(memo.render(data, _uploads())[0], "rb").read() for memo in memos)
+    assert a == b
+
+
+def test_pdf_is_removed_with_the_memo():
+    memo = RenderMemo(deterministic=True)
+    path, _ = memo.render({}, _uploads())
+    del memo
+    gc.collect()
+    assert not os.path.exists(path)
+
+
+def test_skipped_attachments_survive_reuse():
+    memo = RenderMemo(deterministic=True)
+    uploads = _uploads() + [Upload("dañado.pdf", CORRUPT_PDF)]
+    memo.render({}, uploads, skip_invalid=True)
+    assert [e.name for e in memo.skipped] == ["dañado.pdf"]
+    assert memo.render({}, uploads, skip_invalid=True)[1]
+    # Sin skip_invalid el PDF guardado (sin ese anexo) no sirve
+    with pytest.raises(AttachmentError):
+        memo.render({}, uploads)
+
+
+def test_failed_render_keeps_the_previous_pdf():
+    memo = RenderMemo(deterministic=True)
+    path, _ = memo.render({}, _uploads())
+    with pytest.raises(AttachmentError):
+        memo.render({}, [Upload("dañado.pdf", CORRUPT_PDF)])
+    assert memo.final_path == path and os.path.exists(path)
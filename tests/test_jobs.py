@@ -0,0 +1,103 @@
+import io
+import threading
+
+import pytest
+
+from benchmarks.fixtures import Upload, image_bytes, pdf_bytes
+from ficha.cache import ByteLRUCache
+from ficha.jobs import CANCELLED, DONE, FAILED, ProgressTrace, RenderJob
+from ficha.metrics import Registry
+from ficha.pdf import write_pdf_with_attachments
+
+CORRUPT_PDF = b"%PDF-1.4\n" + bytes(range(256)) * 20
+
+
+def _uploads():
+    return [Upload("foto.jpg", image_bytes(1)), Upload("labs.pdf", pdf_bytes(2)),
+            Upload("captura.png", image_bytes(0.3, "PNG"))]
+
+
+def _trace(uploads):
+    return ProgressTrace(len(uploads), [uf.name for uf in uploads], registry=Registry())
+
+
+def _render(uploads, trace, **kwargs):
+    return write_pdf_with_attachments(io.BytesIO(), {}, uploads, trace=trace, **kwargs)
+
+
+def test_progress_reaches_one():
+    uploads = _uploads()
+    trace = _trace(uploads)
+    assert trace.progress == 0 and trace.stage == "En espera"
+    _render(uploads, trace)
+    assert trace.progress == 1.0
+    assert trace.items == {"foto.jpg": "unido (1 págs.)", "labs.pdf": "unido (2 págs.)",
+                           "captura.png": "unido (1 págs.)"}
+
+
+def test_progress_with_cache_hits_and_skipped_attachments():
+    cache = ByteLRUCache(8 * 1024 * 1024)
+    _render(_uploads(), _trace(_uploads()), cache=cache)
+    uploads = _uploads() + [Upload("dañado.pdf", CORRUPT_PDF), Upload("truncada.jpg", image_bytes(4)[:20000])]
+    trace = _trace(uploads)
+    _render(uploads, trace, cache=cache, skip_invalid=True)
+    assert trace.progress == 1.0
+    assert trace.items["dañado.pdf"].startswith("omitido: PDF inválido")
+    assert trace.items["truncada.jpg"].startswith("omitido: imagen inválida")
+
+
+def test_job_runs_in_the_background():
+    uploads = _uploads()
+    trace = _trace(uploads)
+    job = RenderJob("k", lambda: _render(uploads, trace), trace)
+    assert job.wait(timeout=60)
+    assert job.state == DONE and job.result == [] and job.seconds > 0
+
+
+def test_cancel_stops_at_the_next_stage():
+    uploads = _uploads()
+    trace = _trace(uploads)
+    gate = threading.Event()
+
+    def fn():
+        gate.wait()
+        return _render(uploads, trace)
+
+    job = RenderJob("k", fn, trace)
+    job.cancel()
+    gate.set()
+    assert job.wait(timeout=60)
+    assert job.state == CANCELLED and job.result is None
+
+
+def test_failures_are_kept():
+    uploads = [Upload("dañado.pdf", CORRUPT_PDF)]
+    trace = _trace(uploads)
+    job = RenderJob("k", lambda: _render(uploads, trace), trace)
+    job.wait(timeout=60)
+    assert job.state == FAILED and job.error.name == "dañado.pdf"
+
+
+def test_jobs_chained_with_after_do_not_overlap():
+    order = []
+    gate = threading.Event()
+
+    def first():
+        gate.wait()
+        order.append("primero")
+
+    a = RenderJob("a", first, _trace([]))
+    b = RenderJob("b", lambda: order.append("segundo"), _trace([]), after=a)
+    assert not b.wait(timeout=0.2)
+    gate.set()
+    assert b.wait(timeout=60)
+    assert order == ["primero", "segundo"]
+
+
+@pytest.mark.parametrize("stage, label", [("merge", "Uniendo páginas"), ("otra", "otra")])
+def test_stage_labels(stage, label):
+    trace = _trace([])
+    with trace.span(stage):
+        assert trace.stage == label
+    trace.queue_position = 3
+    assert trace.stage == "En cola (posición 3)"
@@ -0,0 +1,145 @@
+import io
+
+import pytest
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import IndirectObject
+
+from benchmarks.fixtures import image_bytes, minimal_data, pdf_bytes
+from ficha.errors import AttachmentError
+from ficha.merge import PageMerger
+from ficha.pdf import build_base_pdf, image_to_pdf_page
+
+CORRUPT_PDF = b"%PDF-1.4\n" + bytes(range(256)) * 20
+
+
+def _merge(*parts, **kwargs):
+    out = io.BytesIO()
+    merger = PageMerger(out)
+    for i, part in enumerate(parts):
+        merger.add(part, f"parte_{i}.pdf", **kwargs)
+    merger.close()
+    return out.getvalue(), merger
+
+
+def _encrypted(user_password, owner_password="dueño") -> bytes:
+    writer = PdfWriter()
+    for page in PdfReader(io.BytesIO(pdf_bytes(2))).pages:
+        writer.add_page(page)
+    writer.encrypt(user_password, owner_password)
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+def _resolve_all(pdf):
+    """Re-lee el PDF en modo estricto y resuelve cada referencia alcanzable desde sus páginas."""
+    reader = PdfReader(io.BytesIO(pdf), strict=True)
+    seen = set()
+
+    def walk(obj):
+        if isinstance(obj, IndirectObject):
+            if obj.idnum in seen:
+                return
+            seen.add(obj.idnum)
+            resolved = obj.get_object()
+            assert resolved is not None, f"objeto {obj.idnum} no existe"
+            obj = resolved
+        if hasattr(obj, "items"):
+            for k, v in obj.items():
+                if k != "/Parent":
+                    walk(v)
+        elif isinstance(obj, list):
+            for v in obj:
+                walk(v)
+
+    for page in reader.pages:
+        walk(page.indirect_reference)
+    return reader
+
+
+def test_merged_pdf_rereads_with_pages_in_order(page_texts):
+    base = build_base_pdf(minimal_data(), generated_at="—")
+    image = image_to_pdf_page(image_bytes(1), "foto.jpg")
+    merged, merger = _merge(base, pdf_bytes(3), image)
+    reader = _resolve_all(merged)
+    base_pages = len(PdfReader(io.BytesIO(base)).pages)
+    assert len(reader.pages) == base_pages + 3 + 1
+    assert page_texts(merged)[:base_pages] == page_texts(base)
+    assert "foto.jpg" in page_texts(merged)[-1]
+    assert [s.pages for s in merger.stats] == [base_pages, 3, 1]
+
+
+def test_identical_parts_are_written_once():
+    doc = image_to_pdf_page(image_bytes(1), "foto.jpg")
+    once, _ = _merge(doc)
+    twice, merger = _merge(doc, doc)
+    assert [s.duplicate for s in merger.stats] == [False, True]
+    assert merger.stats[1].objects == 0
+    # La copia solo agrega un diccionario de página, no la imagen
+    assert len(twice) - len(once) < 1024
+    assert len(_resolve_all(twice).pages) == 2
+
+
+def test_output_is_deterministic():
+    parts = (build_base_pdf(minimal_data(), generated_at="—", invariant=True), pdf_bytes(2))
+    assert _merge(*parts)[0] == _merge(*parts)[0]
+
+
+def test_spooled_parts(tmp_path):
+    path = tmp_path / "labs.pdf"
+    path.write_bytes(pdf_bytes(3))
+    merged, _ = _merge(str(path), pdf_bytes(3))
+    assert len(_resolve_all(merged).pages) == 6
+
+
+def test_owner_only_encryption_is_opened():
+    merged, _ = _merge(_encrypted(""))
+    assert len(_resolve_all(merged).pages) == 2
+
+
+@pytest.mark.parametrize("part, reason", [
+    (_encrypted("secreto"), "PDF protegido con contraseña"),
+    (CORRUPT_PDF, "PDF inválido"),
+])
+def test_bad_parts_raise_and_leave_the_merge_usable(part, reason):
+    out = io.BytesIO()
+    merger = PageMerger(out)
+    merger.add(pdf_bytes(1), "ok.pdf")
+    with pytest.raises(AttachmentError) as excinfo:
+        merger.add(part, "malo.pdf")
+    assert excinfo.value.name == "malo.pdf" and excinfo.value.reason.startswith(reason)
+    merger.add(pdf_bytes(2), "otro.pdf")
+    merger.close()
+    assert len(_resolve_all(out.getvalue()).pages) == 3
+
+
+def test_budget_rolls_back_the_part():
+    out = io.BytesIO()
+    merger = PageMerger(out)
+    with pytest.raises(AttachmentError, match="en unirse"):
+        merger.add(pdf_bytes(50), "largo.pdf", budget=1e-9)
+    merger.add(pdf_bytes(1), "corto.pdf")
+    merger.close()
+    assert len(_resolve_all(out.getvalue()).pages) == 1
+
+
+def test_part_failing_mid_copy_can_be_added_again(monkeypatch):
+    doc = image_to_pdf_page(image_bytes(1), "foto.jpg")
+    out = io.BytesIO()
+    merger = PageMerger(out)
+    write, calls = merger._write, []
+
+    def flaky(num, obj):
+        # Falla con objetos ya numerados pero aún sin escribir
+        calls.append(num)
+        if len(calls) == 3:
+            raise AttachmentError("foto.pdf", "falla simulada")
+        return write(num, obj)
+
+    monkeypatch.setattr(merger, "_write", flaky)
+    with pytest.raises(AttachmentError):
+        merger.add(doc, "foto.pdf")
+    monkeypatch.setattr(merger, "_write", write)
+    merger.add(doc, "foto.pdf")
+    merger.close()
+    assert len(_resolve_all(out.getvalue()).pages) == 1
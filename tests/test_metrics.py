@@ -0,0 +1,74 @@
+import json
+import logging
+import urllib.request
+
+from benchmarks.fixtures import Upload, image_bytes, minimal_data, pdf_bytes
+from ficha.metrics import NULL_TRACE, Registry, Trace, new_trace, start_metrics_server
+from ficha.pdf import build_pdf_with_attachments
+
+
+def test_disabled_by_default(monkeypatch):
+    monkeypatch.delenv("FICHA_METRICS", raising=False)
+    assert new_trace() is NULL_TRACE and not NULL_TRACE
+    with NULL_TRACE.span("base") as sp:
+        sp.bytes_out = 10
+    assert NULL_TRACE.rows() == []
+    monkeypatch.setenv("FICHA_METRICS", "1")
+    assert isinstance(new_trace(), Trace)
+
+
+def test_render_reports_each_stage():
+    trace = Trace(registry=Registry(), memory=False)
+    uploads = [Upload("foto.jpg", image_bytes(1)), Upload("labs.pdf", pdf_bytes(2))]
+    build_pdf_with_attachments(minimal_data(), uploads, trace=trace)
+    stages = [row["stage"] for row in trace.rows()]
+    for stage in ("spool", "validate", "convert", "base", "merge"):
+        assert stage in stages
+    converted = [row for row in trace.rows() if row["stage"] == "convert_attachment"]
+    assert [(row["attachment"], row["kind"]) for row in converted] == [(0, "image"), (1, "pdf")]
+    assert converted[0]["bytes_in"] == len(image_bytes(1)) and converted[0]["bytes_out"] > 0
+    merge = next(row for row in trace.rows() if row["stage"] == "merge")
+    assert merge["pages"] >= 3
+
+
+def test_finish_logs_and_exports(tmp_path, monkeypatch, caplog):
+    path = tmp_path / "ficha.prom"
+    monkeypatch.setenv("FICHA_METRICS_FILE", str(path))
+    registry = Registry()
+    trace = Trace(render_id="r1", registry=registry, memory=False)
+    with trace.span("base") as sp:
+        sp.bytes_out, sp.pages = 100, 2
+    trace.add("convert_attachment", 0.5, bytes_in=10, attachment=0)
+    with caplog.at_level(logging.INFO, logger="ficha.metrics"):
+        trace.finish()
+    events = [json.loads(r.getMessage()) for r in caplog.records]
+    assert [e["event"] for e in events] == ["span", "span", "render"]
+    assert events[1] == {**events[1], "stage": "convert_attachment", "render_id": "r1", "attachment": 0}
+    text = path.read_text(encoding="utf-8")
+    assert 'ficha_stage_pages_total{stage="base"} 2' in text
+    assert 'ficha_stage_bytes_in_total{stage="convert_attachment"} 10' in text
+    assert "ficha_render_seconds_count 1" in text
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry(buckets=(1, 5))
+    registry.observe([], 0.5)
+    registry.observe([], 3)
+    registry.observe([], 10)
+    text = registry.render()
+    assert 'ficha_render_seconds_bucket{le="1"} 1' in text
+    assert 'ficha_render_seconds_bucket{le="5"} 2' in text
+    assert 'ficha_render_seconds_bucket{le="+Inf"} 3' in text
+
+
+def test_metrics_server():
+    registry = Registry()
+    registry.observe([], 0.2)
+    server = start_metrics_server(0, registry=registry)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        with urllib.request.urlopen(url, timeout=10) as resp:
+            assert "ficha_render_seconds_count 1" in resp.read().decode("utf-8")
+    finally:
+        server.shutdown()
+        server.server_close()
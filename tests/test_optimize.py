@@ -0,0 +1,146 @@
+import base64
+import io
+
+import pytest
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import ArrayObject, NameObject
+
+from benchmarks.fixtures import Upload, image_bytes, minimal_data, pdf_bytes
+from ficha.merge import PageMerger
+from ficha.optimize import TARGET_QUALITIES, optimize_pdf
+from ficha.pdf import build_pdf_with_attachments, image_to_pdf_page
+
+
+def _merge(*parts) -> bytes:
+    out = io.BytesIO()
+    merger = PageMerger(out)
+    for i, part in enumerate(parts):
+        merger.add(part, f"parte_{i}.pdf")
+    merger.close()
+    return out.getvalue()
+
+
+def _optimize(source, **kwargs):
+    out = io.BytesIO()
+    steps = optimize_pdf(source, out, **kwargs)
+    return out.getvalue(), steps
+
+
+def _images(pdf) -> list:
+    """Datos (aún codificados) de cada imagen distinta que usan las páginas."""
+    seen = {}
+    for page in PdfReader(io.BytesIO(pdf)).pages:
+        for ref in page["/Resources"].get("/XObject", {}).values():
+            seen.setdefault(ref.idnum, ref.get_object())
+    return [x for x in seen.values() if x["/Subtype"] == "/Image"]
+
+
+def _a85_image_page() -> bytes:
+    """Página de imagen con el JPEG envuelto en ASCII85, como la escriben otras herramientas."""
+    writer = PdfWriter()
+    writer.add_page(PdfReader(io.BytesIO(image_to_pdf_page(image_bytes(0.5), "foto"))).pages[0])
+    for ref in writer.pages[0]["/Resources"]["/XObject"].values():
+        xobj = ref.get_object()
+        xobj._data = base64.a85encode(xobj._data, adobe=True)
+        xobj[NameObject("/Filter")] = ArrayObject([NameObject("/ASCII85Decode"), NameObject("/DCTDecode")])
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+def test_lossless_round_trip(page_texts, read_pages):
+    merged = _merge(pdf_bytes(3), image_to_pdf_page(image_bytes(1), "foto"))
+    optimized, steps = _optimize(merged)
+    assert [s.step for s in steps] == ["read", "dedup", "write"]
+    assert steps[-1].bytes_out == len(optimized) <= len(merged)
+    assert len(read_pages(optimized)) == 4
+    assert page_texts(optimized) == page_texts(merged)
+    assert [x.get_data() for x in _images(optimized)] == [x.get_data() for x in _images(merged)]
+
+
+def test_is_idempotent_and_deterministic():
+    merged = _merge(pdf_bytes(2), image_to_pdf_page(image_bytes(1), "foto"))
+    once, _ = _optimize(merged)
+    assert _optimize(merged)[0] == once
+    twice, _ = _optimize(once)
+    assert len(twice) <= len(once)
+    assert _optimize(twice)[0] == twice
+
+
+def test_ascii_filters_are_removed(page_texts):
+    source = _a85_image_page()
+    optimized, _ = _optimize(source)
+    assert b"/ASCII85Decode" in source and b"/ASCII85Decode" not in optimized
+    assert len(optimized) < len(source) * 0.85
+    assert page_texts(optimized) == page_texts(source)
+    (before,), (after,) = _images(source), _images(optimized)
+    assert after["/Filter"] == "/DCTDecode"
+    assert after.get_data() == base64.a85decode(before._data, adobe=True)
+
+
+def test_identical_images_from_different_parts_are_written_once(page_texts):
+    # Páginas distintas (otro título) con la misma foto: el merge copia la imagen dos veces
+    merged = _merge(image_to_pdf_page(image_bytes(1), "uno"), image_to_pdf_page(image_bytes(1), "dos"))
+    optimized, _ = _optimize(merged)
+    assert len(_images(merged)) == 2 and len(_images(optimized)) == 1
+    assert len(optimized) < len(merged) * 0.6
+    assert page_texts(optimized) == page_texts(merged)
+
+
+def test_paths_in_and_out(tmp_path, read_pages):
+    src, dst = tmp_path / "unido.pdf", tmp_path / "final.pdf"
+    src.write_bytes(_merge(pdf_bytes(2)))
+    steps = optimize_pdf(str(src), str(dst))
+    assert dst.stat().st_size == steps[-1].bytes_out
+    assert len(read_pages(str(dst))) == 2
+
+
+def test_target_bytes_lowers_image_quality_until_it_fits(read_pages):
+    merged = _merge(pdf_bytes(1), image_to_pdf_page(image_bytes(2), "foto"))
+    lossless, _ = _optimize(merged)
+    target = int(len(lossless) * 0.8)
+    optimized, steps = _optimize(merged, target_bytes=target)
+    assert steps[-1].step == "quality" and steps[-1].bytes_out == len(optimized) <= target
+    assert [s.quality for s in steps if s.step == "quality"] == list(TARGET_QUALITIES[:len(steps) - 3])
+    assert len(read_pages(optimized)) == 2
+
+
+def test_unreachable_target_reports_every_step():
+    merged = _merge(image_to_pdf_page(image_bytes(2), "foto"))
+    optimized, steps = _optimize(merged, target_bytes=1000)
+    assert [s.quality for s in steps if s.step == "quality"] == list(TARGET_QUALITIES)
+    sizes = [s.bytes_out for s in steps[2:]]
+    assert sizes == sorted(sizes, reverse=True)
+    assert steps[-1].bytes_out == len(optimized) > 1000
+
+
+def test_target_without_images_only_writes_once():
+    optimized, steps = _optimize(_merge(pdf_bytes(2)), target_bytes=1000)
+    assert [s.step for s in steps] == ["read", "dedup", "write"]
+    assert len(optimized) > 1000
+
+
+def test_trace_gets_a_span_per_step():
+    class Trace:
+        def __init__(self):
+            self.spans = []
+
+        def add(self, name, seconds, **attrs):
+            self.spans.append((name, attrs))
+
+    trace = Trace()
+    _, steps = _optimize(_merge(pdf_bytes(1)), trace=trace)
+    assert [(name, attrs["step"]) for name, attrs in trace.spans] == [("optimize_step", s.step) for s in steps]
+
+
+@pytest.mark.parametrize("kwargs", [{"optimize": True}, {"target_bytes": 10**9}])
+def test_build_with_optimize(kwargs, page_texts):
+    def uploads():
+        return [Upload("foto.jpg", image_bytes(1)), Upload("labs.pdf", pdf_bytes(2))]
+
+    plain = build_pdf_with_attachments(minimal_data(), uploads())
+    optimized = build_pdf_with_attachments(minimal_data(), uploads(), **kwargs)
+    assert len(optimized) < len(plain)
+    assert b"/Type /XRef" in optimized and b"/Type /XRef" not in plain
+    # La fecha de generación cambia entre renders; solo se comparan los anexos
+    assert page_texts(optimized)[1:] == page_texts(plain)[1:]
@@ -0,0 +1,87 @@
+import io
+import re
+import time
+
+import pytest
+from PyPDF2 import PdfReader
+
+from benchmarks.fixtures import Upload, image_bytes, pdf_bytes
+from ficha.errors import AttachmentError
+from ficha.merge import PageMerger
+from ficha.pages import page_count, parse_pages
+from ficha.pdf import build_base_pdf, build_pdf_with_attachments
+
+CORRUPT_PDF = b"%PDF-1.4\n" + bytes(range(256)) * 20
+
+
+@pytest.mark.parametrize("spec, expected", [
+    (None, None),
+    ("", None),
+    (" Todas ", None),
+    ("1", [0]),
+    ("1-3,7", [0, 1, 2, 6]),
+    ("7,1-3", [6, 0, 1, 2]),
+    ("última", [9]),
+    ("Ultima", [9]),
+    ("u", [9]),
+    ("5-última", [4, 5, 6, 7, 8, 9]),
+    ("8-", [7, 8, 9]),
+    ("-2", [0, 1]),
+    (" 2 - 3 , 3 , 2 ", [1, 2]),
+])
+def test_parse_pages(spec, expected):
+    assert parse_pages(spec, 10) == expected
+
+
+@pytest.mark.parametrize("spec, message", [
+    ("0", "la página 0 no existe (el PDF tiene 10)"),
+    ("11", "la página 11 no existe"),
+    ("3-1", "rango invertido '3-1'"),
+    ("1,,2", "no se entiende ''"),
+    ("1-2-3", "no se entiende '1-2-3'"),
+    ("dos", "'dos' no es un número de página"),
+])
+def test_parse_pages_errors(spec, message):
+    with pytest.raises(ValueError, match=re.escape(message)):
+        parse_pages(spec, 10)
+
+
+def test_parse_pages_is_linear():
+    t0 = time.perf_counter()
+    assert len(parse_pages("1-20000," * 20 + "1-20000", 20000)) == 20000
+    assert time.perf_counter() - t0 < 1.0
+
+
+def test_page_count(tmp_path):
+    path = tmp_path / "labs.pdf"
+    path.write_bytes(pdf_bytes(7))
+    assert page_count(pdf_bytes(7)) == page_count(str(path)) == 7
+    with pytest.raises(AttachmentError, match="PDF inválido"):
+        page_count(CORRUPT_PDF, "dañado.pdf")
+
+
+def test_selection_in_the_final_pdf():
+    base_pages = len(PdfReader(io.BytesIO(build_base_pdf({}))).pages)
+    uploads = [Upload("labs.pdf", pdf_bytes(5)), Upload("foto.jpg", image_bytes(1)),
+               Upload("labs.pdf", pdf_bytes(5))]
+    pdf = build_pdf_with_attachments({}, uploads, pages=["2-3", "1", "última"])
+    # Las imágenes ignoran la selección
+    assert len(PdfReader(io.BytesIO(pdf)).pages) == base_pages + 2 + 1 + 1
+
+
+def test_selection_errors_name_the_attachment():
+    with pytest.raises(AttachmentError) as excinfo:
+        build_pdf_with_attachments({}, [Upload("labs.pdf", pdf_bytes(2))], pages=["5"])
+    assert excinfo.value.name == "labs.pdf"
+    assert excinfo.value.reason == "selección de páginas: la página 5 no existe (el PDF tiene 2)"
+
+
+def test_overlapping_selections_of_one_document_share_pages():
+    out = io.BytesIO()
+    merger = PageMerger(out)
+    first = merger.add(pdf_bytes(4), "a.pdf", pages="1-2")
+    second = merger.add(pdf_bytes(4), "a.pdf", pages="2-3")
+    merger.close()
+    assert (first.pages, second.pages) == (2, 2)
+    assert not first.duplicate and not second.duplicate
+    assert len(PdfReader(io.BytesIO(out.getvalue()), strict=True).pages) == 4
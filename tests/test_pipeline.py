@@ -0,0 +1,75 @@
+import io
+
+import pytest
+
+from benchmarks.fixtures import Upload, image_bytes, maximal_data, minimal_data, pdf_bytes
+from ficha.pdf import (
+    build_base_pdf, build_pdf_with_attachments, image_to_pdf_page, merge_pdfs, write_pdf_with_attachments,
+)
+
+
+def _uploads():
+    return [Upload("foto.jpg", image_bytes(2)), Upload("labs.pdf", pdf_bytes(3)),
+            Upload("captura.png", image_bytes(0.3, "PNG"))]
+
+
+def test_base_pdf_is_readable(read_pages):
+    assert len(read_pages(build_base_pdf(minimal_data()))) >= 1
+    assert len(read_pages(build_base_pdf(maximal_data()))) >= 2
+
+
+def test_invariant_base_is_byte_identical():
+    data = maximal_data()
+    a = build_base_pdf(data, generated_at="—", invariant=True)
+    b = build_base_pdf(data, generated_at="—", invariant=True)
+    assert a == b
+
+
+def test_image_page_has_one_page(read_pages):
+    assert len(read_pages(image_to_pdf_page(image_bytes(2), "foto.jpg"))) == 1
+
+
+def test_merge_pdfs_keeps_order(read_pages, page_texts):
+    base = build_base_pdf(minimal_data(), generated_at="—")
+    merged = merge_pdfs([base, pdf_bytes(2)])
+    assert len(read_pages(merged)) == len(read_pages(base)) + 2
+    assert page_texts(merged)[0] == page_texts(base)[0]
+
+
+@pytest.mark.parametrize("workers", [None, 2])
+def test_attachments_are_appended_in_upload_order(workers, read_pages):
+    data = maximal_data()
+    base_pages = len(read_pages(build_base_pdf(data)))
+    pdf = build_pdf_with_attachments(data, _uploads(), workers=workers)
+    pages = read_pages(pdf)
+    # ficha + 1 página por imagen + las 3 del PDF anexo
+    assert len(pages) == base_pages + 1 + 3 + 1
+    # Las imágenes quedan como una sola imagen por página
+    image_page = pages[base_pages]
+    assert len(image_page["/Resources"]["/XObject"]) == 1
+
+
+def test_spooled_and_in_memory_outputs_match(read_pages, page_texts):
+    data = minimal_data()
+    a = build_pdf_with_attachments(data, _uploads(), spool_threshold=None)
+    b = build_pdf_with_attachments(data, _uploads(), spool_threshold=1)
+    assert page_texts(a) == page_texts(b)
+
+
+def test_writes_to_a_path(tmp_path, read_pages):
+    out = tmp_path / "ficha.pdf"
+    assert write_pdf_with_attachments(str(out), minimal_data(), _uploads()) == []
+    assert len(read_pages(str(out))) >= 5
+
+
+def test_uploads_are_not_consumed():
+    uploads = _uploads()
+    build_pdf_with_attachments(minimal_data(), uploads)
+    assert [uf.getvalue() for uf in uploads] == [uf.getvalue() for uf in _uploads()]
+
+
+def test_output_stream_is_written_in_place():
+    out = io.BytesIO(b"prefijo")
+    out.seek(0, io.SEEK_END)
+    write_pdf_with_attachments(out, minimal_data(), [])
+    assert out.getvalue().startswith(b"prefijo%PDF")
@@ -0,0 +1,108 @@
+import threading
+import time
+
+import pytest
+
+import ficha.prepare
+from benchmarks.fixtures import Upload, image_bytes, pdf_bytes
+from ficha.cache import ByteLRUCache
+from ficha.metrics import Registry, Trace
+from ficha.pdf import build_pdf_with_attachments
+from ficha.prepare import FAILED, PENDING, READY, Preconverter
+
+
+def _upload(name, data, file_id):
+    uf = Upload(name, data)
+    uf.file_id = file_id
+    return uf
+
+
+def _wait(pre, key):
+    pre.get(key)
+    return pre.status(key)
+
+
+@pytest.mark.parametrize("workers", [None, 2])
+def test_images_are_converted_ahead_of_the_render(workers):
+    pre = Preconverter(workers=workers)
+    photo = _upload("foto.jpg", image_bytes(2), "f1")
+    labs = _upload("labs.pdf", pdf_bytes(2), "f2")
+    key = pre.submit(photo)
+    assert key is not None and pre.submit(labs) is None
+    assert _wait(pre, key)[0] == READY and pre.pending() == 0
+    trace = Trace(registry=Registry(), memory=False)
+    build_pdf_with_attachments({}, [photo, labs], cache=pre, trace=trace)
+    cache_span = next(row for row in trace.rows() if row["stage"] == "cache")
+    assert cache_span["hits"] == 1
+    assert not [row for row in trace.rows() if row["stage"] == "convert_attachment" and row["kind"] == "image"]
+
+
+def test_uploads_are_sniffed_not_trusted_by_name():
+    pre = Preconverter()
+    assert pre.submit(_upload("foto.pdf", image_bytes(1), "f1")) is not None
+    assert pre.submit(_upload("labs.jpg", pdf_bytes(1), "f2")) is None
+
+
+def test_key_is_hashed_once_per_file_id(monkeypatch):
+    calls = []
+    real = ficha.prepare.upload_hash
+    monkeypatch.setattr(ficha.prepare, "upload_hash", lambda uf: calls.append(uf) or real(uf))
+    pre = Preconverter()
+    photo = _upload("foto.jpg", image_bytes(1), "f1")
+    keys = {pre.submit(photo) for _ in range(5)}
+    assert len(keys) == 1 and len(calls) == 1
+
+
+def test_invalid_images_fail_with_a_reason():
+    pre = Preconverter()
+    key = pre.submit(_upload("truncada.jpg", image_bytes(4)[:20000], "f1"))
+    assert pre.get(key) is None
+    status, detail = pre.status(key)
+    assert status == FAILED and detail.startswith("imagen inválida")
+
+
+def test_shared_cache_is_filled_and_reused():
+    cache = ByteLRUCache(8 * 1024 * 1024)
+    photo = _upload("foto.jpg", image_bytes(1), "f1")
+    first = Preconverter(cache=cache)
+    key = first.submit(photo)
+    _wait(first, key)
+    # El caché se llena en el callback del future, que puede correr justo después
+    deadline = time.monotonic() + 10
+    while key not in cache and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert key in cache
+    second = Preconverter(cache=cache)
+    assert second.submit(photo) == key
+    assert second.status(key) == (READY, "en caché")
+    assert second.get(key) == cache.get(key)
+
+
+def test_retain_forgets_removed_uploads():
+    pre = Preconverter()
+    a = pre.submit(_upload("a.jpg", image_bytes(1), "fa"))
+    b = pre.submit(_upload("b.png", image_bytes(0.3, "PNG"), "fb"))
+    pre.submit(_upload("c.pdf", pdf_bytes(1), "fc"))
+    pre.retain([a])
+    assert set(pre._jobs) == {a} and b not in pre._keys.values()
+    # Los no imagen se recuerdan (no se vuelven a leer)
+    assert pre._keys["fc"] is None
+
+
+def test_render_does_not_wait_forever_for_a_stuck_conversion(monkeypatch, read_pages):
+    release = threading.Event()
+    monkeypatch.setattr(ficha.prepare, "_convert", lambda *args: release.wait(30) and b"")
+    monkeypatch.setattr(ficha.prepare, "BUDGET_GRACE", 0)
+    pre = Preconverter(seconds=0.3)
+    photo = _upload("foto.jpg", image_bytes(1), "f1")
+    key = pre.submit(photo)
+    try:
+        t0 = time.perf_counter()
+        assert pre.get(key) is None
+        # El render convierte por su cuenta en vez de esperar al hilo atorado
+        pdf = build_pdf_with_attachments({}, [photo], cache=pre)
+        assert time.perf_counter() - t0 < 10
+        assert len(read_pages(pdf)) >= 2
+        assert pre.status(key)[0] == PENDING
+    finally:
+        release.set()
@@ -0,0 +1,73 @@
+import json
+import os
+import pstats
+import threading
+
+from benchmarks.fixtures import Upload, image_bytes, maximal_data
+from ficha.pdf import build_pdf_with_attachments
+from ficha.profiling import RenderProfiler, collapsed_stacks, input_tags
+
+
+def _uploads():
+    return [Upload("foto.jpg", image_bytes(2)), Upload("captura.png", image_bytes(0.3, "PNG"))]
+
+
+def test_inactive_profiler_does_nothing(tmp_path, monkeypatch):
+    monkeypatch.delenv("FICHA_PROFILE", raising=False)
+    with RenderProfiler(out_dir=str(tmp_path)) as prof:
+        pass
+    assert not prof and prof.saved == [] and os.listdir(tmp_path) == []
+
+
+def test_fast_renders_are_not_saved(tmp_path, monkeypatch):
+    monkeypatch.setenv("FICHA_PROFILE", "1")
+    with RenderProfiler(threshold=60, out_dir=str(tmp_path), sample=1) as prof:
+        sum(range(1000))
+    assert prof and prof.seconds > 0 and prof.saved == []
+
+
+def test_only_a_sample_of_renders_is_profiled(tmp_path, monkeypatch):
+    monkeypatch.setenv("FICHA_PROFILE", "1")
+    assert not RenderProfiler(out_dir=str(tmp_path), sample=0)
+    active = sum(bool(RenderProfiler(out_dir=str(tmp_path), sample=0.2)) for _ in range(1000))
+    assert 100 < active < 300
+    # Un perfil forzado no depende de la muestra
+    assert RenderProfiler(out_dir=str(tmp_path), force=True, sample=0)
+
+
+def test_forced_profile_is_saved_without_patient_data(tmp_path):
+    data = maximal_data(meds=3)
+    data["Nombre completo"] = "Ana Pérez"
+    tags = input_tags(data, _uploads())
+    with RenderProfiler(tags=tags, out_dir=str(tmp_path), force=True) as prof:
+        build_pdf_with_attachments(data, _uploads())
+    assert sorted(os.path.splitext(p)[1] for p in prof.saved) == [".collapsed", ".json", ".pstats"]
+    with open(prof.saved[2], encoding="utf-8") as f:
+        meta = json.load(f)
+    assert meta["anexos"] == 2 and meta["anexos_tipos"] == {"image": 2} and meta["medicamentos"] == 3
+    assert meta["anexos_bytes"] == sum(uf.size for uf in _uploads())
+    assert "Ana Pérez" not in json.dumps(meta, ensure_ascii=False)
+    assert pstats.Stats(prof.saved[0]).total_tt > 0
+
+
+def test_collapsed_stacks_format(tmp_path):
+    with RenderProfiler(out_dir=str(tmp_path), force=True) as prof:
+        build_pdf_with_attachments({}, _uploads())
+    lines = collapsed_stacks(pstats.Stats(prof.saved[0]))
+    assert lines and all(int(line.rsplit(" ", 1)[1]) >= 1 for line in lines)
+    assert any("images.py" in line and "downsample_image" in line for line in lines)
+
+
+def test_inline_conversions_are_profiled_outside_the_main_thread(tmp_path):
+    # Como en una sesión de Streamlit: el render corre en otro hilo
+    result = {}
+
+    def render():
+        with RenderProfiler(out_dir=str(tmp_path), force=True) as prof:
+            build_pdf_with_attachments({}, _uploads())
+        result["stacks"] = collapsed_stacks(pstats.Stats(prof.saved[0]))
+
+    thread = threading.Thread(target=render)
+    thread.start()
+    thread.join()
+    assert any("downsample_image" in line for line in result["stacks"])
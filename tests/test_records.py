@@ -0,0 +1,139 @@
+import io
+import json
+
+import pytest
+
+import ficha.records
+from ficha.batch import run
+from ficha.records import RecordStore, get_record_store, normalize_curp, normalize_name, normalize_phone
+
+CURP = "PELJ800101HDFRPN09"
+
+
+class _Clock:
+    """Reemplazo de `time` que avanza un segundo en cada lectura (fichas en orden)."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        self.now += 1
+        return self.now
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(ficha.records, "time", _Clock())
+    return RecordStore(str(tmp_path / "fichas.sqlite"))
+
+
+def _patient(name="José Pérez López", curp=CURP, phone="+52 (55) 1234-5678", **extra):
+    return {"Nombre completo": name, "CURP": curp, "Teléfono del paciente": phone, **extra}
+
+
+def test_normalization():
+    assert normalize_name("  José  Pérez-López ") == "jose perez lopez"
+    assert normalize_name(None) == ""
+    assert normalize_phone("+52 (55) 1234-5678") == "5512345678"
+    assert normalize_phone("") == ""
+    assert normalize_curp(" pelj 800101hdfrpn09 ") == CURP
+
+
+def test_save_and_load_round_trip(store):
+    data = _patient(Medicamentos=[{"nombre": "Metformina", "dosis": "850 mg"}], Anexos=["bh.pdf"])
+    rid = store.save(data)
+    assert store.load(rid) == data
+    assert store.load(rid + 1) is None
+    assert store.count() == 1
+
+
+def test_search_by_curp_name_and_phone(store):
+    rid = store.save(_patient())
+    other = store.save(_patient("María Gómez", "GOMM900202MDFMRR01", "5598765432",
+                                **{"Teléfono de contacto": "55 1234 5678"}))
+
+    assert [r["id"] for r in store.search(CURP.lower())] == [rid]
+    # Prefijo del nombre sin acentos ni mayúsculas
+    assert [r["id"] for r in store.search("jose pér")] == [rid]
+    # El teléfono del paciente o el de contacto; las más recientes primero
+    assert [r["id"] for r in store.search("55-1234-5678")] == [other, rid]
+    assert store.search("") == [] and store.search("  ¿? ") == []
+
+    summary = store.search("maria")[0]
+    assert summary["nombre"] == "María Gómez" and summary["curp"] == "GOMM900202MDFMRR01"
+    assert summary["telefono"] == "5598765432"
+
+
+def test_search_free_text(store):
+    rid = store.save(_patient(**{"Alergias": "Penicilina", "Medicamentos": [{"nombre": "Losartán"}]}))
+    store.save(_patient("Ana Ruiz", "RUIA750303MDFZNN02", "5511112222"))
+    assert [r["id"] for r in store.search("penicil")] == [rid]
+    assert [r["id"] for r in store.search("losartan")] == [rid]
+    # Apellido en medio del nombre: no es prefijo de name_norm, lo encuentra FTS
+    assert [r["id"] for r in store.search("perez")] == [rid]
+    # Los signos no se leen como sintaxis de FTS5
+    assert [r["id"] for r in store.search('penicil*"(')] == [rid]
+
+
+def test_common_name_returns_the_newest(store):
+    # "Ana Ruiz" va después de "Ana Aguilar" en orden alfabético, pero es más reciente
+    old = [store.save(_patient(f"Ana Aguilar {i}", None, "")) for i in range(5)]
+    new = [store.save(_patient(f"Ana Ruiz {i}", None, "")) for i in range(5)]
+    assert [r["id"] for r in store.search("ana", limit=5)] == new[::-1]
+    assert [r["id"] for r in store.search("ana", limit=7)] == new[::-1] + old[:-3:-1]
+
+
+def test_newer_free_text_match_is_not_skipped(store):
+    # El prefijo del nombre llena el límite, pero hay una ficha más reciente que solo
+    # coincide por texto completo (apellido en medio)
+    names = [store.save(_patient(f"Luis Gómez {i}", None, "")) for i in range(3)]
+    middle = store.save(_patient("José Luis Pérez", None, ""))
+    assert [r["id"] for r in store.search("luis", limit=3)] == [middle, names[2], names[1]]
+    assert [r["id"] for r in store.search("luis g", limit=3)] == names[::-1]
+
+
+def test_latest_by_curp_picks_newest(store):
+    store.save(_patient(Alergias="ninguna"))
+    store.save(_patient(Alergias="penicilina"))
+    store.save(_patient("Otra", "RUIA750303MDFZNN02"))
+    assert store.latest_by_curp(CURP.lower())["Alergias"] == "penicilina"
+    assert store.latest_by_curp("XXXX000000XXXXXX00") is None
+
+
+def test_save_many_in_batches(store):
+    records = (_patient(f"Paciente {i}", None, f"55000{i:05d}") for i in range(25))
+    assert store.save_many(records, batch=10) == 25
+    assert store.count() == 25
+    assert store.save_many([], batch=10) == 0
+    assert [r["nombre"] for r in store.search("paciente", limit=3)] == ["Paciente 24", "Paciente 23", "Paciente 22"]
+    assert [r["nombre"] for r in store.search("paciente 2")] == [f"Paciente {i}" for i in (24, 23, 22, 21, 20, 2)]
+
+
+def test_failed_batch_rolls_back(store):
+    def records():
+        yield _patient()
+        raise RuntimeError("corte")
+
+    with pytest.raises(RuntimeError):
+        store.save_many(records())
+    assert store.count() == 0
+
+
+def test_get_record_store_follows_env(tmp_path, monkeypatch):
+    monkeypatch.delenv("FICHA_RECORDS_DB", raising=False)
+    assert get_record_store() is None
+    monkeypatch.setenv("FICHA_RECORDS_DB", str(tmp_path / "a.sqlite"))
+    store = get_record_store()
+    assert store is get_record_store() and store.path == str(tmp_path / "a.sqlite")
+    monkeypatch.setenv("FICHA_RECORDS_DB", str(tmp_path / "b.sqlite"))
+    assert get_record_store().path == str(tmp_path / "b.sqlite")
+
+
+def test_batch_saves_generated_records(tmp_path, store):
+    lines = [{"id": "a", "data": _patient()}, {"id": "b", "data": _patient("Ana Ruiz", None, "")}, "no es json"]
+    path = tmp_path / "registros.jsonl"
+    path.write_text("\n".join(x if isinstance(x, str) else json.dumps(x) for x in lines), encoding="utf-8")
+    failed = run(str(path), str(tmp_path / "salida"), jobs=1, records=store, out=io.StringIO(), err=io.StringIO())
+    assert failed == 1
+    assert store.count() == 2
+    assert store.latest_by_curp(CURP)["Nombre completo"] == "José Pérez López"
@@ -0,0 +1,127 @@
+import threading
+
+import pytest
+
+from ficha.jobs import DONE, ProgressTrace, RenderJob
+from ficha.metrics import Registry
+from ficha.scheduler import BASE_COST, RenderScheduler, SchedulerBusy
+
+MB = 1024 * 1024
+
+
+def _states(*tickets):
+    return [t.state for t in tickets]
+
+
+def test_at_most_max_running():
+    s = RenderScheduler(max_running=2)
+    a, b, c = (s.submit(session) for session in "abc")
+    assert _states(a, b, c) == ["running", "running", "queued"]
+    assert (a.position, c.position) == (0, 1)
+    a.release()
+    assert c.state == "running" and c.waited >= 0
+    assert s.stats()["running"] == 2 and s.stats()["queued"] == 0
+
+
+def test_admission_by_memory():
+    s = RenderScheduler(max_running=4, memory_budget=BASE_COST * 2 + 100 * MB)
+    big = s.submit("a", 60 * MB)
+    other = s.submit("b", 60 * MB)
+    assert _states(big, other) == ["running", "queued"]
+    assert s.stats()["running_bytes"] == BASE_COST + 60 * MB
+    big.release()
+    assert other.state == "running"
+
+
+def test_oversized_render_runs_alone():
+    s = RenderScheduler(max_running=4, memory_budget=10 * MB)
+    huge = s.submit("a", 500 * MB)
+    small = s.submit("b")
+    assert _states(huge, small) == ["running", "queued"]
+    huge.release()
+    assert small.state == "running"
+
+
+def test_small_renders_do_not_overtake_a_waiting_big_one():
+    s = RenderScheduler(max_running=4, memory_budget=BASE_COST * 3 + 100 * MB, max_queued=50)
+    first = s.submit("a", 50 * MB)
+    big = s.submit("b", 90 * MB)
+    small = s.submit("c", 1 * MB)
+    # `small` cabría en memoria, pero llegó después del grande que espera
+    assert _states(first, big, small) == ["running", "queued", "queued"]
+    assert (big.position, small.position) == (1, 2)
+    first.release()
+    assert _states(big, small) == ["running", "running"]
+
+
+def test_sessions_with_fewer_running_renders_go_first():
+    s = RenderScheduler(max_running=2)
+    first, second = s.submit("a"), s.submit("a")
+    again = s.submit("a")
+    newcomer = s.submit("b")
+    assert (newcomer.position, again.position) == (1, 2)
+    first.release()
+    # "a" aún tiene un render en curso: pasa "b" aunque llegó después
+    assert _states(second, newcomer, again) == ["running", "running", "queued"]
+
+
+def test_full_queue_rejects_immediately():
+    s = RenderScheduler(max_running=1, max_queued=2, memory_budget=BASE_COST * 4)
+    s.submit("a")
+    s.submit("b")
+    s.submit("c")
+    with pytest.raises(SchedulerBusy, match="hay 2 fichas en espera"):
+        s.submit("d")
+    s2 = RenderScheduler(max_running=1, memory_budget=BASE_COST * 3)
+    s2.submit("a")
+    s2.submit("b", BASE_COST)
+    with pytest.raises(SchedulerBusy, match="MB de anexos en espera"):
+        s2.submit("c", BASE_COST)
+    assert s.rejected == s2.rejected == 1
+
+
+def test_cancelled_wait_leaves_the_queue():
+    s = RenderScheduler(max_running=1)
+    running = s.submit("a")
+    queued = s.submit("b")
+    behind = s.submit("c")
+    assert queued.wait(cancelled=lambda: True, poll=0.01) is False
+    assert queued.state == "cancelled" and behind.position == 1
+    running.release()
+    assert behind.state == "running"
+
+
+def test_release_is_idempotent():
+    s = RenderScheduler(max_running=1)
+    t = s.submit("a")
+    t.release()
+    t.release()
+    assert t.state == "done" and s.stats() == {"running": 0, "queued": 0, "running_bytes": 0,
+                                               "queued_bytes": 0, "rejected": 0}
+
+
+def test_wait_blocks_until_a_slot_frees():
+    s = RenderScheduler(max_running=1)
+    running = s.submit("a")
+    queued = s.submit("b")
+    result = {}
+    waiter = threading.Thread(target=lambda: result.setdefault("admitted", queued.wait(poll=0.01)))
+    waiter.start()
+    waiter.join(timeout=0.1)
+    assert waiter.is_alive()
+    running.release()
+    waiter.join(timeout=10)
+    assert result == {"admitted": True}
+
+
+def test_job_waits_for_its_ticket():
+    s = RenderScheduler(max_running=1)
+    running = s.submit("a")
+    trace = ProgressTrace(0, registry=Registry())
+    job = RenderJob("k", lambda: "pdf", trace, ticket=s.submit("b"))
+    assert not job.wait(timeout=0.3)
+    assert trace.stage == "En cola (posición 1)"
+    running.release()
+    assert job.wait(timeout=10) and job.state == DONE and job.result == "pdf"
+    assert [row["stage"] for row in trace.rows()] == ["queue"]
+    assert s.stats()["running"] == 0
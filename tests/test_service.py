@@ -0,0 +1,137 @@
+import io
+import json
+import socket
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from benchmarks.fixtures import Upload, image_bytes, maximal_data, pdf_bytes
+from ficha.errors import AttachmentError
+from ficha.incremental import RenderMemo
+from ficha.pdf import build_base_pdf, write_pdf_with_attachments
+from ficha.scheduler import RenderScheduler, SchedulerBusy
+from ficha.service import RenderClient, RenderTimeout, serve
+
+CORRUPT_PDF = b"%PDF-1.4\n" + bytes(range(256)) * 20
+
+
+class _RecordingScheduler(RenderScheduler):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.sessions = []
+
+    def submit(self, session, attachment_bytes=0):
+        self.sessions.append(session)
+        return super().submit(session, attachment_bytes)
+
+
+@pytest.fixture(scope="module")
+def server():
+    srv = serve(0)
+    yield f"http://127.0.0.1:{srv.server_address[1]}"
+    srv.shutdown()
+    srv.server_close()
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    sched = _RecordingScheduler()
+    monkeypatch.setattr("ficha.service.get_scheduler", lambda: sched)
+    return sched
+
+
+def _closed_port_url():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{s.getsockname()[1]}"
+
+
+def _uploads():
+    return [Upload("foto.jpg", image_bytes(1)), Upload("labs.pdf", pdf_bytes(3))]
+
+
+def test_remote_pdf_matches_local(server, scheduler):
+    data = maximal_data(meds=3)
+    local = io.BytesIO()
+    base = build_base_pdf(data, generated_at="—", invariant=True)
+    write_pdf_with_attachments(local, data, _uploads(), base_pdf=base, pages=[None, "2-3"])
+    remote = io.BytesIO()
+    client = RenderClient(server)
+    assert client.write(remote, data, _uploads(), pages=[None, "2-3"], generated_at="—", invariant=True) == []
+    assert remote.getvalue() == local.getvalue()
+    # La conexión queda libre para el siguiente render
+    assert len(client._idle[client.servers[0].netloc]) == 1
+    client.close()
+
+
+def test_session_reaches_the_scheduler(server, scheduler):
+    memo = RenderMemo(remote=RenderClient(server), session="sesion-A")
+    memo.render({}, _uploads())
+    RenderClient(server).write(io.BytesIO(), {}, [])
+    assert scheduler.sessions == ["sesion-A", "127.0.0.1"]
+
+
+def test_invalid_attachment_is_reported(server, scheduler):
+    client = RenderClient(server)
+    with pytest.raises(AttachmentError) as excinfo:
+        client.write(io.BytesIO(), {}, [Upload("dañado.pdf", CORRUPT_PDF)])
+    assert excinfo.value.name == "dañado.pdf" and excinfo.value.reason.startswith("PDF inválido")
+    skipped = client.write(io.BytesIO(), {}, _uploads() + [Upload("dañado.pdf", CORRUPT_PDF)], skip_invalid=True)
+    assert [(e.name, e.reason.split(" ")[0]) for e in skipped] == [("dañado.pdf", "PDF")]
+
+
+def test_busy_servers_raise_scheduler_busy(server, monkeypatch):
+    sched = RenderScheduler(max_running=1, max_queued=1)
+    sched.submit("otra")
+    sched.submit("otra")
+    monkeypatch.setattr("ficha.service.get_scheduler", lambda: sched)
+    with pytest.raises(SchedulerBusy):
+        RenderClient([server, server]).write(io.BytesIO(), {}, _uploads())
+    assert sched.rejected == 2
+
+
+def test_fails_over_when_a_server_is_down(server, scheduler):
+    out = io.BytesIO()
+    RenderClient([_closed_port_url(), server], timeout=5).write(out, {}, [])
+    assert out.getvalue().startswith(b"%PDF")
+    with pytest.raises(ConnectionRefusedError):
+        RenderClient(_closed_port_url(), timeout=5).write(io.BytesIO(), {}, [])
+
+
+def test_no_failover_after_a_server_accepted_the_render(server, scheduler):
+    # Servidor que acepta la conexión y nunca contesta
+    hang = socket.socket()
+    hang.bind(("127.0.0.1", 0))
+    hang.listen()
+    accepted = []
+    threading.Thread(target=lambda: accepted.append(hang.accept()), daemon=True).start()
+    client = RenderClient([f"http://127.0.0.1:{hang.getsockname()[1]}", server], timeout=5, render_timeout=0.5)
+    try:
+        with pytest.raises(RenderTimeout):
+            client.write(io.BytesIO(), {}, _uploads())
+        assert scheduler.sessions == []  # el segundo servidor nunca recibió la petición
+    finally:
+        for conn, _ in accepted:
+            conn.close()
+        hang.close()
+
+
+@pytest.mark.parametrize("manifest", [
+    [], "texto", {"attachments": []}, {"data": [], "attachments": []}, {"data": {}, "attachments": {}},
+    {"data": {}, "attachments": [None]}, {"data": {}, "attachments": [{"name": "a.pdf", "size": "12"}]},
+    {"data": {}, "attachments": [{"name": "a.pdf", "size": 12, "pages": 3}]},
+], ids=["lista", "texto", "sin-data", "data-lista", "anexos-objeto", "anexo-null", "size-texto", "pages-numero"])
+def test_malformed_manifest_is_rejected(server, scheduler, manifest):
+    body = json.dumps(manifest).encode() + b"\n"
+    with pytest.raises(urllib.error.HTTPError) as excinfo:
+        urllib.request.urlopen(urllib.request.Request(f"{server}/render", data=body), timeout=10)
+    assert excinfo.value.code == 400
+    assert json.load(excinfo.value)["reason"].startswith("petición inválida")
+    assert scheduler.sessions == []
+
+
+def test_health(server, scheduler):
+    with urllib.request.urlopen(f"{server}/health", timeout=10) as resp:
+        assert json.load(resp) == scheduler.stats()
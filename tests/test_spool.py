@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+from benchmarks.fixtures import Upload, image_bytes
+from ficha.images import downsample_image
+from ficha.pdf import PathUpload
+from ficha.spool import Spool, is_spooled, part_size, read_part
+
+
+def test_small_uploads_stay_in_memory():
+    with Spool(threshold=10) as spool:
+        part = spool.add_upload(Upload("a.pdf", b"%PDF-1.4"))
+        assert part == b"%PDF-1.4" and not is_spooled(part)
+
+
+def test_large_uploads_go_to_disk():
+    data = b"x" * 100
+    with Spool(threshold=10) as spool:
+        part = spool.add_upload(Upload("Foto.JPG", data))
+        assert is_spooled(part) and part.startswith(spool.path) and part.endswith(".jpg")
+        assert read_part(part) == data and part_size(part) == 100
+    assert not os.path.exists(spool.path)
+
+
+def test_uploads_on_disk_are_not_copied(tmp_path):
+    path = tmp_path / "labs.pdf"
+    path.write_bytes(b"%PDF" * 100)
+    with Spool(threshold=10) as spool:
+        assert spool.add_upload(PathUpload(str(path))) == str(path)
+        assert os.listdir(spool.path) == []
+
+
+def test_new_paths_are_unique(tmp_path):
+    with Spool(dir=tmp_path) as spool:
+        assert spool.new_path() != spool.new_path(".png")
+        assert os.path.dirname(spool.path) == str(tmp_path)
+    assert os.listdir(tmp_path) == []
+
+
+
+def _open_fds(path):
+    fds = "/proc/self/fd"
+    return [fd for fd in os.listdir(fds) if os.path.realpath(os.path.join(fds, fd)) == str(path)]
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="requiere /proc")
+def test_spooled_image_is_closed_when_conversion_fails(tmp_path):
+    path = tmp_path / "truncada.jpg"
+    path.write_bytes(image_bytes(4)[:20000])
+    with pytest.raises(OSError) as excinfo:
+        downsample_image(str(path), 504, 666)
+    # El traceback sigue vivo (retiene los frames) y aun así el archivo ya se cerró
+    assert excinfo.traceback and _open_fds(path) == []
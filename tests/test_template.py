@@ -0,0 +1,184 @@
+import io
+
+import pytest
+from reportlab.lib.pagesizes import LETTER
+from reportlab.lib.utils import simpleSplit
+from reportlab.pdfgen import canvas
+
+from benchmarks.fixtures import maximal_data, minimal_data
+from ficha.pdf import build_base_pdf
+from ficha.template import (
+    BOTTOM,
+    COL_W,
+    FIELD_FONT,
+    FIELD_SIZE,
+    GUTTER,
+    FIELD_LEADING,
+    LEFT,
+    MAX_W,
+    MIN_LINES,
+    TOP,
+    Label,
+    compile_template,
+    layout,
+    render_ficha,
+    _Renderer,
+    wrap_field,
+)
+
+LONG_TEXT = "Hipertensión arterial sistémica de larga evolución con control irregular. " * 120
+
+
+class _SpyCanvas:
+    """Canvas que solo anota qué texto se dibuja, dónde y en qué página."""
+
+    def __init__(self):
+        self.pages = [[]]
+        self.saved = 0
+
+    def drawString(self, x, y, text):
+        self.pages[-1].append((x, y, text))
+
+    def showPage(self):
+        self.saved += 1
+        self.pages.append([])
+
+    def setFont(self, *args):
+        pass
+
+    def setFillColorRGB(self, *args):
+        pass
+
+    def setLineWidth(self, *args):
+        pass
+
+    def line(self, *args):
+        pass
+
+
+def _render(data, columns=False):
+    c = _SpyCanvas()
+    pages = render_ficha(c, data, "hoy", columns=columns)
+    assert c.pages.pop() == []  # render_ficha termina con showPage
+    assert pages == c.saved == len(c.pages)
+    return c.pages
+
+
+def _section_titles(data):
+    return [box[1] for box in layout(data) if box[0] == "section"]
+
+
+def _field_lines(boxes):
+    return [line for box in boxes if box[0] == "field" for line in box[1]]
+
+
+def test_template_is_compiled_once():
+    assert compile_template() is compile_template()
+
+
+@pytest.mark.parametrize("value", ["Sí", "", None, "palabra " * 60, "uno\ndos\n\ntres",
+                                   "https://ejemplo.com/" + "x" * 200])
+def test_wrap_field_matches_simple_split(value):
+    label = "Cirugías / hospitalizaciones importantes"
+    expected = simpleSplit(f"{label}: {value if value not in (None, '') else '—'}", FIELD_FONT, FIELD_SIZE, MAX_W)
+    assert list(wrap_field(Label(label), value)) == expected
+
+
+def test_obstetric_block_only_for_women():
+    block = "1B) Antecedentes gineco-obstétricos (si aplica)"
+    assert block in _section_titles({"Sexo": "Femenino"})
+    assert block not in _section_titles({"Sexo": "Masculino"}) and block not in _section_titles({})
+
+
+def test_medications_and_attachments_get_one_field_each():
+    data = maximal_data(meds=4, anexos=3)
+    lines = _field_lines(layout(data))
+    assert sum(line.startswith("Medicamento ") for line in lines) == 4
+    assert [line for line in lines if line.startswith("Archivo:")] == [
+        f"Archivo: analisis_{i}.pdf" for i in range(3)]
+
+
+def test_empty_values_render_as_dash():
+    lines = _field_lines(layout({}))
+    assert "Medicamentos: —" in lines and "Anexos: —" in lines
+    assert "Enfermedades diagnosticadas: —" in lines
+
+
+def test_base_pdf_contains_the_values(page_texts):
+    data = {"Nombre completo": "Ana Pérez", "Contacto de emergencia": "Luis", "Medicamentos": [
+        {"nombre": "Losartán", "dosis": "50 mg", "frecuencia": "c/12h", "para_que": "presión"}]}
+    text = "\n".join(page_texts(build_base_pdf(data, generated_at="2026-01-02")))
+    assert "Generado: 2026-01-02" in text
+    assert "Nombre completo: Ana Pérez" in text
+    assert "Medicamento 1: Losartán | 50 mg | c/12h | presión" in text
+
+
+_LAYOUTS = {
+    "minima": minimal_data(),
+    "maxima": maximal_data(meds=20, anexos=10),
+    "campo_largo": {**minimal_data(), "Otros relevantes": LONG_TEXT},
+    "mujer": {**maximal_data(meds=8, seed=3), "Sexo": "Femenino"},
+}
+
+
+@pytest.mark.parametrize("columns", [False, True])
+@pytest.mark.parametrize("name", sorted(_LAYOUTS))
+def test_text_never_goes_below_the_margin(name, columns):
+    for page in _render(_LAYOUTS[name], columns):
+        assert page
+        assert all(BOTTOM <= y <= TOP for _, y, _ in page)
+
+
+@pytest.mark.parametrize("name", sorted(_LAYOUTS))
+def test_sections_are_not_orphaned(name):
+    data = _LAYOUTS[name]
+    titles = {box[1] for box in layout(data) if box[0] in ("section", "heading")}
+    pages = _render(data)
+    for page in pages[:-1]:
+        assert page[-1][2] not in titles
+
+
+def test_long_field_is_split_across_pages():
+    expected = list(wrap_field(Label("Otros relevantes"), LONG_TEXT))
+    pages = _render(_LAYOUTS["campo_largo"])
+    parts = [[text for _, _, text in page if text in expected] for page in pages]
+    parts = [part for part in parts if part]
+    assert len(parts) > 1
+    assert [line for part in parts for line in part] == expected
+    assert len(parts[0]) >= MIN_LINES
+
+
+def test_split_field_leaves_at_least_min_lines_on_each_page():
+    lines = list(wrap_field(Label("Otros relevantes"), LONG_TEXT))
+    # Cada punto de arranque posible cerca del margen inferior
+    for tenth in range(0, int(4 * FIELD_LEADING * 10)):
+        c = _SpyCanvas()
+        r = _Renderer(c)
+        r.y = start = BOTTOM + tenth / 10
+        r.flow([("field", lines, False)])
+        parts = [len(page) for page in c.pages if page]
+        assert sum(parts) == len(lines)
+        assert min(parts) >= MIN_LINES, start
+
+
+def test_page_count_matches_the_pdf(read_pages):
+    for data in _LAYOUTS.values():
+        buf = io.BytesIO()
+        c = canvas.Canvas(buf, pagesize=LETTER)
+        pages = render_ficha(c, data, "hoy", columns=False)
+        c.save()
+        assert len(read_pages(buf.getvalue())) == pages
+    assert len(read_pages(build_base_pdf(_LAYOUTS["maxima"]))) == len(_render(_LAYOUTS["maxima"]))
+
+
+def test_two_columns_pair_short_fields():
+    data = _LAYOUTS["maxima"]
+    rows = [box for box in layout(data, columns=True) if box[0] == "row"]
+    assert rows and all(len(cell[0]) == 1 for row in rows for cell in row[1:])
+    pages = _render(data, columns=True)
+    assert any(x == LEFT + COL_W + GUTTER for page in pages for x, _, _ in page)
+    assert len(pages) <= len(_render(data))
+    # Mismas líneas de campo en ambos modos, solo acomodadas distinto
+    one = {text.split(":")[0] for page in _render(data) for _, _, text in page}
+    two = {text.split(":")[0] for page in pages for _, _, text in page}
+    assert one == two
@@ -0,0 +1,57 @@
+import pytest
+from reportlab.lib.utils import simpleSplit
+from reportlab.pdfbase.pdfmetrics import stringWidth
+
+from ficha.text import cache_info, clear_caches, split_state, string_width, wrap_continued, wrap_text
+
+TEXTS = [
+    "",
+    "No",
+    "hipertensión control diario con revisión mensual " * 8,
+    "línea uno\nlínea dos\n\n  espacios   dobles  ",
+    "supercalifragilisticoespialidoso" * 6,
+    "ñandú ¿qué? «comillas» — guiones – y acentos áéíóú ÁÉÍÓÚ",
+]
+
+
+@pytest.fixture(autouse=True)
+def _fresh_caches():
+    clear_caches()
+    yield
+    clear_caches()
+
+
+@pytest.mark.parametrize("text", TEXTS)
+@pytest.mark.parametrize("font, size, max_w", [("Helvetica", 10, 504), ("Helvetica-Bold", 12, 120),
+                                               ("Times-Roman", 9, 40)])
+def test_wrap_matches_simple_split(text, font, size, max_w):
+    assert list(wrap_text(text, font, size, max_w)) == simpleSplit(text, font, size, max_w)
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_string_width_matches_reportlab(text):
+    assert string_width(text, "Helvetica", 10) == pytest.approx(stringWidth(text, "Helvetica", 10), abs=1e-9)
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_continuing_a_measured_prefix(text):
+    state = split_state("Etiqueta larga de un campo:", "Helvetica", 10, 150)
+    expected = simpleSplit(f"Etiqueta larga de un campo: {text}", "Helvetica", 10, 150)
+    assert list(wrap_continued(state, text, "Helvetica", 10, 150)) == expected
+
+
+def test_repeated_texts_are_split_once():
+    for _ in range(5):
+        wrap_text("Sí", "Helvetica", 10, 504)
+        wrap_text("No sabe", "Helvetica", 10, 504)
+    info = cache_info()["wrap"]
+    assert (info["misses"], info["hits"]) == (2, 8)
+    # Los anchos por carácter se miden una vez por fuente
+    assert cache_info()["fonts"]["Helvetica"] == len(set("SíNo sabe"))
+
+
+def test_clear_caches_resets_everything():
+    wrap_text("texto", "Helvetica", 10, 504)
+    clear_caches()
+    info = cache_info()
+    assert info["wrap"]["currsize"] == info["words"]["currsize"] == 0 and info["fonts"] == {}
@@ -0,0 +1,277 @@
+import io
+import multiprocessing
+import os
+import re
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+from PIL import Image
+from PyPDF2 import PdfReader, PdfWriter
+
+import ficha.pdf
+from benchmarks.fixtures import Upload, image_bytes, minimal_data, pdf_bytes
+from ficha.errors import AttachmentError
+from ficha.metrics import Registry, Trace
+from ficha.validate import DEFAULT_LIMITS, budget, sniff_kind, validate_attachment
+from ficha.workers import get_process_pool
+
+CORRUPT_PDF = b"%PDF-1.4\n" + bytes(range(256)) * 20
+MB = 1024 * 1024
+
+
+def _png(size, mode="1") -> bytes:
+    out = io.BytesIO()
+    Image.new(mode, size).save(out, format="PNG")
+    return out.getvalue()
+
+
+def _pdf(pages=2, user_password=None, owner_password="dueño") -> bytes:
+    writer = PdfWriter()
+    for page in PdfReader(io.BytesIO(pdf_bytes(pages))).pages if pages else ():
+        writer.add_page(page)
+    if user_password is not None:
+        writer.encrypt(user_password, owner_password)
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+def _reason(name, source, **kwargs):
+    with pytest.raises(AttachmentError) as excinfo:
+        validate_attachment(name, source, **kwargs)
+    assert excinfo.value.name == name
+    return excinfo.value.reason
+
+
+# ----------------------------
+# Tipo
+# ----------------------------
+def test_sniff_kind():
+    assert sniff_kind(image_bytes(0.1)) == "image"
+    assert sniff_kind(_png((4, 4))) == "image"
+    assert sniff_kind(pdf_bytes(1)) == "pdf"
+    # Basura antes del encabezado (correos, escáneres): los lectores la toleran
+    assert sniff_kind(b"\r\nX-Mailer: algo\r\n" + pdf_bytes(1)) == "pdf"
+    assert sniff_kind(b"GIF89a" + bytes(100)) is None
+    assert sniff_kind(b"") is None
+
+
+def test_kind_comes_from_content_not_extension():
+    assert validate_attachment("foto.pdf", image_bytes(0.1)).kind == "image"
+    assert validate_attachment("labs.jpg", pdf_bytes(1)).kind == "pdf"
+    assert "no reconocido" in _reason("notas.pdf", b"texto plano" * 100)
+
+
+def test_accepts_bytes_memoryview_and_path(tmp_path):
+    path = tmp_path / "labs.pdf"
+    path.write_bytes(pdf_bytes(3))
+    infos = [validate_attachment("labs.pdf", src) for src in (pdf_bytes(3), memoryview(pdf_bytes(3)), str(path))]
+    assert {info.pages for info in infos} == {3}
+    image = image_bytes(0.5)
+    view = memoryview(image)
+    width, height = Image.open(io.BytesIO(image)).size
+    assert validate_attachment("foto.jpg", view) == ("image", "JPEG", width * height, None, False)
+    # La vista del llamador sigue usable (solo se libera la copia interna)
+    assert view[:3] == image[:3]
+
+
+# ----------------------------
+# Rechazos
+# ----------------------------
+def test_size_limit():
+    limits = DEFAULT_LIMITS._replace(max_bytes=1 * MB)
+    assert re.match(r"archivo de \d+ MB \(máximo 1 MB\)", _reason("grande.pdf", bytes(2 * MB), limits=limits))
+
+
+def test_corrupt_pdf():
+    assert _reason("dañado.pdf", CORRUPT_PDF).startswith("PDF inválido")
+
+
+def test_password_protected_pdf():
+    assert _reason("cifrado.pdf", _pdf(user_password="secreto")) == "PDF protegido con contraseña"
+    # Solo contraseña de propietario: se abre con la vacía
+    info = validate_attachment("permisos.pdf", _pdf(user_password=""))
+    assert info.encrypted and info.pages == 2
+
+
+def test_page_count_limits():
+    assert _reason("vacio.pdf", _pdf(pages=0)) == "el PDF no tiene páginas"
+    limits = DEFAULT_LIMITS._replace(max_pages=2)
+    assert _reason("largo.pdf", pdf_bytes(3), limits=limits) == "PDF de 3 páginas (máximo 2)"
+    assert validate_attachment("largo.pdf", pdf_bytes(3), limits=DEFAULT_LIMITS._replace(max_pages=0)).pages == 3
+
+
+def test_page_selection():
+    assert validate_attachment("labs.pdf", pdf_bytes(3), pages="2-última").pages == 3
+    assert _reason("labs.pdf", pdf_bytes(3), pages="5") == "selección de páginas: la página 5 no existe (el PDF tiene 3)"
+    assert _reason("labs.pdf", pdf_bytes(3), pages="3-1").startswith("selección de páginas: rango invertido")
+
+
+def test_png_over_the_pixel_limit_is_rejected():
+    limits = DEFAULT_LIMITS._replace(max_pixels=1_000_000)
+    bomb = _png((2000, 1000))
+    assert len(bomb) < 10_000
+    assert "posible bomba de descompresión" in _reason("bomba.png", bomb, limits=limits)
+    assert validate_attachment("bomba.png", bomb).pixels == 2_000_000
+
+
+def test_large_jpeg_is_accepted():
+    # libjpeg lo decodifica ya reducido (Image.draft)
+    info = validate_attachment("foto.jpg", image_bytes(2), limits=DEFAULT_LIMITS._replace(max_pixels=1_000_000))
+    assert info.format == "JPEG" and info.pixels > 1_000_000
+
+
+def test_pillow_bomb_limit(monkeypatch):
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 1000)
+    assert "bomba de descompresión" in _reason("bomba.png", _png((100, 100)))
+
+
+def test_broken_image_header():
+    assert _reason("foto.png", b"\x89PNG\r\n\x1a\n" + b"basura" * 50).startswith("imagen inválida")
+    assert _reason("foto.jpg", b"\xff\xd8\xff" + bytes(50)).startswith("imagen inválida")
+
+
+def test_validation_reads_only_headers():
+    # Datos dañados tras un encabezado válido no se detectan aquí sino al convertir
+    png = _png((200, 200), "RGB")
+    truncated = png[:len(png) // 2]
+    assert validate_attachment("foto.png", truncated).pixels == 40_000
+    with pytest.raises(AttachmentError, match="imagen inválida"):
+        ficha.pdf.convert_within_budget("foto.png", truncated, kind="image")
+
+
+# ----------------------------
+# Presupuesto
+# ----------------------------
+def test_budget_time_in_main_thread():
+    t0 = time.perf_counter()
+    with pytest.raises(AttachmentError) as excinfo:
+        with budget("lento.jpg", seconds=0.2):
+            time.sleep(5)
+    assert time.perf_counter() - t0 < 2
+    assert excinfo.value.reason == "tardó más de 0.2 s"
+    # La alarma se desactiva al salir
+    with budget("rapido.jpg", seconds=0.2):
+        pass
+    time.sleep(0.3)
+
+
+def test_budget_does_not_limit_the_server_process():
+    # Proceso principal (el de Streamlit): RLIMIT_AS limitaría a las demás sesiones
+    with budget("foto.jpg", memory=1 * MB):
+        data = bytearray(20 * MB)
+    assert len(data) == 20 * MB
+
+
+def _allocate(mb):
+    try:
+        with budget("foto.jpg", memory=50 * MB):
+            return len(bytearray(mb * MB))
+    except AttachmentError as e:
+        return e.reason
+
+
+def test_budget_memory_in_child_process():
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        assert pool.submit(_allocate, 10).result() == 10 * MB
+        assert pool.submit(_allocate, 500).result() == "necesitó más de 50 MB de memoria"
+        # Cada bloque aplica su tope y al salir lo quita: el worker sigue sirviendo
+        assert pool.submit(_allocate, 100).result() == "necesitó más de 50 MB de memoria"
+        assert pool.submit(_allocate, 10).result() == 10 * MB
+
+
+def _slow(*args, **kwargs):
+    time.sleep(3)
+    return b"", 0.0
+
+
+def test_inline_conversion_outside_main_thread_is_bounded(monkeypatch):
+    monkeypatch.setattr(ficha.pdf, "_convert_timed", _slow)
+    limits = DEFAULT_LIMITS._replace(seconds=0.5)
+    result = {}
+
+    def render():
+        t0 = time.perf_counter()
+        result["skipped"] = ficha.pdf.write_pdf_with_attachments(
+            io.BytesIO(), minimal_data(), [Upload("foto.jpg", image_bytes(0.5))], skip_invalid=True, limits=limits)
+        result["seconds"] = time.perf_counter() - t0
+
+    thread = threading.Thread(target=render)
+    thread.start()
+    thread.join()
+    assert [(e.name, e.reason) for e in result["skipped"]] == [("foto.jpg", "tardó más de 0.5 s")]
+    assert result["seconds"] < 2.5
+
+
+def test_crashed_worker_is_reported_and_the_pool_recreated(page_texts):
+    future = get_process_pool(2).submit(os._exit, 1)
+    with pytest.raises(AttachmentError, match="terminó inesperadamente"):
+        ficha.pdf._wait_converted(future, "foto.jpg", 10)
+    pdf = ficha.pdf.build_pdf_with_attachments(minimal_data(), [Upload("foto.jpg", image_bytes(0.5))], workers=2)
+    assert "foto.jpg" in page_texts(pdf)[-1]
+
+
+def test_attachment_is_retried_when_another_worker_crashed():
+    # Así queda un trabajo en cola cuando otro worker muere
+    victim = Future()
+    victim.set_exception(BrokenProcessPool("A child process terminated abruptly"))
+    assert ficha.pdf._wait_converted(victim, "foto.jpg", 10, lambda: get_process_pool(2).submit(abs, -4)) == 4
+    # Solo si vuelve a fallar en el pool nuevo se culpa al anexo
+    with pytest.raises(AttachmentError, match="también al reintentar"):
+        ficha.pdf._wait_converted(get_process_pool(2).submit(os._exit, 1), "bomba.png", 10,
+                                  lambda: get_process_pool(2).submit(os._exit, 1))
+
+
+# ----------------------------
+# En el render
+# ----------------------------
+def test_skip_invalid_in_the_pipeline(read_pages):
+    uploads = [Upload("dañado.pdf", CORRUPT_PDF), Upload("labs.pdf", pdf_bytes(2)),
+               Upload("notas.txt", b"solo texto" * 10), Upload("foto.jpg", image_bytes(0.5))]
+    with pytest.raises(AttachmentError, match="dañado.pdf"):
+        ficha.pdf.build_pdf_with_attachments(minimal_data(), uploads)
+    out = io.BytesIO()
+    skipped = ficha.pdf.write_pdf_with_attachments(out, minimal_data(), uploads, skip_invalid=True)
+    assert [e.name for e in skipped] == ["dañado.pdf", "notas.txt"]
+    base = len(read_pages(ficha.pdf.build_base_pdf(minimal_data())))
+    assert len(read_pages(out.getvalue())) == base + 2 + 1
+
+
+def test_pdfs_are_validated_in_the_pool(read_pages):
+    uploads = [Upload("labs.pdf", pdf_bytes(2)), Upload("dañado.pdf", CORRUPT_PDF),
+               Upload("foto.jpg", image_bytes(0.5)), Upload("rx.pdf", pdf_bytes(3))]
+    trace = Trace(registry=Registry(), memory=False)
+    out = io.BytesIO()
+    skipped = ficha.pdf.write_pdf_with_attachments(out, minimal_data(), uploads, workers=2, skip_invalid=True,
+                                                   trace=trace)
+    assert [(e.name, e.reason[:12]) for e in skipped] == [("dañado.pdf", "PDF inválido")]
+    assert [s.attrs["parallel"] for s in trace.spans if s.stage == "validate"] == [3]
+    base = len(read_pages(ficha.pdf.build_base_pdf(minimal_data())))
+    assert len(read_pages(out.getvalue())) == base + 2 + 1 + 3
+
+
+class _StuckPool:
+    """Pool falso: el primer trabajo falla y los demás quedan en cola."""
+
+    def __init__(self):
+        self.futures = []
+
+    def submit(self, fn, name, *args):
+        future = Future()
+        if not self.futures:
+            future.set_exception(AttachmentError(name, "imagen inválida"))
+        self.futures.append(future)
+        return future
+
+
+def test_failed_render_cancels_pending_conversions(monkeypatch):
+    pool = _StuckPool()
+    monkeypatch.setattr(ficha.pdf, "get_process_pool", lambda workers: pool)
+    uploads = [Upload(f"foto_{i}.jpg", image_bytes(0.1)) for i in range(4)]
+    with pytest.raises(AttachmentError, match="foto_0.jpg"):
+        ficha.pdf.build_pdf_with_attachments(minimal_data(), uploads, workers=2)
+    assert len(pool.futures) == 4
+    assert all(f.cancelled() for f in pool.futures[1:])
@@ -0,0 +1,20 @@
+import sys
+
+from benchmarks.bench_import import FORBIDDEN, importtime, startup_modules
+from ficha.warmup import import_pdf_stack, warm_up
+
+
+def test_startup_does_not_load_the_pdf_stack():
+    modules = startup_modules()
+    assert "streamlit" in modules
+    loaded = {name for name, _, _, _ in importtime(modules)}
+    assert not loaded & set(FORBIDDEN)
+
+
+def test_warm_up_loads_the_stack_in_the_background():
+    thread = warm_up(workers=2)
+    assert thread.daemon and thread.name == "ficha-warmup"
+    thread.join(timeout=120)
+    assert not thread.is_alive()
+    assert {"ficha.pdf", "reportlab", "PyPDF2", "PIL"} <= set(sys.modules)
+    assert import_pdf_stack()
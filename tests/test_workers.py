@@ -0,0 +1,29 @@
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from ficha.workers import default_workers, get_background_executor, get_process_pool
+
+
+@pytest.mark.parametrize("value, expected", [("3", 3), ("0", 1), ("-2", 1), ("", os.cpu_count() or 1),
+                                             ("muchos", os.cpu_count() or 1)])
+def test_default_workers(monkeypatch, value, expected):
+    monkeypatch.setenv("FICHA_WORKERS", value)
+    assert default_workers() == expected
+
+
+def test_pool_is_shared_per_size():
+    assert get_process_pool(2) is get_process_pool(2)
+    assert get_process_pool(2) is not get_process_pool(1)
+    assert get_background_executor() is get_background_executor()
+
+
+def test_broken_pool_is_replaced():
+    pool = get_process_pool(2)
+    future = pool.submit(os._exit, 1)
+    with pytest.raises(BrokenProcessPool):
+        future.result(timeout=60)
+    fresh = get_process_pool(2)
+    assert fresh is not pool
+    assert fresh.submit(abs, -4).result(timeout=60) == 4